@@ -33,7 +33,7 @@ class SpellinBloxPushDataCrafter:
         tag_word_details_list = []
         for tup in collection.toList():
             if len(tup) >= 3:
-                cur = cls.createTagWordDetailsDict(tup[0], tup[1], tup[3])
+                cur = cls.createTagWordDetailsDict(tup[0], tup[1], tup[2])
             elif len(tup) == 2:
                 cur = cls.createTagWordDetailsDict(tup[0], tup[1])
             else:
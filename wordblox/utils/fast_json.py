@@ -0,0 +1,107 @@
+"""
+    JSON encoding through the fastest encoder that is installed.
+
+    Two output styles are in use and each has to stay byte for byte what the stdlib produces:
+
+        COMPACT     DRF's JSONRenderer: no spaces, non-ASCII written as UTF-8
+        DEFAULT     Django's JsonResponse: ", " and ": " separators, non-ASCII escaped
+
+    orjson is used for the COMPACT style, it can not write the DEFAULT one. Everything else,
+    and any value the fast encoder refuses (big integers, non string keys and the like), goes
+    through the stdlib json module. FAST_JSON = False turns the fast encoder off.
+
+    The JsonInputHandler responses keep the DEFAULT style unless JSON_HANDLER_STYLE is set to
+    "compact", which changes their bytes (not their meaning) in exchange for the fast encoder.
+
+    The outputs only differ for floats that need an exponent, written as 1e20 and 1e-7 by
+    orjson instead of 1e+20 and 1e-07. None of the wordtag responses carry floats.
+"""
+import json
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError: # Optional, the stdlib is used without it
+    orjson = None
+
+COMPACT = "compact"
+DEFAULT = "default"
+
+
+def isEnabled():
+    return orjson != None and getattr(settings, "FAST_JSON", True)
+
+
+def fastDumps(data, encoder_class=DjangoJSONEncoder):
+    """
+        Encodes in the COMPACT style with orjson.
+
+        @return {bytes} The encoded value, or None if orjson is not in use or can not encode it
+    """
+    if not isEnabled():
+        return None
+    try:
+        # datetimes and dataclasses go through encoder_class so they are written the same way
+        return orjson.dumps(data, default=encoder_class().default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+    except TypeError: # orjson.JSONEncodeError is a TypeError
+        return None
+
+
+def _escapeLineTerminators(data):
+    # The same escaping of the two line terminators JSON allows in strings but JavaScript does
+    # not as JSONRenderer
+    return data.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+
+
+def dumps(data, style=DEFAULT, encoder_class=DjangoJSONEncoder):
+    """
+        @param  data    The value to encode
+        @param  {str}   style   COMPACT or DEFAULT
+        @param  encoder_class   The json.JSONEncoder whose default() handles the types JSON does not
+
+        @return {bytes}
+    """
+    if style == COMPACT:
+        ret = fastDumps(data, encoder_class)
+        if ret == None:
+            ret = json.dumps(data, cls=encoder_class, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return _escapeLineTerminators(ret)
+    return json.dumps(data, cls=encoder_class).encode("utf-8")
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+        JSONRenderer using dumps() for the default compact, unicode output. Indented output (as
+        asked for by the browsable API) and non default renderer settings go through DRF.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent != None or not self.compact or self.ensure_ascii or not self.strict:
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = fastDumps(data, self.encoder_class)
+        if ret == None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return _escapeLineTerminators(ret)
+
+
+class FastJsonResponse(JsonResponse):
+    """
+        JsonResponse whose content is encoded by dumps(), in the same style as JsonResponse unless
+        another one is given
+    """
+
+    def __init__(self, data, encoder=DjangoJSONEncoder, safe=True, json_dumps_params=None, style=DEFAULT, **kwargs):
+        if json_dumps_params:
+            # Custom parameters are only understood by the stdlib
+            super().__init__(data, encoder, safe, json_dumps_params, **kwargs)
+            return
+        if safe and not isinstance(data, dict):
+            raise TypeError("In order to allow non-dict objects to be serialized set the safe parameter to False.")
+        kwargs.setdefault("content_type", "application/json")
+        super(JsonResponse, self).__init__(content=dumps(data, style, encoder), **kwargs)
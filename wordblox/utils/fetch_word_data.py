@@ -1,4 +1,10 @@
-import requests
+"""
+    Client for the external SpellinBlox server.
+
+    requests is only imported once a FetchController is created, so processes that never talk
+    to the external server do not load it. The deprecated module level helpers live in
+    utils.legacy_fetch and are only loaded if one of them is used.
+"""
 import logging
 
 class ExternalServerFetchException(Exception):
@@ -56,7 +62,9 @@ class FetchController:
         """
             Constructor for the Fetch Controller. Creates a session to hold cookies and other session data for this connection.
         """
+        import requests # Loaded on first use, see the module docstring
         self.session = requests.Session()
+        self.payload_bytes = 0 # Size of the last response of getData
 
     def auth(self, username: str, password: str):
         """
@@ -83,12 +91,11 @@ class FetchController:
 
         if csrftoken:
             login_payload['csrfmiddlewaretoken'] = csrftoken
-            headers['Referer'] = LOGIN_URL
+            headers['Referer'] = self.__class__.LOGIN_URL
 
         login_response = self.session.post(self.__class__.LOGIN_URL, data=login_payload, headers=headers)
-        self.__class__.logger.error(login_response.status_code)
-        self.__class__.logger.error(f"URL is: {login_response.url} and {login_response.url == LOGIN_URL}")
-        if login_response.status_code not in [200, 302] or login_response.url == LOGIN_URL: 
+        self.__class__.logger.debug("Login status: %s, URL: %s", login_response.status_code, login_response.url)
+        if login_response.status_code not in [200, 302] or login_response.url == self.__class__.LOGIN_URL: 
             raise ExternalServerFetchException("ERROR: Login Failed", login_response.status_code)
         
     def getData(self, domain:str):
@@ -112,6 +119,7 @@ class FetchController:
         data_response = self.session.post(self.__class__.DATA_URL, headers=data_headers, json=data_payload)
         if not data_response.status_code == 200:
             raise ExternalServerFetchException("ERROR: Data could not be fetched", data_response.status_code)
+        self.payload_bytes = len(data_response.content)
         return data_response.json()
     
     def sendData(self, data):
@@ -126,77 +134,17 @@ class FetchController:
         return data_response.json()
     
     def quit(self):
-        self.session.close()
+        session = getattr(self, "session", None)
+        if session != None:
+            session.close()
 
     def __del__(self):
         self.quit()
 
-"""
-    ----- Every thing under this is depreciated -----
-
-    This is still here as a way to record and to remember as the code below was tested but the 
-    translated code above has yet to be tested, even though it should be functionally equivalent
-
-    --------------------------------------------------
-"""
-
-# Hard code for now. Limit only to domains that I have permission to do this to.
-LOGIN_URL = "https://spellinblox.com/accounts/login/"
-
-# The static URL that the data exists at 
-# (Parameters are used by server to dynamically serve appropiate data)
-DATA_URL = "https://spellinblox.com/api/load/"
-
-# Depreciated
-def fetch_data_with_auth(username: str, password: str, domain: str):
-    """
-        This is the helper function that authenticates a user and fetches the appropiate
-        Word/Tag data for the game linked to their domain.
-
-        username    {str} The username used to authenticate with the external server
-        password    {str} The password used to authenticate with the external server
-        domain      {str} An additional parameter required by the external server to determine
-                            which data rows are relevant or appropiate.
-
-        {Dictionary}    A dictionary returning all the tag/word/details for the given domain,
-                        if the authentication was succuessfull
-
-        {ExternalServerFetchException}  Raised if there is an issue with server communication.
-    """
-    login_payload = {
-        'username': username,
-        "password": password
-    }
-
-    session = requests.Session()
-
-    # This block gets the csrftoken that is used when loging in automatically
-    _ = session.get(LOGIN_URL) # result not need, but the information in the Session object is
-    csrftoken = session.cookies.get('csrftoken') # token used when performing login
-
-    headers = {}
-
-    if csrftoken:
-        login_payload['csrfmiddlewaretoken'] = csrftoken
-        headers['Referer'] = LOGIN_URL
-
-    login_response = session.post(LOGIN_URL, data=login_payload, headers=headers)
-
-    if login_response.status_code not in [200, 302]:
-        raise ExternalServerFetchException("ERROR: Login Failed", login_response.status_code)
-
-    csrftoken2 = session.cookies.get('csrftoken')
-
-    data_payload = {
-        "domain": domain
-    }
-
-    data_headers = {
-        'Content-Type': "application/json",
-        "X-CSRFToken": csrftoken2
-    }
 
-    data_response = session.post(DATA_URL, headers=data_headers, json=data_payload)
-    if not data_response.status_code == 200:
-        raise ExternalServerFetchException("ERROR: Data could not be fetched", data_response.status_code)
-    return data_response.json()
+def __getattr__(name):
+    # The deprecated helpers and constants that used to be defined here
+    if name in ("fetch_data_with_auth", "LOGIN_URL", "DATA_URL"):
+        from . import legacy_fetch
+        return getattr(legacy_fetch, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
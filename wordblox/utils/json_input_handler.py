@@ -1,5 +1,6 @@
 from django.http import HttpResponse
 from django.conf import settings
+from utils.fast_json import DEFAULT, FastJsonResponse
 import logging
 
 class JsonInputHandler:
@@ -14,23 +15,33 @@ class JsonInputHandler:
 
     @classmethod
     def print_headers(cls, request):
-        cls.logger.error("REQUEST HEADERS:")
-        for k, v in request.META.items():
-            cls.logger.error(f"{k}: {v}")
+        if cls.logger.isEnabledFor(logging.DEBUG):
+            cls.logger.debug("REQUEST HEADERS:")
+            for k, v in request.META.items():
+                cls.logger.debug("%s: %s", k, v)
         
     @classmethod
     def log_object(cls, obj, label=""):
-        cls.logger.error(f"----- {label} -----")
-        for key, val in obj.items():
-            cls.logger.error(f"\n\tKey: {key}\n\tValue: {val}")
-        cls.logger.error("---------------------")
+        if cls.logger.isEnabledFor(logging.DEBUG):
+            cls.logger.debug("----- %s -----", label)
+            for key, val in obj.items():
+                cls.logger.debug("\n\tKey: %s\n\tValue: %s", key, val)
+            cls.logger.debug("---------------------")
 
     @classmethod
     def log_array(cls, array, label=""):
-        cls.logger.error(f"------ {label} -----")
-        for elem in array:
-            cls.logger.error(f"n\tElem: {elem}")
-        cls.logger.error("---------------------")
+        if cls.logger.isEnabledFor(logging.DEBUG):
+            cls.logger.debug("------ %s -----", label)
+            for elem in array:
+                cls.logger.debug("\n\tElem: %s", elem)
+            cls.logger.debug("---------------------")
+
+    @classmethod
+    def respond(cls, data, **kwargs):
+        """
+            JSON response for the handlers, encoded with the JSON_HANDLER_STYLE of utils.fast_json
+        """
+        return FastJsonResponse(data, style=getattr(settings, "JSON_HANDLER_STYLE", DEFAULT), **kwargs)
 
     @classmethod
     def post_input(cls, request):
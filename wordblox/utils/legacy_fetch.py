@@ -0,0 +1,70 @@
+"""
+    ----- Every thing in here is depreciated -----
+
+    Moved out of utils.fetch_word_data so that it is only loaded when used. It is kept as a
+    record, as this code was tested against the external server and FetchController is its
+    translation.
+"""
+import requests
+from .fetch_word_data import ExternalServerFetchException
+
+# Hard code for now. Limit only to domains that I have permission to do this to.
+LOGIN_URL = "https://spellinblox.com/accounts/login/"
+
+# The static URL that the data exists at 
+# (Parameters are used by server to dynamically serve appropiate data)
+DATA_URL = "https://spellinblox.com/api/load/"
+
+# Depreciated
+def fetch_data_with_auth(username: str, password: str, domain: str):
+    """
+        This is the helper function that authenticates a user and fetches the appropiate
+        Word/Tag data for the game linked to their domain.
+
+        username    {str} The username used to authenticate with the external server
+        password    {str} The password used to authenticate with the external server
+        domain      {str} An additional parameter required by the external server to determine
+                            which data rows are relevant or appropiate.
+
+        {Dictionary}    A dictionary returning all the tag/word/details for the given domain,
+                        if the authentication was succuessfull
+
+        {ExternalServerFetchException}  Raised if there is an issue with server communication.
+    """
+    login_payload = {
+        'username': username,
+        "password": password
+    }
+
+    session = requests.Session()
+
+    # This block gets the csrftoken that is used when loging in automatically
+    _ = session.get(LOGIN_URL) # result not need, but the information in the Session object is
+    csrftoken = session.cookies.get('csrftoken') # token used when performing login
+
+    headers = {}
+
+    if csrftoken:
+        login_payload['csrfmiddlewaretoken'] = csrftoken
+        headers['Referer'] = LOGIN_URL
+
+    login_response = session.post(LOGIN_URL, data=login_payload, headers=headers)
+
+    if login_response.status_code not in [200, 302]:
+        raise ExternalServerFetchException("ERROR: Login Failed", login_response.status_code)
+
+    csrftoken2 = session.cookies.get('csrftoken')
+
+    data_payload = {
+        "domain": domain
+    }
+
+    data_headers = {
+        'Content-Type': "application/json",
+        "X-CSRFToken": csrftoken2
+    }
+
+    data_response = session.post(DATA_URL, headers=data_headers, json=data_payload)
+    if not data_response.status_code == 200:
+        raise ExternalServerFetchException("ERROR: Data could not be fetched", data_response.status_code)
+    return data_response.json()
@@ -0,0 +1,124 @@
+"""
+    Logging helpers shared by the handlers and the sync pipeline.
+
+    QueueListenerHandler keeps log I/O off the request thread: records are put on an
+    in-process queue and a background QueueListener formats and writes them. The listener
+    thread is started by the first record a process logs, so a worker forked from a server
+    that loaded the settings before forking (gunicorn --preload) starts its own.
+
+    SampledLogger is for messages that can fire once per row during a sync, where
+    logging every occurrence would cost more than the work being logged.
+"""
+import atexit
+import copy
+import logging
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+
+class QueueListenerHandler(QueueHandler):
+    """
+        QueueHandler that owns its QueueListener and the stream handler it writes to.
+
+        Used from the LOGGING setting through the '()' factory key, so it behaves the same
+        on every Python version regardless of dictConfig's own QueueHandler support.
+    """
+
+    def __init__(self, queue_size=-1):
+        super().__init__(queue.Queue(queue_size))
+        self.queue_size = queue_size
+        self.target = logging.StreamHandler()
+        self.listener = None
+        self._pid = None    # Process the listener was started in
+        self._start_lock = threading.Lock()
+        atexit.register(self.stopListener)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._afterFork)
+
+    def _afterFork(self):
+        """
+            The listener thread does not survive a fork, and the queue may hold records or a lock
+            of the parent, so the child starts over with a new queue
+        """
+        self.queue = queue.Queue(self.queue_size)
+        self.listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def startListener(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._start_lock:
+            if self._pid != pid:
+                self.listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+                self.listener.start()
+                self._pid = pid
+
+    def stopListener(self):
+        if self.listener != None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+            self._pid = None
+
+    def emit(self, record):
+        self.startListener()
+        super().emit(record)
+
+    def setFormatter(self, fmt):
+        """
+            Formatting is done by the listener thread, so the formatter belongs on the target.
+        """
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        """
+            Like QueueHandler.prepare, merges the message with its args and drops the args and
+            the exception before the record is queued, so the listener thread never touches
+            objects the logging thread may still change. Unlike it the record is not formatted
+            here, the target does that, so only the traceback is rendered into the message.
+        """
+        msg = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = (self.target.formatter or logging.Formatter()).formatException(record.exc_info)
+        if record.exc_text:
+            msg = f"{msg}\n{record.exc_text}"
+        record = copy.copy(record)
+        record.message = msg
+        record.msg = msg
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+
+class SampledLogger:
+    """
+        Wrapper around a logger for high volume, per row messages.
+
+        The first occurrence of a key is always logged, after that only every
+        sample_every-th occurrence is. flush() logs how many were seen in total
+        and resets the counters.
+    """
+
+    def __init__(self, logger, sample_every=100, level=logging.WARNING):
+        self.logger = logger
+        self.sample_every = max(int(sample_every), 1)
+        self.level = level
+        self.counts = {}
+
+    def log(self, key, msg, *args):
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        if (count == 1 or count % self.sample_every == 0) and self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, "%s (occurrence %d): " + msg, key, count, *args)
+
+    def flush(self):
+        if self.logger.isEnabledFor(self.level):
+            for key, count in self.counts.items():
+                if count > 1:
+                    self.logger.log(self.level, "%s: %d occurrences", key, count)
+        self.counts = {}
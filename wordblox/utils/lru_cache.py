@@ -0,0 +1,61 @@
+"""
+    A bounded, thread safe mapping that evicts the least recently used entry once full.
+
+    Entries can also expire after a time to live, which bounds how long a value changed by
+    another process can be served from the cache.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+
+    _missing = object()
+
+    def __init__(self, max_size: int = 1024, ttl: float = None):
+        """
+            @param  {int}   max_size    The number of entries kept
+            @param  {float} ttl     Seconds an entry is kept, None to keep it until it is evicted
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, stored at)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, self._missing)
+            if entry is self._missing:
+                return default
+            if self.ttl != None and time.monotonic() - entry[1] > self.ttl:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def evict(self, predicate):
+        """
+            Removes every entry for which predicate(key, value) is true
+        """
+        with self._lock:
+            for key in [key for key, (value, _) in self._data.items() if predicate(key, value)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
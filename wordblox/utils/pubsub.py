@@ -0,0 +1,183 @@
+"""
+    In-process publish/subscribe for pushing events to asyncio consumers.
+
+    PubSub fans a message published for a key out to every subscriber of that key. Publishers
+    can be any thread (a sync view, a signal receiver or a background pull). A subscriber either
+    lives on an event loop (an async view served over ASGI), the hand over then goes through
+    call_soon_threadsafe, or blocks a thread of its own (a view served over WSGI, see
+    subscribeSync).
+
+    Every subscriber has a bounded queue, a subscriber that does not keep up loses its oldest
+    messages instead of growing without limit.
+
+    PostgresNotifyBackend carries the messages between worker processes with LISTEN/NOTIFY: a
+    publish becomes a NOTIFY and a listener thread in every process hands what it receives to
+    the local PubSub.
+"""
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+
+
+class Subscription:
+
+    __slots__ = ("key", "queue", "loop")
+
+    def __init__(self, key, queue, loop):
+        self.key = key
+        self.queue = queue
+        self.loop = loop
+
+    @staticmethod
+    def _put(queue, message):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+    def deliver(self, message):
+        """
+            Hands a message over from any thread
+
+            @raise  {RuntimeError}  If the loop of the subscriber was closed
+        """
+        self.loop.call_soon_threadsafe(self._put, self.queue, message)
+
+    async def get(self, timeout=None):
+        """
+            @return The next message, or None if none arrived within timeout seconds
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class SyncSubscription:
+    """
+        A subscription read by blocking the thread of its reader
+    """
+
+    __slots__ = ("key", "queue", "lock")
+
+    def __init__(self, key, queue_size):
+        self.key = key
+        self.queue = queue.Queue(queue_size)
+        self.lock = threading.Lock()
+
+    def deliver(self, message):
+        with self.lock:
+            if self.queue.full():
+                self.queue.get_nowait()
+            self.queue.put_nowait(message)
+
+    def get(self, timeout=None):
+        """
+            @return The next message, or None if none arrived within timeout seconds
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class PubSub:
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def _add(self, sub):
+        with self._lock:
+            self._subscribers.setdefault(sub.key, set()).add(sub)
+        return sub
+
+    def subscribe(self, key):
+        """
+            Has to be called from the event loop the subscription is read on
+        """
+        return self._add(Subscription(key, asyncio.Queue(self.queue_size), asyncio.get_running_loop()))
+
+    def subscribeSync(self, key):
+        """
+            A subscription for a thread without an event loop, read with a blocking get
+        """
+        return self._add(SyncSubscription(key, self.queue_size))
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.key, None)
+            if subs != None:
+                subs.discard(sub)
+                if len(subs) == 0:
+                    del self._subscribers[sub.key]
+
+    def count(self, key=None):
+        with self._lock:
+            if key != None:
+                return len(self._subscribers.get(key, ()))
+            return sum(len(subs) for subs in self._subscribers.values())
+
+    def publish(self, key, message):
+        """
+            Hands the message to every subscriber of key, safe to call from any thread
+        """
+        with self._lock:
+            subs = list(self._subscribers.get(key, ()))
+        for sub in subs:
+            try:
+                sub.deliver(message)
+            except RuntimeError: # The loop of the subscriber was closed
+                self.unsubscribe(sub)
+
+
+class PostgresNotifyBackend:
+    """
+        Shares the messages of a PubSub between processes using PostgreSQL LISTEN/NOTIFY.
+
+        Messages have to be JSON serializable and, once encoded, below the 8000 byte limit of
+        a NOTIFY payload.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    reconnect_delay = 5
+
+    def __init__(self, pubsub, channel, conninfo):
+        self.pubsub = pubsub
+        self.channel = channel
+        self.conninfo = conninfo
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread == None:
+                self._thread = threading.Thread(target=self._listen, name=f"pubsub-{self.channel}", daemon=True)
+                self._thread.start()
+
+    def publish(self, key, message, cursor):
+        """
+            @param  cursor  A database cursor to send the NOTIFY on
+        """
+        cursor.execute("SELECT pg_notify(%s, %s)", [self.channel, json.dumps({"key": key, "message": message})])
+
+    def _listen(self):
+        import psycopg # Only needed when this backend is configured
+        while True:
+            try:
+                with psycopg.connect(self.conninfo, autocommit=True) as conn:
+                    conn.execute(f'LISTEN "{self.channel}"')
+                    for notify in conn.notifies():
+                        try:
+                            payload = json.loads(notify.payload)
+                        except ValueError:
+                            self.logger.warning("Ignoring a malformed notification on %s", self.channel)
+                            continue
+                        self.pubsub.publish(payload.get("key", None), payload.get("message", None))
+            except Exception as e:
+                self.logger.error("Listening on %s failed, reconnecting: %s", self.channel, e)
+                time.sleep(self.reconnect_delay)
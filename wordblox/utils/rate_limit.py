@@ -0,0 +1,108 @@
+"""
+    Token bucket rate limiting and a concurrency cap, kept in process memory.
+
+    A bucket holds up to burst tokens and refills at rate tokens per second. Every call takes a
+    token and is refused while the bucket is empty, with the time until the next token is due so
+    the caller can be told when to retry. The buckets live in an LRUCache, so a flood of distinct
+    keys only ever costs max_keys entries, and a bucket left alone long enough to refill expires
+    from it, which is the same as keeping it full.
+
+    The limits are per process: with several workers a client gets the allowance of the worker
+    its requests land on.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from .lru_cache import LRUCache
+
+
+class RateLimited(Exception):
+
+    def __init__(self, message, retry_after):
+        """
+            @param  {str}   message
+            @param  {float} retry_after     Seconds until the call may succeed
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def retryAfterHeader(self):
+        """
+            @return {str}   retry_after for a Retry-After header, whole seconds rounded up and at least 1
+        """
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class RateLimiter:
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        """
+            @param  {float} rate    Tokens added per second, 0 or less turns the limiter off
+            @param  {int}   burst   The most tokens a bucket holds
+            @param  {int}   max_keys    The number of buckets kept
+        """
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._buckets = LRUCache(max_keys, self.burst / rate if rate > 0 else None)  # key -> (tokens, time)
+        self._lock = threading.Lock()
+
+    def isEnabled(self):
+        return self.rate > 0
+
+    def take(self, key, cost: float = 1):
+        """
+            Takes cost tokens from the bucket of key if it has them.
+
+            @return {float} 0 if the tokens were taken, otherwise the seconds until they will be there
+        """
+        if not self.isEnabled():
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < cost:
+                self._buckets.set(key, (tokens, now))
+                return (cost - tokens) / self.rate
+            self._buckets.set(key, (tokens - cost, now))
+            return 0
+
+    def check(self, key, message, cost: float = 1):
+        """
+            take() raising RateLimited when the tokens are not there
+        """
+        retry_after = self.take(key, cost)
+        if retry_after > 0:
+            raise RateLimited(message, retry_after)
+
+
+class ConcurrencyLimiter:
+    """
+        Caps how many callers are inside slot() at once
+    """
+
+    def __init__(self, limit: int):
+        """
+            @param  {int}   limit   The number of concurrent slots, 0 or less for no cap
+        """
+        self.limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit) if limit > 0 else None
+
+    @contextmanager
+    def slot(self, timeout: float, message, retry_after: float):
+        """
+            Holds a slot for the block, waiting at most timeout seconds for one.
+
+            @raise  {RateLimited}   With retry_after if no slot came free in time
+        """
+        if self._semaphore == None:
+            yield
+            return
+        acquired = self._semaphore.acquire(timeout=timeout) if timeout > 0 else self._semaphore.acquire(blocking=False)
+        if not acquired:
+            raise RateLimited(message, retry_after)
+        try:
+            yield
+        finally:
+            self._semaphore.release()
@@ -0,0 +1,156 @@
+"""
+    Helpers for making sure that only one copy of an expensive job runs at a time.
+
+    SingleFlight coalesces concurrent calls inside a process: the first caller for a key runs
+    the job and every caller arriving while it runs, or shortly after it finished, gets its result.
+
+    FileLock is an exclusive lock on a file, so that the same holds across worker processes on
+    one host. It also stores a small JSON state next to the lock, which lets a process that
+    waited on the lock find out what the process holding it before did.
+"""
+import json
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError: # Not available on Windows, FileLock then only locks within the process
+    fcntl = None
+
+
+class SingleFlightTimeout(Exception):
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class _Call:
+
+    __slots__ = ("event", "result", "error", "finished")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished = None
+
+
+class SingleFlight:
+
+    def __init__(self, window: float = 0):
+        """
+            @param  {float} window  Seconds a successful result is handed to new callers after the job finished
+        """
+        self.window = window
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        """
+            Runs fn, unless a call for the same key is running or finished within the window,
+            in which case its result is returned (or its exception raised) instead.
+
+            @return {tuple} (result, shared) where shared is True if the result came from another call
+        """
+        with self._lock:
+            call = self._calls.get(key, None)
+            if call != None and call.finished != None and time.monotonic() - call.finished > self.window:
+                call = None
+            leader = call == None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+        if not leader:
+            if not call.event.wait(timeout):
+                raise SingleFlightTimeout(f"Timed out waiting for the running call for {key}")
+            if call.error != None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            call.finished = time.monotonic()
+            with self._lock:
+                if call.error != None or self.window <= 0:
+                    # Failures are not shared with later callers, they get to try again
+                    self._calls.pop(key, None)
+            call.event.set()
+        return call.result, False
+
+
+class FileLockTimeout(Exception):
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class FileLock:
+    """
+        Exclusive lock on a file, used as a context manager.
+
+        The file's content is a JSON object that the holder can read with state() and replace
+        with setState().
+    """
+
+    poll_interval = 0.05
+
+    _thread_locks = {}
+    _thread_locks_lock = threading.Lock()
+
+    def __init__(self, path, timeout: float = None):
+        self.path = path
+        self.timeout = timeout
+        self._file = None
+        with self.__class__._thread_locks_lock:
+            self._thread_lock = self.__class__._thread_locks.setdefault(path, threading.Lock())
+
+    def acquire(self):
+        if not self._thread_lock.acquire(timeout=-1 if self.timeout == None else self.timeout):
+            raise FileLockTimeout(f"Timed out waiting for {self.path}")
+        if fcntl == None:
+            return
+        start = time.monotonic()
+        self._file = open(self.path, "a+")
+        while True:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if self.timeout != None and time.monotonic() - start > self.timeout:
+                    self.release()
+                    raise FileLockTimeout(f"Timed out waiting for {self.path}")
+                time.sleep(self.poll_interval)
+
+    def release(self):
+        if self._file != None:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            finally:
+                self._file.close()
+                self._file = None
+        self._thread_lock.release()
+
+    def state(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.loads(f.read() or "{}")
+        except (OSError, ValueError):
+            return {}
+
+    def setState(self, state):
+        # Rewritten in place, replacing the file would leave other processes locking a different inode
+        with open(self.path, "a+") as f:
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
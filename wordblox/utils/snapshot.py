@@ -0,0 +1,210 @@
+"""
+    Immutable, memory-mapped snapshot files of (tag, word, details) rows.
+
+    A snapshot is written once, to a temporary file that is renamed over the previous one, and
+    never modified afterwards. Readers memory-map it, so every process reading the same file
+    shares one copy of it in the page cache instead of holding the rows on its own heap. A
+    reader that has the old file mapped keeps reading it until it notices the swap.
+
+    File layout, all integers little endian:
+
+        header      magic "WBXS", u16 format version, u16 reserved, u64 revision,
+                    u32 row count, u32 tag count, u64 tags offset, u64 rows offset, u64 pool offset
+        tags        tag count records of u32 offset, u32 length into the pool, sorted by text
+        rows        row count records of u32 word offset, u32 word length, u32 tag index,
+                    u32 details offset, u32 details length, sorted by (word, tag index)
+        pool        The UTF-8 bytes of every string, each word and details stored once per row
+                    and each tag once
+
+    Words are ordered by their UTF-8 bytes, which is the same order as Python str comparison,
+    so a word or a prefix is found by binary search over the fixed size row records.
+
+    The writer takes the rows already in that order, such as from a query ordered with a
+    binary collation, and streams them to the file: the row records go straight to it and the
+    pool is spooled to a temporary file appended at the end, so only the tags are held in
+    memory.
+"""
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+MAGIC = b"WBXS"
+FORMAT_VERSION = 1
+
+_header = struct.Struct("<4sHHQIIQQQ")
+_tag = struct.Struct("<II")
+_row = struct.Struct("<IIIII")
+
+
+class SnapshotError(Exception):
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+def writeSnapshot(path, revision, rows, tags):
+    """
+        Writes the rows to a new snapshot file and atomically puts it in place of path.
+
+        @param  {str}   path    Where the snapshot is placed
+        @param  {int}   revision    The version of the data, stored in the header
+        @param  rows    Iterable of (tag, word, details) tuples, sorted by the UTF-8 bytes of the
+                        word and then by tag
+        @param  tags    Every tag text the rows use, in any order
+
+        @return {int}   The number of rows written
+        @raise  {SnapshotError}     If the rows are out of order or use a tag not in tags
+    """
+    tag_texts = sorted(set(tags))
+    tag_index = {tag: i for i, tag in enumerate(tag_texts)}
+    tags_offset = _header.size
+    rows_offset = tags_offset + _tag.size * len(tag_texts)
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+    try:
+        with os.fdopen(fd, "w+b") as f, tempfile.TemporaryFile(dir=directory) as pool:
+            pool_size = 0
+            f.seek(tags_offset)
+            for tag in tag_texts:
+                data = tag.encode("utf-8")
+                f.write(_tag.pack(pool_size, len(data)))
+                pool.write(data)
+                pool_size += len(data)
+            count = 0
+            last = None
+            for tag, word, details in rows:
+                word = word.encode("utf-8")
+                details = (details or "").encode("utf-8")
+                index = tag_index.get(tag, None)
+                if index == None:
+                    raise SnapshotError(f"The tag {tag!r} of a row is not one of the snapshot's tags")
+                # Sorting by tag text within a word is the same as sorting by tag index, as the tags are sorted too
+                if last != None and (word, index) < last:
+                    raise SnapshotError("The rows of a snapshot have to be sorted by word and tag")
+                last = (word, index)
+                f.write(_row.pack(pool_size, len(word), index, pool_size + len(word), len(details)))
+                pool.write(word)
+                pool.write(details)
+                pool_size += len(word) + len(details)
+                count += 1
+            if pool_size > 0xFFFFFFFF:
+                raise SnapshotError("The rows do not fit the 4GB string pool of a snapshot")
+            pool_offset = rows_offset + _row.size * count
+            pool.seek(0)
+            shutil.copyfileobj(pool, f)
+            f.seek(0)
+            f.write(_header.pack(MAGIC, FORMAT_VERSION, 0, revision, count, len(tag_texts), tags_offset, rows_offset, pool_offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return count
+
+
+class SnapshotReader:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns)
+            if stat.st_size < _header.size:
+                raise SnapshotError(f"{path} is too short to be a snapshot")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.revision, self.count, self.tag_count, self._tags_offset, self._rows_offset, self._pool_offset = _header.unpack_from(self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise SnapshotError(f"{path} is not a version {FORMAT_VERSION} snapshot")
+        self._tag_texts = [self._string(*_tag.unpack_from(self._map, self._tags_offset + i * _tag.size)) for i in range(self.tag_count)]
+
+    def close(self):
+        self._map.close()
+
+    def isCurrent(self):
+        """
+            @return {bool}  False once the file at path has been replaced by a newer snapshot
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return (stat.st_ino, stat.st_mtime_ns) == self.identity
+
+    def __len__(self):
+        return self.count
+
+    def _bytes(self, offset, length):
+        start = self._pool_offset + offset
+        return self._map[start:start + length]
+
+    def _string(self, offset, length):
+        return self._bytes(offset, length).decode("utf-8")
+
+    def _record(self, index):
+        return _row.unpack_from(self._map, self._rows_offset + index * _row.size)
+
+    def _wordBytes(self, index):
+        word_offset, word_length, _, _, _ = self._record(index)
+        return self._bytes(word_offset, word_length)
+
+    def row(self, index):
+        """
+            @return {tuple} (tag, word, details) of the row at index
+        """
+        word_offset, word_length, tag_index, details_offset, details_length = self._record(index)
+        return self._tag_texts[tag_index], self._string(word_offset, word_length), self._string(details_offset, details_length)
+
+    def rows(self):
+        for index in range(self.count):
+            yield self.row(index)
+
+    def tags(self):
+        return list(self._tag_texts)
+
+    def _lowerBound(self, key: bytes):
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self._wordBytes(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def find(self, word):
+        """
+            @return {list}  (tag, word, details) of every row of the word
+        """
+        key = word.encode("utf-8")
+        ret = []
+        index = self._lowerBound(key)
+        while index < self.count and self._wordBytes(index) == key:
+            ret.append(self.row(index))
+            index += 1
+        return ret
+
+    def complete(self, prefix, tag=None, limit=20):
+        """
+            Distinct words starting with prefix in sorted order, optionally only those in a tag.
+
+            @return {list}  At most limit words
+        """
+        key = prefix.encode("utf-8")
+        ret = []
+        index = self._lowerBound(key)
+        while index < self.count and len(ret) < limit:
+            word_offset, word_length, tag_index, _, _ = self._record(index)
+            word = self._bytes(word_offset, word_length)
+            if not word.startswith(key):
+                break
+            if (tag == None or self._tag_texts[tag_index] == tag) and (len(ret) == 0 or ret[-1] != word):
+                ret.append(word)
+            index += 1
+        return [word.decode("utf-8") for word in ret]
@@ -0,0 +1,104 @@
+"""
+    A small trie used to answer "is this a word" and "which words start with this" in
+    O(len(word)) without going to the database.
+
+    Every word ending at a node records the set of tags it belongs to, so the same trie
+    answers both the domain wide and the per tag questions.
+"""
+
+
+class TrieNode:
+
+    __slots__ = ("children", "tags")
+
+    def __init__(self):
+        self.children = {}
+        self.tags = None    # Set of tags when a word ends at this node
+
+
+class Trie:
+
+    def __init__(self):
+        self.root = TrieNode()
+        self.size = 0
+
+    def _find(self, prefix: str):
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char, None)
+            if node == None:
+                return None
+        return node
+
+    def add(self, tag: str, word: str):
+        node = self.root
+        for char in word:
+            child = node.children.get(char, None)
+            if child == None:
+                child = TrieNode()
+                node.children[char] = child
+            node = child
+        if node.tags == None:
+            node.tags = set()
+            self.size += 1
+        node.tags.add(tag)
+
+    def remove(self, tag: str, word: str):
+        """
+            Removes the word from a tag, pruning the nodes that no longer lead to a word
+
+            @return {bool}  False if the word was not in the tag
+        """
+        path = [self.root]
+        for char in word:
+            node = path[-1].children.get(char, None)
+            if node == None:
+                return False
+            path.append(node)
+        node = path[-1]
+        if node.tags == None or tag not in node.tags:
+            return False
+        node.tags.discard(tag)
+        if len(node.tags) == 0:
+            node.tags = None
+            self.size -= 1
+            for i in range(len(word), 0, -1):
+                cur = path[i]
+                if cur.tags != None or len(cur.children) > 0:
+                    break
+                del path[i - 1].children[word[i - 1]]
+        return True
+
+    def tags(self, word: str):
+        """
+            @return {set}   The tags the word belongs to, empty if it is not a word
+        """
+        node = self._find(word)
+        if node == None or node.tags == None:
+            return set()
+        return set(node.tags)
+
+    def contains(self, word: str, tag: str = None):
+        node = self._find(word)
+        if node == None or node.tags == None:
+            return False
+        return tag == None or tag in node.tags
+
+    def complete(self, prefix: str, tag: str = None, limit: int = 20):
+        """
+            Words starting with prefix, in sorted order, optionally only those in a tag.
+
+            @return {list}  At most limit words
+        """
+        ret = []
+        node = self._find(prefix)
+        if node == None or limit <= 0:
+            return ret
+        stack = [(prefix, node)]
+        while len(stack) > 0 and len(ret) < limit:
+            cur_prefix, cur = stack.pop()
+            if cur.tags != None and (tag == None or tag in cur.tags):
+                ret.append(cur_prefix)
+            for char in sorted(cur.children, reverse=True):
+                stack.append((cur_prefix + char, cur.children[char]))
+        return ret
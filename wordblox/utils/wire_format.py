@@ -0,0 +1,241 @@
+"""
+    Compact binary encoding of word lists, served instead of JSON to clients that ask for it
+    with "Accept: application/vnd.wordblox.words".
+
+    Every tag text appears once in a string table and rows refer to it by index, strings are
+    UTF-8 prefixed with their byte length, and every integer is an unsigned LEB128 varint
+    (7 bits per byte, low bits first, high bit set on every byte but the last).
+
+    Layout:
+
+        magic       4 bytes "WBXW"
+        version     1 byte, currently 1
+        kind        1 byte, 1 for a word list and 2 for a changes feed
+        revision    varint, the domain revision the data is at
+        since       varint, changes feed only: the revision the changes start after
+        tags        varint count, then count strings
+        kind 1:
+            rows    varint count, then per row: varint tag index, string word, string details
+        kind 2:
+            changed varint count, then per row: varint id, varint revision, varint tag index,
+                    string word, string details
+            deleted varint count, then per row: varint revision, varint tag index, string word
+
+    where a string is a varint byte length followed by that many bytes of UTF-8.
+
+    The encoder gathers the pieces of the payload and writes them into one output buffer
+    allocated at the exact size of the payload.
+"""
+
+CONTENT_TYPE = "application/vnd.wordblox.words"
+
+MAGIC = b"WBXW"
+VERSION = 1
+
+KIND_WORDS = 1
+KIND_CHANGES = 2
+
+
+class WireFormatError(Exception):
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+def acceptsBinary(accept_header):
+    """
+        @return {bool}  True if the Accept header asks for the binary format, JSON stays the default
+    """
+    for media_range in (accept_header or "").split(","):
+        parts = [part.strip() for part in media_range.split(";")]
+        if parts[0].lower() != CONTENT_TYPE:
+            continue
+        for param in parts[1:]:
+            key, _, val = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    return float(val) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+_small = [bytes((val,)) for val in range(0x80)]  # The one byte varints
+
+
+def varint(val):
+    if val < 0x80:
+        return _small[val]
+    ret = bytearray()
+    while val >= 0x80:
+        ret.append((val & 0x7F) | 0x80)
+        val >>= 7
+    ret.append(val)
+    return bytes(ret)
+
+
+class Encoder:
+    """
+        Gathers the pieces of a payload and copies them once into an output buffer of the exact
+        size (bytes.join sizes the result before copying), so the payload is never regrown or
+        copied piece by piece.
+    """
+
+    __slots__ = ("pieces",)
+
+    def __init__(self):
+        self.pieces = []
+
+    def varint(self, val):
+        self.pieces.append(_small[val] if val < 0x80 else varint(val))
+
+    def raw(self, data):
+        self.pieces.append(data)
+
+    def string(self, data):
+        self.pieces.append(_small[len(data)] if len(data) < 0x80 else varint(len(data)))
+        self.pieces.append(data)
+
+    def finish(self):
+        return b"".join(self.pieces)
+
+
+class _TagTable:
+
+    __slots__ = ("index", "encoded")
+
+    def __init__(self):
+        self.index = {}     # tag -> index
+        self.encoded = []   # encoded tag texts, in index order
+
+    def get(self, tag):
+        index = self.index.get(tag, None)
+        if index == None:
+            index = len(self.encoded)
+            self.index[tag] = index
+            self.encoded.append(tag.encode("utf-8"))
+        return index
+
+
+def _encode(kind, revision, since, tag_table, body):
+    encoder = Encoder()
+    encoder.raw(MAGIC)
+    encoder.raw(bytes((VERSION, kind)))
+    encoder.varint(revision)
+    if since != None:
+        encoder.varint(since)
+    encoder.varint(len(tag_table.encoded))
+    for tag in tag_table.encoded:
+        encoder.string(tag)
+    encoder.pieces.extend(body.pieces)
+    return encoder.finish()
+
+
+def encodeWords(revision, rows):
+    """
+        @param  {int}   revision    The revision of the domain
+        @param  rows    Iterable of (tag, word, details)
+
+        @return {bytes}
+    """
+    tag_table = _TagTable()
+    body = Encoder()
+    pieces = body.pieces
+    count = 0
+    # The row loop is the hot path, the common case of a small tag index and short strings
+    # is written without a call per field
+    for tag, word, details in rows:
+        index = tag_table.get(tag)
+        word = word.encode("utf-8")
+        details = (details or "").encode("utf-8")
+        if index < 0x80 and len(word) < 0x80 and len(details) < 0x80:
+            pieces.extend((_small[index], _small[len(word)], word, _small[len(details)], details))
+        else:
+            body.varint(index)
+            body.string(word)
+            body.string(details)
+        count += 1
+    pieces.insert(0, varint(count))
+    return _encode(KIND_WORDS, revision, None, tag_table, body)
+
+
+def encodeChanges(changes):
+    """
+        @param  {dict}  changes     As returned by DomainRevision.changes
+
+        @return {bytes}
+    """
+    tag_table = _TagTable()
+    body = Encoder()
+    body.varint(len(changes["changed"]))
+    for row in changes["changed"]:
+        body.varint(row["id"])
+        body.varint(row["revision"])
+        body.varint(tag_table.get(row["tag"]))
+        body.string(row["word"].encode("utf-8"))
+        body.string((row["details"] or "").encode("utf-8"))
+    body.varint(len(changes["deleted"]))
+    for row in changes["deleted"]:
+        body.varint(row["revision"])
+        body.varint(tag_table.get(row["tag"]))
+        body.string(row["word"].encode("utf-8"))
+    return _encode(KIND_CHANGES, changes["revision"] or 0, changes["since"], tag_table, body)
+
+
+class Decoder:
+    """
+        Reference decoder for the format, returning the same dicts the JSON endpoints do
+    """
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def varint(self):
+        ret = 0
+        shift = 0
+        while True:
+            if self.pos >= len(self.data):
+                raise WireFormatError("Truncated varint")
+            byte = self.data[self.pos]
+            self.pos += 1
+            ret |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return ret
+            shift += 7
+
+    def string(self):
+        length = self.varint()
+        end = self.pos + length
+        if end > len(self.data):
+            raise WireFormatError("Truncated string")
+        ret = bytes(self.data[self.pos:end]).decode("utf-8")
+        self.pos = end
+        return ret
+
+    def decode(self):
+        if bytes(self.data[:4]) != MAGIC or len(self.data) < 6 or self.data[4] != VERSION:
+            raise WireFormatError(f"Not a version {VERSION} word list")
+        kind = self.data[5]
+        self.pos = 6
+        revision = self.varint()
+        since = self.varint() if kind == KIND_CHANGES else None
+        tags = [self.string() for _ in range(self.varint())]
+        if kind == KIND_WORDS:
+            words = []
+            for _ in range(self.varint()):
+                tag = tags[self.varint()]
+                words.append({"tag": tag, "word": self.string(), "details": self.string()})
+            return {"revision": revision, "words": words}
+        elif kind == KIND_CHANGES:
+            changed = []
+            for _ in range(self.varint()):
+                word_id, word_revision, tag = self.varint(), self.varint(), tags[self.varint()]
+                changed.append({"id": word_id, "tag": tag, "word": self.string(), "details": self.string(), "revision": word_revision})
+            deleted = []
+            for _ in range(self.varint()):
+                deleted_revision, tag = self.varint(), tags[self.varint()]
+                deleted.append({"tag": tag, "word": self.string(), "revision": deleted_revision})
+            return {"revision": revision, "since": since, "changed": changed, "deleted": deleted}
+        raise WireFormatError(f"Unknown kind {kind}")
@@ -60,11 +60,15 @@ class TupleKeyCollection:
         """
             Using a toList function to create tuple lists that can be easily iterated on
         """
-        l = []
+        return list(self.iterRows())
+
+    def iterRows(self):
+        """
+            Yields the (tag, word, details) tuples of toList one at a time, without building the list
+        """
         for k, v in self.tag_word_details.items():
             key1, key2 = self.__class__.separate(k)
-            l.append((key1, key2, v))
-        return l
+            yield (key1, key2, v)
 
     def add(self, tag: str, word: str, details: str = ""):
         key = self.__class__.combine(tag, word)
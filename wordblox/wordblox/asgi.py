@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Serve the project through this module (for example with uvicorn wordblox.asgi:application)
+so that the /events stream of wordtag.events holds no worker thread per connected client.
 """
 
 import os
@@ -14,3 +17,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wordblox.settings')
 
 application = get_asgi_application()
+
+# With WARMUP_ON_START the worker only hands the application to the server once it is warm
+from wordtag.warmup import Warmup  # noqa: E402
+
+Warmup.serverStart()
@@ -83,6 +83,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'wordtag.replica.PrimaryPinMiddleware',
 ]
 
 ROOT_URLCONF = 'wordblox.urls'
@@ -108,13 +109,212 @@ WSGI_APPLICATION = 'wordblox.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# The database profile is chosen with DB_ENGINE ("sqlite" or "postgresql").
+#
+# SQLite runs in WAL mode so that reads are not blocked while a sync is writing,
+# the pragmas are applied by init_command on every new connection.
+#
+# PostgreSQL either uses a psycopg connection pool (DB_POOL=1) or persistent
+# connections with health checks, Django does not allow both at once.
+
+db_engine = getEnviron('DB_ENGINE', 'sqlite')
+
+if db_engine == 'postgresql':
+    db_pool_env = getEnviron('DB_POOL', "0")
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': getEnviron('DB_NAME', 'wordblox'),
+            'USER': getEnviron('DB_USER', 'wordblox'),
+            'PASSWORD': getEnviron('DB_PASSWORD', ''),
+            'HOST': getEnviron('DB_HOST', 'localhost'),
+            'PORT': getEnviron('DB_PORT', '5432'),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
     }
-}
+    if db_pool_env == "1":
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(getEnviron('DB_POOL_MIN_SIZE', "2")),
+            'max_size': int(getEnviron('DB_POOL_MAX_SIZE', "10")),
+            'timeout': int(getEnviron('DB_POOL_TIMEOUT', "10")),
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = int(getEnviron('DB_CONN_MAX_AGE', "600"))
+else:
+    sqlite_pragmas = [
+        "PRAGMA journal_mode=WAL;",
+        "PRAGMA synchronous=NORMAL;",
+        f"PRAGMA busy_timeout={int(getEnviron('SQLITE_BUSY_TIMEOUT', '5000'))};",
+        f"PRAGMA mmap_size={int(getEnviron('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))};",
+        f"PRAGMA cache_size={int(getEnviron('SQLITE_CACHE_SIZE', '-64000'))};",
+        "PRAGMA temp_store=MEMORY;",
+    ]
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': getEnviron('SQLITE_PATH', str(BASE_DIR / 'db.sqlite3')),
+            'CONN_MAX_AGE': int(getEnviron('DB_CONN_MAX_AGE', "60")),
+            'OPTIONS': {
+                'init_command': "".join(sqlite_pragmas),
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': int(getEnviron('SQLITE_BUSY_TIMEOUT', '5000')) / 1000,
+            },
+        }
+    }
+
+# Optional read replica, see wordtag.replica. The API list/retrieve actions and the snapshot
+# builder read from it. With SQLite it is a second file copied from the primary by the
+# copy_replica command, or in the background REPLICA_COPY_DELAY seconds after a pull when
+# REPLICA_COPY_ON_SYNC is set (each copy is a full backup of the database). With PostgreSQL it
+# is a server replicating from the primary
+if db_engine == 'postgresql' and getEnviron('DB_REPLICA_HOST', '') != '':
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': getEnviron('DB_REPLICA_HOST', ''),
+        'PORT': getEnviron('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'OPTIONS': dict(DATABASES['default']['OPTIONS']),
+    }
+elif db_engine != 'postgresql' and getEnviron('SQLITE_REPLICA_PATH', '') != '':
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': getEnviron('SQLITE_REPLICA_PATH', ''),
+        'OPTIONS': {
+            'init_command': "".join(sqlite_pragmas) + "PRAGMA query_only=ON;",
+            'timeout': DATABASES['default']['OPTIONS']['timeout'],
+        },
+    }
+
+REPLICA_DB_ALIAS = 'replica'
+REPLICA_COPY_ON_SYNC = getEnviron('REPLICA_COPY_ON_SYNC', "0") == "1"
+REPLICA_COPY_DELAY = float(getEnviron('REPLICA_COPY_DELAY', "1"))
+
+# Optional per domain shards, see wordtag.shards. DOMAIN_SHARDS names the shard databases,
+# each new domain is placed in one of them and its tags and words are written there instead
+# of the primary. With SQLite each shard is a db-<shard>.sqlite3 file in SQLITE_SHARD_DIR
+# (next to the primary by default), with PostgreSQL a
+# database named <DB_NAME>_<shard> on the primary's server. Create their tables with
+# "migrate --database <shard>" and move existing domains with the shard_domains command.
+DOMAIN_SHARDS = getEnvironArray('DOMAIN_SHARDS')
+
+for shard in DOMAIN_SHARDS:
+    if db_engine == 'postgresql':
+        DATABASES[shard] = {
+            **DATABASES['default'],
+            'NAME': f"{DATABASES['default']['NAME']}_{shard}",
+            'OPTIONS': dict(DATABASES['default']['OPTIONS']),
+        }
+    else:
+        DATABASES[shard] = {
+            **DATABASES['default'],
+            'NAME': str(Path(getEnviron('SQLITE_SHARD_DIR', str(BASE_DIR))) / f"db-{shard}.sqlite3"),
+            'OPTIONS': dict(DATABASES['default']['OPTIONS']),
+        }
 
+DATABASE_ROUTERS = []
+
+if len(DOMAIN_SHARDS) > 0:
+    # Before the replica router, the rows of a sharded domain are read and written in its shard
+    DATABASE_ROUTERS.append('wordtag.shards.DomainShardRouter')
+
+if REPLICA_DB_ALIAS in DATABASES:
+    # Tests run against the primary only
+    DATABASES[REPLICA_DB_ALIAS]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_ROUTERS.append('wordtag.replica.PrimaryReplicaRouter')
+
+
+# Number of rows written per bulk query by the sync writers and the import/export commands
+SYNC_BATCH_SIZE = int(getEnviron('SYNC_BATCH_SIZE', "1000"))
+
+# How a pull is diffed against the cache: "python" diffs in memory, "staging" loads the
+# external rows into a temporary table and diffs them in SQL, "chunked" diffs the cached rows
+# a tag and a page at a time, each page holding at most SYNC_CHUNK_BUDGET bytes of words
+SYNC_ENGINE = getEnviron('SYNC_ENGINE', "python")
+SYNC_CHUNK_BUDGET = int(getEnviron('SYNC_CHUNK_BUDGET', str(16 * 1024 * 1024)))
+
+# Concurrent pulls of a domain share one fetch and sync. SYNC_LOCK_DIR holds the lock files
+# used across worker processes, a finished pull is reused for SYNC_COALESCE_WINDOW seconds
+# and waiting on a running pull gives up after SYNC_LOCK_TIMEOUT seconds
+SYNC_LOCK_DIR = getEnviron('SYNC_LOCK_DIR', str(BASE_DIR / 'locks'))
+SYNC_COALESCE_WINDOW = float(getEnviron('SYNC_COALESCE_WINDOW', "5"))
+SYNC_LOCK_TIMEOUT = float(getEnviron('SYNC_LOCK_TIMEOUT', "300"))
+
+# Seconds a pulled domain is served from the cache without pulling again, for domains
+# without their own Domain.sync_ttl. A stale domain is still served while it is pulled again
+# in the background
+SYNC_FRESHNESS_TTL = int(getEnviron('SYNC_FRESHNESS_TTL', "300"))
+
+# Days the tombstones of deleted words are kept for the /changes feed, pruned by the
+# prune_tombstones command. A client that was away for longer downloads the words again
+TOMBSTONE_RETENTION_DAYS = float(getEnviron('TOMBSTONE_RETENTION_DAYS', "30"))
+
+# Pulls recorded by wordtag.sync_runs kept per domain, 0 keeps every run
+SYNC_RUN_KEEP = int(getEnviron('SYNC_RUN_KEEP', "500"))
+
+# Admission control for /login and /push_data, see wordtag.admission. Token buckets per
+# client IP and per domain (requests per minute and burst size, a rate of 0 turns a limit
+# off, the domain's only counts the pulls and pushes that run), kept for up to RATE_LIMIT_MAX_KEYS keys per worker. At most SYNC_MAX_IN_FLIGHT pulls
+# and pushes run at once in a worker (0 for no cap), a call waits SYNC_ADMISSION_TIMEOUT
+# seconds for a free slot before it is answered with 429 and Retry-After: SYNC_RETRY_AFTER
+RATE_LIMIT_IP_PER_MINUTE = float(getEnviron('RATE_LIMIT_IP_PER_MINUTE', "30"))
+RATE_LIMIT_IP_BURST = int(getEnviron('RATE_LIMIT_IP_BURST', "10"))
+RATE_LIMIT_DOMAIN_PER_MINUTE = float(getEnviron('RATE_LIMIT_DOMAIN_PER_MINUTE', "60"))
+RATE_LIMIT_DOMAIN_BURST = int(getEnviron('RATE_LIMIT_DOMAIN_BURST', "20"))
+RATE_LIMIT_MAX_KEYS = int(getEnviron('RATE_LIMIT_MAX_KEYS', "10000"))
+SYNC_MAX_IN_FLIGHT = int(getEnviron('SYNC_MAX_IN_FLIGHT', "4"))
+SYNC_ADMISSION_TIMEOUT = float(getEnviron('SYNC_ADMISSION_TIMEOUT', "0"))
+SYNC_RETRY_AFTER = int(getEnviron('SYNC_RETRY_AFTER', "5"))
+
+# Maximum number of items accepted by the /api/words/batch/ and /api/tags/batch/ endpoints
+BATCH_MAX_ITEMS = int(getEnviron('BATCH_MAX_ITEMS', "1000"))
+
+# Seconds before the in-memory word indexes of a domain are rebuilt, to pick up writes
+# made by other worker processes
+WORD_INDEX_TTL = int(getEnviron('WORD_INDEX_TTL', "300"))
+
+# Size of the process wide domain url and tag text to id caches, and seconds before an entry
+# is looked up again to pick up changes made by other worker processes
+ID_CACHE_SIZE = int(getEnviron('ID_CACHE_SIZE', "10000"))
+ID_CACHE_TTL = int(getEnviron('ID_CACHE_TTL', "300"))
+
+# Write a memory-mapped snapshot file of each domain to SNAPSHOT_DIR after every pull, and
+# serve getAllCachedData, /validate and /complete from it while it is up to date. The domain
+# revision a snapshot is checked against is read again after SNAPSHOT_REVISION_TTL seconds, so
+# writes made by other worker processes are seen that much later
+DOMAIN_SNAPSHOTS = getEnviron('DOMAIN_SNAPSHOTS', "0") == "1"
+SNAPSHOT_DIR = getEnviron('SNAPSHOT_DIR', str(BASE_DIR / 'snapshots'))
+SNAPSHOT_REVISION_TTL = float(getEnviron('SNAPSHOT_REVISION_TTL', "5"))
+
+# Warm a new worker up before it serves, see wordtag.warmup: the WARMUP_DOMAINS most recently
+# pulled domains get their ids, snapshots and word indexes loaded. Only the WSGI/ASGI entry
+# points start it, and wait at most WARMUP_TIMEOUT seconds for it, management commands do not
+WARMUP_ON_START = getEnviron('WARMUP_ON_START', "0") == "1"
+WARMUP_DOMAINS = int(getEnviron('WARMUP_DOMAINS', "50"))
+WARMUP_TIMEOUT = float(getEnviron('WARMUP_TIMEOUT', "30"))
+
+# Change notifications streamed by /events. "local" reaches the clients of this process only,
+# "postgres" shares the events between worker processes with LISTEN/NOTIFY on
+# DOMAIN_EVENTS_CHANNEL. A client that falls DOMAIN_EVENTS_QUEUE_SIZE events behind loses the
+# oldest ones, an idle stream gets a keepalive comment every DOMAIN_EVENTS_KEEPALIVE seconds
+DOMAIN_EVENTS_BACKEND = getEnviron('DOMAIN_EVENTS_BACKEND', "local")
+DOMAIN_EVENTS_CHANNEL = getEnviron('DOMAIN_EVENTS_CHANNEL', "wordtag_domain_events")
+DOMAIN_EVENTS_QUEUE_SIZE = int(getEnviron('DOMAIN_EVENTS_QUEUE_SIZE', "100"))
+DOMAIN_EVENTS_KEEPALIVE = float(getEnviron('DOMAIN_EVENTS_KEEPALIVE', "15"))
+
+
+# Responses are encoded with orjson when it is installed, see utils.fast_json. It is listed in
+# requirements.txt but optional, without it the stdlib json module writes the same bytes. The handler
+# responses keep the spaced JsonResponse style unless JSON_HANDLER_STYLE is "compact"
+FAST_JSON = getEnviron('FAST_JSON', "1") == "1"
+JSON_HANDLER_STYLE = getEnviron('JSON_HANDLER_STYLE', "default")
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'utils.fast_json.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -161,6 +361,19 @@ STATIC_ROOT = BASE_DIR / 'django_static'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Logging
+# Handlers write through a queue so that log I/O happens on a background thread
+# instead of the request thread. Per row sync messages are sampled, only every
+# LOG_SAMPLE_EVERY-th occurrence of the same message is written.
+# django.db.backends logs every SQL statement at DEBUG, it has its own level,
+# DB_LOG_LEVEL, so that a DEBUG LOG_LEVEL does not log every query.
+
+LOG_LEVEL = getEnviron('DJANGO_LOG_LEVEL', 'DEBUG' if DEBUG else 'INFO')
+
+DB_LOG_LEVEL = getEnviron('DB_LOG_LEVEL', 'WARNING')
+
+LOG_SAMPLE_EVERY = int(getEnviron('LOG_SAMPLE_EVERY', "100"))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -171,19 +384,30 @@ LOGGING = {
     },
     'handlers': {
         'console': {
-            'level': getEnviron('DJANGO_LOG_LEVEL', 'DEBUG'),
-            'class': 'logging.StreamHandler',
+            '()': 'utils.log_utils.QueueListenerHandler',
+            'level': LOG_LEVEL,
+            'formatter': 'default',
         }
     },
     'loggers': {
         'django': {
-            'handers': ['console'],
-            'level': getEnviron('DJANGO_LOG_LEVEL', 'DEBUG'),
+            'handlers': ['console'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        'django.db.backends': {
+            'handlers': ['console'],
+            'level': DB_LOG_LEVEL,
             'propagate': False,
         },
         'wordtag': {
             'handlers': ['console'],
-            'level': getEnviron('DJANGO_LOG_LEVEL', 'DEBUG'),
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        'utils': {
+            'handlers': ['console'],
+            'level': LOG_LEVEL,
             'propagate': False,
         }
     }
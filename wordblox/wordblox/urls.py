@@ -17,7 +17,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
-from wordtag.views import TagViewSet, WordViewSet, SpellinBloxPullHandler, DomainLocker, LogoutHandler, AuthChecker, SpellinBloxPushHandler
+from wordtag.views import TagViewSet, WordViewSet, SpellinBloxPullHandler, DomainLocker, LogoutHandler, AuthChecker, SpellinBloxPushHandler, WordSearchHandler, WordValidateHandler, WordCompleteHandler, WordFormableHandler, WordSampleHandler, DomainChangesHandler, DomainEventsHandler, DomainWordsHandler, SyncRunsHandler
 from utils.tokens import get_csrf_token
 
 router = routers.DefaultRouter()
@@ -32,5 +32,14 @@ urlpatterns = [
     path('logout', LogoutHandler.run),
     path('is_auth', AuthChecker.run),
     path('push_data', SpellinBloxPushHandler.run),
+    path('search', WordSearchHandler.run),
+    path('validate', WordValidateHandler.run),
+    path('complete', WordCompleteHandler.run),
+    path('formable', WordFormableHandler.run),
+    path('sample', WordSampleHandler.run),
+    path('words', DomainWordsHandler.run),
+    path('changes', DomainChangesHandler.run),
+    path('events', DomainEventsHandler.run),
+    path('sync_runs', SyncRunsHandler.run),
     path('api/', include(router.urls))
 ]
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wordblox.settings')
 
 application = get_wsgi_application()
+
+# With WARMUP_ON_START the worker only hands the application to the server once it is warm
+from wordtag.warmup import Warmup  # noqa: E402
+
+Warmup.serverStart()
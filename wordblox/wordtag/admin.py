@@ -1,3 +1,22 @@
 from django.contrib import admin
+from .models import SyncRun
 
 # Register your models here.
+
+@admin.register(SyncRun)
+class SyncRunAdmin(admin.ModelAdmin):
+    """
+        Read only view of the pull and push history, the rows are written by the pulls and pushes (see wordtag.sync_runs)
+    """
+    list_display = ("domain", "started", "kind", "engine", "completed", "total_seconds", "fetch_seconds", "load_seconds", "sync_seconds", "payload_bytes", "new_rows", "changed_rows", "deleted_rows", "unchanged_rows")
+    list_filter = ("kind", "completed", "engine", "sync_control", "started")
+    search_fields = ("domain__url", "error")
+    date_hierarchy = "started"
+    list_select_related = ("domain",)
+    ordering = ("-started",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,91 @@
+"""
+    Admission control for the endpoints that go to the external server.
+
+    /login and /push_data each cost an upstream round trip and often a sync of a whole domain.
+    The calls of a client IP are limited by a token bucket checked before any work is done (see
+    utils.rate_limit). The bucket of a domain is only charged once a pull or push of it is
+    actually about to run, after the credentials and the freshness check, so calls answered
+    from a fresh cache, coalesced into a running pull or refused at login can not use up the
+    domain's allowance. The pulls and pushes running in a process are capped at
+    SYNC_MAX_IN_FLIGHT. A refused call is answered straight away with 429 Too Many Requests and
+    a Retry-After header, so an overload is shed at the door instead of queueing behind the
+    running syncs.
+"""
+from django.conf import settings
+from django.http import HttpResponse
+from utils.rate_limit import ConcurrencyLimiter, RateLimited, RateLimiter
+from utils.session_auth import get_client_ip
+
+
+class SyncAdmission:
+
+    _ip_limiter = None
+    _domain_limiter = None
+    _in_flight = None
+
+    @classmethod
+    def ipLimiter(cls):
+        if cls._ip_limiter == None:
+            cls._ip_limiter = RateLimiter(
+                getattr(settings, "RATE_LIMIT_IP_PER_MINUTE", 30) / 60,
+                getattr(settings, "RATE_LIMIT_IP_BURST", 10),
+                getattr(settings, "RATE_LIMIT_MAX_KEYS", 10000)
+            )
+        return cls._ip_limiter
+
+    @classmethod
+    def domainLimiter(cls):
+        if cls._domain_limiter == None:
+            cls._domain_limiter = RateLimiter(
+                getattr(settings, "RATE_LIMIT_DOMAIN_PER_MINUTE", 60) / 60,
+                getattr(settings, "RATE_LIMIT_DOMAIN_BURST", 20),
+                getattr(settings, "RATE_LIMIT_MAX_KEYS", 10000)
+            )
+        return cls._domain_limiter
+
+    @classmethod
+    def inFlight(cls):
+        if cls._in_flight == None:
+            cls._in_flight = ConcurrencyLimiter(getattr(settings, "SYNC_MAX_IN_FLIGHT", 4))
+        return cls._in_flight
+
+    @classmethod
+    def admit(cls, request):
+        """
+            Takes a token for the client IP.
+
+            @raise  {RateLimited}   If the bucket is empty
+        """
+        cls.ipLimiter().check(get_client_ip(request), "Too many requests from this address")
+
+    @classmethod
+    def chargeDomain(cls, domain):
+        """
+            Takes a token for the domain, right before a pull or a push of it runs.
+
+            @raise  {RateLimited}   If the bucket is empty
+        """
+        cls.domainLimiter().check(domain, "Too many requests for this domain")
+
+    @classmethod
+    def syncSlot(cls):
+        """
+            Context manager holding one of the SYNC_MAX_IN_FLIGHT slots for a pull or a push,
+            waiting at most SYNC_ADMISSION_TIMEOUT seconds for it.
+
+            @raise  {RateLimited}   If every slot stayed taken
+        """
+        return cls.inFlight().slot(
+            getattr(settings, "SYNC_ADMISSION_TIMEOUT", 0),
+            "Too many syncs are running, try again later",
+            getattr(settings, "SYNC_RETRY_AFTER", 5)
+        )
+
+    @classmethod
+    def reject(cls, error: RateLimited):
+        """
+            @return {HttpResponse}  The 429 response for a refused call
+        """
+        response = HttpResponse(f"{error}", status=429)
+        response["Retry-After"] = error.retryAfterHeader()
+        return response
@@ -4,3 +4,30 @@ from django.apps import AppConfig
 class WordtagConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'wordtag'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from .signals import domain_changed, domain_revised, domain_synced
+        from .events import DomainEvents
+        from .id_cache import DomainIdCache
+        from .models import Domain, Tag
+        from . import replica
+        from .shards import DomainShards
+        from .snapshots import DomainSnapshots
+        from .word_index import DomainAnagramIndex, DomainSampleIndex, DomainTrieIndex
+        domain_changed.connect(DomainTrieIndex.onDomainChanged, weak=False, dispatch_uid="wordtag.word_index.trie")
+        domain_changed.connect(DomainAnagramIndex.onDomainChanged, weak=False, dispatch_uid="wordtag.word_index.anagram")
+        domain_changed.connect(DomainSampleIndex.onDomainChanged, weak=False, dispatch_uid="wordtag.word_index.sample")
+        domain_revised.connect(DomainEvents.onDomainRevised, weak=False, dispatch_uid="wordtag.events.revised")
+        domain_synced.connect(DomainEvents.onDomainSynced, weak=False, dispatch_uid="wordtag.events.synced")
+        # The replica copy is scheduled before the snapshot waits for it
+        domain_synced.connect(replica.onDomainSynced, weak=False, dispatch_uid="wordtag.replica.synced")
+        domain_synced.connect(DomainSnapshots.onDomainSynced, weak=False, dispatch_uid="wordtag.snapshots.synced")
+        domain_changed.connect(DomainSnapshots.onDomainChanged, weak=False, dispatch_uid="wordtag.snapshots.changed")
+        domain_revised.connect(DomainSnapshots.onDomainChanged, weak=False, dispatch_uid="wordtag.snapshots.revised")
+        domain_changed.connect(DomainIdCache.onDomainChanged, weak=False, dispatch_uid="wordtag.id_cache.changed")
+        for signal in (post_save, post_delete):
+            signal.connect(DomainIdCache.onDomainSaved, sender=Domain, weak=False, dispatch_uid=f"wordtag.id_cache.domain.{signal is post_save}")
+            signal.connect(DomainIdCache.onTagSaved, sender=Tag, weak=False, dispatch_uid=f"wordtag.id_cache.tag.{signal is post_save}")
+        post_save.connect(DomainShards.onDomainSaved, sender=Domain, weak=False, dispatch_uid="wordtag.shards.domain.saved")
+        post_delete.connect(DomainShards.onDomainDeleted, sender=Domain, weak=False, dispatch_uid="wordtag.shards.domain.deleted")
@@ -0,0 +1,414 @@
+"""
+    Batch create/update/delete for the Tag and Word API.
+
+    The payload has the form:
+        {
+            "create": [{...}, ...],
+            "update": [{"id": 1, ...}, ...],
+            "delete": [1, 2, ...],
+            "domain_id": 1
+        }
+
+    domain_id is only needed when the domains are sharded (see wordtag.shards): it names the
+    domain whose shard holds the rows, and every row of the batch has to be in that shard.
+
+    The whole payload is validated first, using one query for the rows being updated or
+    deleted, one for the related rows and one for unique conflicts. If every item is valid
+    the changes are applied in a single transaction with bulk queries, otherwise nothing is
+    written. Either way a result is returned for every item.
+"""
+from django.conf import settings
+from .models import Domain, Tag, Word
+from .revisions import DomainRevision, RevisionScope
+from .shards import DomainShards
+from .signals import notify_domain_changed
+
+
+class BatchError(Exception):
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class BatchHandler:
+
+    # ----- Payload keys -----
+
+    create_key = "create"
+    update_key = "update"
+    delete_key = "delete"
+    domain_key = "domain_id"
+
+    # ----- Model description, set by the subclasses -----
+
+    model = None
+
+    related_model = None    # The model the related_key points to
+    related_key = None      # The field holding the foreign key, such as tag_id
+
+    create_fields = []      # Fields accepted on create, other than the related_key
+    update_fields = []      # Fields accepted on update, other than the related_key
+
+    required_fields = []    # Fields that have to be present on create
+
+    text_max_length = 75
+
+    unique_error = "The fields must make a unique set"
+
+    @classmethod
+    def maxItems(cls):
+        return getattr(settings, "BATCH_MAX_ITEMS", 1000)
+
+    @classmethod
+    def isValidId(cls, val):
+        return type(val) == int and val > 0
+
+    @classmethod
+    def itemId(cls, item, key):
+        """
+            The id stored under key in an item, or None if it is missing or not a valid id
+        """
+        val = item.get(key, None)
+        return val if cls.isValidId(val) else None
+
+    @classmethod
+    def validateField(cls, field, val):
+        """
+            Returns an error message for the value, or None if it is valid
+        """
+        if field == "text":
+            if type(val) != str or len(val) <= 0:
+                return "Must be a non empty string"
+            elif len(val) > cls.text_max_length:
+                return f"Ensure this field has no more than {cls.text_max_length} characters"
+        elif field == "details":
+            if type(val) != str:
+                return "Must be a string"
+        return None
+
+    @classmethod
+    def uniqueKey(cls, values):
+        """
+            The key that has to be unique among the rows of the model, or None if there is no such constraint
+        """
+        return None
+
+    @classmethod
+    def uniqueConflicts(cls, keys):
+        """
+            Returns {key: id} for the rows already using one of the keys
+        """
+        return {}
+
+    @classmethod
+    def parse(cls, data):
+        if type(data) != dict:
+            raise BatchError("Expected an object with create, update and/or delete lists")
+        creates = data.get(cls.create_key, [])
+        updates = data.get(cls.update_key, [])
+        deletes = data.get(cls.delete_key, [])
+        if type(creates) != list or type(updates) != list or type(deletes) != list:
+            raise BatchError(f"{cls.create_key}, {cls.update_key} and {cls.delete_key} must be lists")
+        if len(creates) + len(updates) + len(deletes) > cls.maxItems():
+            raise BatchError(f"A batch can not contain more than {cls.maxItems()} items")
+        deletes = [item.get("id", None) if type(item) == dict else item for item in deletes]
+        deletes = [item if cls.isValidId(item) else None for item in deletes]
+        return creates, updates, deletes
+
+    @classmethod
+    def validateValues(cls, item, fields, related):
+        errors = {}
+        for field in item:
+            if field != "id" and field not in fields + [cls.related_key]:
+                errors[field] = "This field can not be set"
+            elif field in fields:
+                msg = cls.validateField(field, item[field])
+                if msg != None:
+                    errors[field] = msg
+        if cls.related_key in item:
+            related_id = item[cls.related_key]
+            if not cls.isValidId(related_id) or related_id not in related:
+                errors[cls.related_key] = f"Invalid pk \"{related_id}\" - object does not exist"
+        return errors
+
+    @classmethod
+    def finalValues(cls, item, cur=None):
+        """
+            The values a row will have once the item is applied
+        """
+        return {field: item.get(field, getattr(cur, field, None)) for field in cls.create_fields + [cls.related_key]}
+
+    @classmethod
+    def validate(cls, creates, updates, deletes):
+        """
+            Validates the whole batch.
+
+            Updates are checked before creates, so that a create reusing the unique key of a row
+            that is left unchanged by an update is the item reported as invalid.
+
+            @return {tuple} (results, instances) where results has one entry per item, in the order
+                            create, update, delete, with an "errors" dict on the invalid ones
+        """
+        update_items = [item for item in updates if type(item) == dict]
+        create_items = [item for item in creates if type(item) == dict]
+        row_ids = {cls.itemId(item, "id") for item in update_items} | set(deletes)
+        instances = cls.model.objects.in_bulk([i for i in row_ids if i != None])
+        related_ids = {cls.itemId(item, cls.related_key) for item in create_items + update_items}
+        related = cls.related_model.objects.in_bulk([i for i in related_ids if i != None])
+
+        # Unique keys already in use, except by rows that are deleted or updated in this batch
+        deleted_ids = {i for i in deletes if i in instances}
+        updated_ids = {cls.itemId(item, "id") for item in update_items} & set(instances)
+        new_keys = [cls.uniqueKey(cls.finalValues(item, instances.get(cls.itemId(item, "id"), None))) for item in update_items]
+        new_keys.extend(cls.uniqueKey(cls.finalValues(item)) for item in create_items)
+        taken = {}
+        for key, row_id in cls.uniqueConflicts([k for k in new_keys if k != None]).items():
+            if row_id not in deleted_ids and row_id not in updated_ids:
+                taken[key] = row_id
+
+        update_results = []
+        for index, item in enumerate(updates):
+            errors = {}
+            row_id = cls.itemId(item, "id") if type(item) == dict else None
+            if type(item) != dict:
+                errors["non_field_errors"] = "Expected an object"
+            elif row_id not in instances:
+                errors["id"] = f"Invalid pk \"{row_id}\" - object does not exist"
+            elif row_id in deleted_ids:
+                errors["id"] = "Can not update and delete the same object"
+            else:
+                errors = cls.validateValues(item, cls.update_fields, related)
+                if len(errors) == 0:
+                    key = cls.uniqueKey(cls.finalValues(item, instances[row_id]))
+                    if key != None and key in taken and taken[key] != row_id:
+                        errors["non_field_errors"] = cls.unique_error
+                    elif key != None:
+                        taken[key] = row_id
+            update_results.append(cls.result(cls.update_key, index, row_id, errors))
+
+        create_results = []
+        for index, item in enumerate(creates):
+            errors = {}
+            if type(item) != dict:
+                errors["non_field_errors"] = "Expected an object"
+            else:
+                errors = cls.validateValues(item, cls.create_fields, related)
+                for field in cls.required_fields + [cls.related_key]:
+                    if field not in item:
+                        errors[field] = "This field is required"
+                if "id" in item:
+                    errors["id"] = "This field can not be set"
+                if len(errors) == 0:
+                    key = cls.uniqueKey(cls.finalValues(item))
+                    if key != None and key in taken:
+                        errors["non_field_errors"] = cls.unique_error
+                    elif key != None:
+                        taken[key] = None
+            create_results.append(cls.result(cls.create_key, index, None, errors))
+
+        delete_results = []
+        for index, row_id in enumerate(deletes):
+            errors = {}
+            if row_id not in instances:
+                errors["id"] = f"Invalid pk \"{row_id}\" - object does not exist"
+            delete_results.append(cls.result(cls.delete_key, index, row_id, errors))
+        return create_results + update_results + delete_results, instances
+
+    @classmethod
+    def result(cls, op, index, row_id, errors):
+        ret = {"op": op, "index": index, "id": row_id}
+        if len(errors) > 0:
+            ret["status"] = "invalid"
+            ret["errors"] = errors
+        else:
+            ret["status"] = "ok"
+        return ret
+
+    @classmethod
+    def domainIds(cls, related_ids):
+        """
+            The ids of the domains that the related ids belong to
+        """
+        return set(related_ids)
+
+    @classmethod
+    def changedDomainIds(cls, creates, updates, instances):
+        related_ids = {item[cls.related_key] for item in creates + updates if cls.related_key in item}
+        related_ids |= {getattr(cur, cls.related_key) for cur in instances.values()}
+        return cls.domainIds(related_ids)
+
+    @classmethod
+    def prepareRow(cls, obj, changed_fields):
+        """
+            Sets the derived fields of a row before it is written, adding them to changed_fields
+        """
+        pass
+
+    @classmethod
+    def stampRevisions(cls, creates, updates, deletes, instances, revision_scope):
+        """
+            Called before the batch is written, with the instances still holding their old values.
+            Records the tombstones of the words the batch removes from a domain.
+
+            @return {tuple} (create_revisions, update_revisions), the revision of each created row
+                            in order and {id: revision} for the updated rows
+        """
+        return [], {}
+
+    @classmethod
+    def apply(cls, creates, updates, deletes, instances, results):
+        """
+            Writes a validated batch in one transaction and fills in the ids of the created rows
+        """
+        domain_ids = cls.changedDomainIds(creates, updates, instances)
+        with DomainShards.atomic():
+            create_revisions, update_revisions = cls.stampRevisions(creates, updates, deletes, instances, RevisionScope())
+            # Deletes first and creates last, the order validate frees and takes the unique keys in
+            if len(deletes) > 0:
+                cls.model.objects.filter(id__in=deletes).delete()
+            changed_fields = set()
+            to_update = []
+            for item in updates:
+                cur = instances[item["id"]]
+                for field, val in item.items():
+                    if field != "id":
+                        setattr(cur, field, val)
+                        changed_fields.add(field)
+                if cur.id in update_revisions:
+                    cur.revision = update_revisions[cur.id]
+                    changed_fields.add("revision")
+                cls.prepareRow(cur, changed_fields)
+                to_update.append(cur)
+            if len(to_update) > 0 and len(changed_fields) > 0:
+                cls.model.objects.bulk_update(to_update, list(changed_fields))
+            to_create = []
+            for index, item in enumerate(creates):
+                obj = cls.model(**{field: item[field] for field in cls.create_fields + [cls.related_key] if field in item})
+                if index < len(create_revisions):
+                    obj.revision = create_revisions[index]
+                cls.prepareRow(obj, set())
+                to_create.append(obj)
+            created = cls.model.objects.bulk_create(to_create)
+            for domain_id in domain_ids:
+                notify_domain_changed(cls, domain_id)
+        for i, obj in enumerate(created):
+            results[i]["id"] = obj.id
+        return results
+
+    @classmethod
+    def run(cls, data):
+        """
+            Validates and applies a batch.
+
+            @param  {dict}  data    The parsed request body
+
+            @return {tuple} (applied, results) where applied is False if nothing was written
+        """
+        creates, updates, deletes = cls.parse(data)
+        with DomainShards.use(cls.itemId(data, cls.domain_key)):
+            results, instances = cls.validate(creates, updates, deletes)
+            if any(res["status"] != "ok" for res in results):
+                return False, results
+            return True, cls.apply(creates, updates, deletes, instances, results)
+
+
+class WordBatchHandler(BatchHandler):
+
+    model = Word
+
+    related_model = Tag
+    related_key = "tag_id"
+
+    create_fields = ["text", "details"]
+    update_fields = ["text", "details"]
+
+    required_fields = ["text"]
+
+    unique_error = "The fields text, tag must make a unique set"
+
+    @classmethod
+    def prepareRow(cls, obj, changed_fields):
+        obj.signature = Word.signatureOf(obj.text)
+        if "text" in changed_fields:
+            changed_fields.add("signature")
+        obj.details_digest = Word.digestOf(obj.details)
+        if "details" in changed_fields:
+            changed_fields.add("details_digest")
+
+    @classmethod
+    def uniqueKey(cls, values):
+        if type(values.get("text", None)) != str or not cls.isValidId(values.get(cls.related_key, None)):
+            return None
+        return (values[cls.related_key], values["text"])
+
+    @classmethod
+    def uniqueConflicts(cls, keys):
+        if len(keys) == 0:
+            return {}
+        rows = Word.objects.filter(tag_id__in={tag_id for tag_id, _ in keys}, text__in={text for _, text in keys})
+        return {(tag_id, text): row_id for row_id, tag_id, text in rows.values_list("id", "tag_id", "text")}
+
+    @classmethod
+    def domainIds(cls, related_ids):
+        return set(Tag.objects.filter(id__in=related_ids).values_list("domain_id", flat=True).distinct())
+
+    @classmethod
+    def stampRevisions(cls, creates, updates, deletes, instances, revision_scope):
+        tag_ids = {item[cls.related_key] for item in creates + updates if cls.related_key in item}
+        tag_ids |= {cur.tag_id for cur in instances.values()}
+        tags = {tag_id: (text, domain_id) for tag_id, text, domain_id in Tag.objects.filter(id__in=tag_ids).values_list("id", "text", "domain_id")}
+        create_revisions = [revision_scope.revision(tags[item[cls.related_key]][1]) for item in creates]
+        update_revisions = {}
+        removed = {}
+        for item in updates:
+            if len(item) <= 1:
+                continue
+            cur = instances[item["id"]]
+            old_tag, old_domain = tags[cur.tag_id]
+            new_tag, new_domain = tags[item.get(cls.related_key, cur.tag_id)]
+            update_revisions[cur.id] = revision_scope.revision(new_domain)
+            if (old_domain, old_tag, cur.text) != (new_domain, new_tag, item.get("text", cur.text)):
+                removed.setdefault(old_domain, []).append((old_tag, cur.text))
+        for row_id in deletes:
+            cur = instances[row_id]
+            old_tag, old_domain = tags[cur.tag_id]
+            removed.setdefault(old_domain, []).append((old_tag, cur.text))
+        for domain_id, rows in removed.items():
+            DomainRevision.recordDeleted(domain_id, revision_scope.revision(domain_id), rows)
+        return create_revisions, update_revisions
+
+
+class TagBatchHandler(BatchHandler):
+
+    model = Tag
+
+    related_model = Domain
+    related_key = "domain_id"
+
+    create_fields = ["text"]
+    update_fields = []  # The text of a tag is read only once created, the same as TagSerializer
+
+    required_fields = ["text"]
+
+    @classmethod
+    def validateValues(cls, item, fields, related):
+        errors = super().validateValues(item, fields, related)
+        if cls.related_key in item and cls.related_key not in errors and DomainShards.alias(item[cls.related_key]) != DomainShards.current():
+            errors[cls.related_key] = f"The domain is stored in another shard, name it in the {cls.domain_key} of the batch"
+        return errors
+
+    @classmethod
+    def stampRevisions(cls, creates, updates, deletes, instances, revision_scope):
+        # A tag has no revision of its own, but deleting it deletes its words and moving it to
+        # another domain moves them
+        moved = {item["id"]: item[cls.related_key] for item in updates if item.get(cls.related_key, instances[item["id"]].domain_id) != instances[item["id"]].domain_id}
+        removed = {}
+        rows = Word.objects.filter(tag_id__in=list(moved) + list(deletes)).values_list("tag_id", "text")
+        for tag_id, text in rows.iterator():
+            cur = instances[tag_id]
+            removed.setdefault(cur.domain_id, []).append((cur.text, text))
+        for domain_id, words in removed.items():
+            DomainRevision.recordDeleted(domain_id, revision_scope.revision(domain_id), words)
+        for tag_id, domain_id in moved.items():
+            Word.objects.filter(tag_id=tag_id).update(revision=revision_scope.revision(domain_id))
+        return [], {}
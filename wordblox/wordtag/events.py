@@ -0,0 +1,129 @@
+"""
+    Push notifications of domain changes, streamed to clients as Server-Sent Events.
+
+    The domain_revised and domain_synced signals are turned into events and published on a
+    PubSub keyed by domain id. The /events endpoint subscribes a client to its domain and
+    streams the events until it disconnects, so editors and game clients learn about writes
+    made by other users without polling. The events only say that something changed, a client
+    catches up with GET /changes?since=<the revision it has>.
+
+    Events:
+        hello       Sent on connect, {domain_id, revision}
+        revision    The words of the domain changed, {domain_id, revision}
+        sync        A pull of the domain finished, {domain_id, completed, error}
+
+    With DOMAIN_EVENTS_BACKEND = "local" events only reach the clients connected to the worker
+    process that made the change. With "postgres" they go through LISTEN/NOTIFY and reach the
+    clients of every worker.
+
+    The endpoint is an async view and holds no thread while a client is idle when served over
+    ASGI (wordblox.asgi). Under WSGI the events are streamed by a plain generator instead,
+    as WSGI reads an async stream to its end before sending any of it, and every connected
+    client holds a worker thread.
+"""
+import json
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from utils.pubsub import PostgresNotifyBackend, PubSub
+from .revisions import DomainRevision
+
+
+class DomainEvents:
+
+    logger = logging.getLogger(__name__)
+
+    _default_backend = "local"
+
+    _bus = None
+    _backend = None
+
+    @classmethod
+    def keepalive(cls):
+        return getattr(settings, "DOMAIN_EVENTS_KEEPALIVE", 15)
+
+    @classmethod
+    def bus(cls):
+        if cls._bus == None:
+            cls._bus = PubSub(getattr(settings, "DOMAIN_EVENTS_QUEUE_SIZE", 100))
+        return cls._bus
+
+    @classmethod
+    def backend(cls):
+        """
+            @return {PostgresNotifyBackend} The backend shared between processes, or None for local only
+        """
+        if getattr(settings, "DOMAIN_EVENTS_BACKEND", cls._default_backend) != "postgres":
+            return None
+        if cls._backend == None:
+            from psycopg.conninfo import make_conninfo # Only needed when this backend is configured
+            db = settings.DATABASES["default"]
+            conninfo = make_conninfo(dbname=db["NAME"], user=db["USER"], password=db["PASSWORD"], host=db["HOST"], port=db["PORT"])
+            cls._backend = PostgresNotifyBackend(cls.bus(), getattr(settings, "DOMAIN_EVENTS_CHANNEL", "wordtag_domain_events"), conninfo)
+            cls._backend.start()
+        return cls._backend
+
+    @classmethod
+    def publish(cls, domain_id, event, data):
+        backend = cls.backend()
+        message = {"event": event, "data": data}
+        if backend == None:
+            cls.bus().publish(domain_id, message)
+        else:
+            with connection.cursor() as cursor:
+                backend.publish(domain_id, message, cursor)
+
+    @classmethod
+    def onDomainRevised(cls, sender, domain_id, revision, **kwargs):
+        cls.publish(domain_id, "revision", {"domain_id": domain_id, "revision": revision})
+
+    @classmethod
+    def onDomainSynced(cls, sender, domain_id, completed, error="", **kwargs):
+        cls.publish(domain_id, "sync", {"domain_id": domain_id, "completed": completed, "error": error})
+
+    @classmethod
+    def format(cls, event, data):
+        """
+            Encodes an event in the text/event-stream format, revision events carry the revision as their id
+        """
+        ret = f"event: {event}\n"
+        if event in ("hello", "revision") and data.get("revision", None) != None:
+            ret += f"id: {data['revision']}\n"
+        return ret + f"data: {json.dumps(data)}\n\n"
+
+    @classmethod
+    def formatMessage(cls, message):
+        if message == None:
+            # A comment line, keeps proxies from closing an idle connection
+            return ": keepalive\n\n"
+        return cls.format(message["event"], message["data"])
+
+    @classmethod
+    async def stream(cls, domain_id):
+        """
+            Yields the events of a domain as text/event-stream chunks, until the client disconnects
+        """
+        cls.backend()
+        sub = cls.bus().subscribe(domain_id)
+        try:
+            revision = await sync_to_async(DomainRevision.current)(domain_id)
+            yield cls.format("hello", {"domain_id": domain_id, "revision": revision})
+            while True:
+                yield cls.formatMessage(await sub.get(cls.keepalive()))
+        finally:
+            cls.bus().unsubscribe(sub)
+
+    @classmethod
+    def streamSync(cls, domain_id):
+        """
+            stream() for WSGI, blocking the worker thread between events
+        """
+        cls.backend()
+        sub = cls.bus().subscribeSync(domain_id)
+        try:
+            yield cls.format("hello", {"domain_id": domain_id, "revision": DomainRevision.current(domain_id)})
+            while True:
+                yield cls.formatMessage(sub.get(cls.keepalive()))
+        finally:
+            cls.bus().unsubscribe(sub)
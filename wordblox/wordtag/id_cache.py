@@ -0,0 +1,135 @@
+"""
+    Process wide cache of the ids behind domain urls and tag texts.
+
+    Nearly every request names its domain by url and every synced row names its tag by text.
+    Resolving them here once lets the queries that follow filter on integer ids instead of
+    joining the Domain and Tag tables.
+
+    Ids are only cached once the transaction that read or created them has committed, so a
+    rolled back write never leaves an id behind. The entries of a domain are dropped when its
+    Domain or Tag rows are saved or deleted in this process. Changes made by other processes
+    are picked up once an entry is older than ID_CACHE_TTL, except for the tag ids: tagIds
+    checks the ids it takes from the cache with one query by primary key, run in the
+    transaction of the write they are for, so a tag deleted by another process is created
+    again instead of failing the write on its foreign key.
+"""
+from django.conf import settings
+from django.db import transaction
+from utils.lru_cache import LRUCache
+from .models import Domain, Tag
+from .shards import DomainShards
+
+
+class DomainIdCache:
+
+    _domains = None     # url -> domain id
+    _tags = None        # (domain id, tag text) -> tag id
+
+    @classmethod
+    def _cache(cls, name):
+        cache = getattr(cls, name)
+        if cache == None:
+            cache = LRUCache(getattr(settings, "ID_CACHE_SIZE", 10000), getattr(settings, "ID_CACHE_TTL", 300))
+            setattr(cls, name, cache)
+        return cache
+
+    @classmethod
+    def _remember(cls, name, key, value, using=None):
+        transaction.on_commit(lambda: cls._cache(name).set(key, value), using=using)
+
+    @classmethod
+    def domainId(cls, url, create=False):
+        """
+            @param  {str}   url     The url of the domain
+            @param  {bool}  create  Create the domain if it does not exist
+
+            @return {int}   The id of the domain, or None if there is none and create is not set
+        """
+        domain_id = cls._cache("_domains").get(url, None)
+        if domain_id != None:
+            return domain_id
+        if create:
+            domain_id = Domain.objects.get_or_create(url=url, defaults={"shard": DomainShards.assign(url)})[0].id
+        else:
+            domain_id = Domain.objects.filter(url=url).values_list("id", flat=True).first()
+        if domain_id != None:
+            cls._remember("_domains", url, domain_id)
+        return domain_id
+
+    @classmethod
+    def tagIds(cls, domain_id, tag_texts, create=True):
+        """
+            Maps tag text to Tag id for a domain, querying only for the texts that are not cached
+            and creating the missing tags in bulk. The cached ids are checked to still exist.
+
+            If a tag text exists more than once in the domain the oldest row is used.
+
+            @return {dict}  Tag text to Tag id
+        """
+        cache = cls._cache("_tags")
+        tag_map = {}
+        unknown = set()
+        for text in tag_texts:
+            tag_id = cache.get((domain_id, text), None)
+            if tag_id != None:
+                tag_map[text] = tag_id
+            else:
+                unknown.add(text)
+        with DomainShards.use(domain_id) as alias:
+            if len(tag_map) > 0:
+                live = dict(Tag.objects.filter(domain_id=domain_id, id__in=tag_map.values()).values_list("id", "text"))
+                for text, tag_id in list(tag_map.items()):
+                    if live.get(tag_id, None) != text:
+                        # Deleted or moved by another process
+                        cache.pop((domain_id, text))
+                        del tag_map[text]
+                        unknown.add(text)
+        if len(unknown) == 0:
+            return tag_map
+        found = {}
+        with DomainShards.use(domain_id) as alias:
+            for tag_id, text in Tag.objects.filter(domain_id=domain_id, text__in=unknown).order_by("-id").values_list("id", "text"):
+                found[text] = tag_id
+            missing = [text for text in unknown if text not in found]
+            if create and len(missing) > 0:
+                for tagObj in Tag.objects.bulk_create([Tag(text=text, domain_id=domain_id) for text in missing]):
+                    found[tagObj.text] = tagObj.id
+        for text, tag_id in found.items():
+            cls._remember("_tags", (domain_id, text), tag_id, using=alias)
+        tag_map.update(found)
+        return tag_map
+
+    @classmethod
+    def invalidateDomain(cls, domain_id):
+        cls._cache("_domains").evict(lambda url, cached_id: cached_id == domain_id)
+        cls._cache("_tags").evict(lambda key, tag_id: key[0] == domain_id)
+
+    @classmethod
+    def invalidateTag(cls, tag_id):
+        cls._cache("_tags").evict(lambda key, cached_id: cached_id == tag_id)
+
+    @classmethod
+    def clear(cls):
+        cls._cache("_domains").clear()
+        cls._cache("_tags").clear()
+
+    # ----- Signal receivers, connected in WordtagConfig.ready -----
+
+    @classmethod
+    def onDomainSaved(cls, sender, instance, using=None, **kwargs):
+        # The copies of the Domain rows kept by the shards do not change the ids
+        if using in DomainShards.shards():
+            return
+        cls.invalidateDomain(instance.id)
+
+    @classmethod
+    def onTagSaved(cls, sender, instance, **kwargs):
+        # The tag may have moved from another domain, so it is dropped by id and not by key
+        cls.invalidateTag(instance.id)
+
+    @classmethod
+    def onDomainChanged(cls, sender, domain_id, added=None, removed=None, **kwargs):
+        # Writes that bypass the model signals (bulk updates of tags, raw SQL) say so by not
+        # listing the changed rows
+        if added == None and removed == None:
+            cls._cache("_tags").evict(lambda key, tag_id: key[0] == domain_id)
@@ -0,0 +1,21 @@
+import sqlite3
+from django.core.management.base import BaseCommand, CommandError
+from wordtag.replica import copyToReplica
+
+
+class Command(BaseCommand):
+    """
+        Refreshes the SQLite replica file from the primary database. A PostgreSQL replica is kept
+        up to date by the server and needs no copy.
+    """
+
+    help = "Copy the primary SQLite database into the replica file (SQLITE_REPLICA_PATH)"
+
+    def handle(self, *args, **options):
+        try:
+            copied = copyToReplica()
+        except sqlite3.Error as e:
+            raise CommandError(f"Could not copy the database to the replica: {e}")
+        if not copied:
+            raise CommandError("There is no SQLite replica configured, set SQLITE_REPLICA_PATH")
+        self.stdout.write("Copied the primary database to the replica")
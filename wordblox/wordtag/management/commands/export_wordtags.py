@@ -0,0 +1,68 @@
+import csv
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from wordtag.id_cache import DomainIdCache
+from wordtag.models import Word
+from wordtag.shards import DomainShards
+from wordtag.views import SyncHandler
+from utils.create_spellinblox_wordtag_dict import SpellinBloxPushDataCrafter
+
+
+class Command(BaseCommand):
+    """
+        Streams the tag/word/details rows of a domain to a JSONL or CSV file.
+
+        Rows are read with a server side iterator, so memory use is set by the chunk size and not by
+        the size of the domain. The output can be read back by the import command.
+    """
+
+    help = "Export the tag/word/details rows of a domain to a JSONL or CSV file ('-' for stdout)"
+
+    formats = ["jsonl", "csv"]
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to write, '-' writes to stdout")
+        parser.add_argument("--domain", required=True, help="The domain to export")
+        parser.add_argument("--format", choices=self.formats, default=None, help="Defaults to the file extension")
+        parser.add_argument("--chunk-size", type=int, default=None, help="Rows fetched per query, defaults to SYNC_BATCH_SIZE")
+
+    @classmethod
+    def detectFormat(cls, path, file_format):
+        if file_format != None:
+            return file_format
+        for cur in cls.formats:
+            if path.endswith(f".{cur}"):
+                return cur
+        raise CommandError(f"Can not detect the format of {path}, use --format")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        domain = options["domain"]
+        file_format = self.detectFormat(path, options["format"])
+        chunk_size = options["chunk_size"] or SyncHandler.batchSize()
+        domain_id = DomainIdCache.domainId(domain)
+        if domain_id == None:
+            raise CommandError(f"There is no cached data for the domain: {domain}")
+        rows = Word.objects.using(DomainShards.alias(domain_id)).filter(tag__domain_id=domain_id).order_by("tag_id", "id").values_list("tag__text", "text", "details")
+        try:
+            stream = sys.stdout if path == "-" else open(path, "w", newline="", encoding="utf-8")
+        except OSError as e:
+            raise CommandError(f"Could not open {path}: {e}")
+        exported = 0
+        try:
+            if file_format == "csv":
+                writer = csv.writer(stream)
+                writer.writerow([SpellinBloxPushDataCrafter.tag_key, SpellinBloxPushDataCrafter.word_key, SpellinBloxPushDataCrafter.details_key])
+                for tag, word, details in rows.iterator(chunk_size=chunk_size):
+                    writer.writerow([tag, word, details])
+                    exported += 1
+            else:
+                for tag, word, details in rows.iterator(chunk_size=chunk_size):
+                    stream.write(json.dumps(SpellinBloxPushDataCrafter.createTagWordDetailsDict(tag, word, details)))
+                    stream.write("\n")
+                    exported += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        self.stderr.write(f"Exported {exported} rows from {domain}")
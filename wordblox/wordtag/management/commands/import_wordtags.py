@@ -0,0 +1,97 @@
+import csv
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from array import array
+from utils.word_tag_data import TupleKeyCollection
+from wordtag.id_cache import DomainIdCache
+from wordtag.revisions import RevisionScope
+from wordtag.shards import DomainShards
+from wordtag.views import SyncHandler, getWordTagObject
+
+
+class Command(BaseCommand):
+    """
+        Streams tag/word/details rows from a JSONL or CSV file into the cache database for a domain.
+
+        Rows are read and written in chunks through the SyncHandler bulk writers, so memory use is set
+        by the chunk size and not by the size of the file. With --delete, words of the domain that are
+        not in the file are removed once the whole file has been written.
+
+        JSONL rows use the same {tag, word, details} shape as the export command, CSV files must have
+        a header row with the columns tag, word and details.
+    """
+
+    help = "Import tag/word/details rows for a domain from a JSONL or CSV file ('-' for stdin)"
+
+    formats = ["jsonl", "csv"]
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, '-' reads from stdin")
+        parser.add_argument("--domain", required=True, help="The domain the rows are imported into")
+        parser.add_argument("--format", choices=self.formats, default=None, help="Defaults to the file extension")
+        parser.add_argument("--chunk-size", type=int, default=None, help="Rows per chunk, defaults to SYNC_BATCH_SIZE")
+        parser.add_argument("--delete", action="store_true", help="Remove words of the domain that are not in the file")
+
+    @classmethod
+    def detectFormat(cls, path, file_format):
+        if file_format != None:
+            return file_format
+        for cur in cls.formats:
+            if path.endswith(f".{cur}"):
+                return cur
+        raise CommandError(f"Can not detect the format of {path}, use --format")
+
+    @classmethod
+    def readRows(cls, stream, file_format):
+        if file_format == "csv":
+            for row in csv.DictReader(stream):
+                yield getWordTagObject(row)
+        else:
+            for line in stream:
+                line = line.strip()
+                if len(line) > 0:
+                    yield getWordTagObject(json.loads(line))
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        domain = options["domain"]
+        if not SyncHandler.isValidDomain(domain):
+            raise CommandError(f"Can not process the given domain: {domain}")
+        file_format = self.detectFormat(path, options["format"])
+        chunk_size = options["chunk_size"] or SyncHandler.batchSize()
+        try:
+            stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        except OSError as e:
+            raise CommandError(f"Could not open {path}: {e}")
+        imported = 0
+        skipped = 0
+        word_ids = array("q")
+        try:
+            domain_id = DomainIdCache.domainId(domain, create=True)
+            with DomainShards.use(domain_id), DomainShards.atomic():
+                # The whole import is one revision of the domain
+                revision_scope = RevisionScope()
+                collection = TupleKeyCollection()
+                for tag, word, details in self.readRows(stream, file_format):
+                    try:
+                        collection.add(tag, word, details if details != None else "")
+                    except TypeError:
+                        skipped += 1
+                        continue
+                    if len(collection.tag_word_details) >= chunk_size:
+                        imported += len(collection.tag_word_details)
+                        word_ids.extend(SyncHandler.bulkAddToCache(collection, domain, chunk_size, revision_scope))
+                        collection = TupleKeyCollection()
+                if len(collection.tag_word_details) > 0:
+                    imported += len(collection.tag_word_details)
+                    word_ids.extend(SyncHandler.bulkAddToCache(collection, domain, chunk_size, revision_scope))
+                deleted = 0
+                if options["delete"]:
+                    deleted = SyncHandler.removeOthersFromCache(domain, word_ids, chunk_size, revision_scope)
+        except (ValueError, csv.Error) as e:
+            raise CommandError(f"Could not read {path}: {e}")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write(f"Imported {imported} rows into {domain} ({skipped} skipped, {deleted} deleted)")
@@ -0,0 +1,34 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from wordtag.models import Domain
+from wordtag.revisions import DomainRevision
+from wordtag.shards import PRIMARY
+
+
+class Command(BaseCommand):
+    """
+        Deletes the tombstones older than TOMBSTONE_RETENTION_DAYS (see wordtag.revisions). The
+        clients holding a revision from before the pruned tombstones are answered 410 by /changes
+        and download the word list again.
+    """
+
+    help = "Delete the tombstones of deleted words older than the retention period"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=float, default=None, help="Keep the tombstones of the last days, defaults to TOMBSTONE_RETENTION_DAYS")
+        parser.add_argument("--domain", action="append", default=None, help="The url of a domain to prune, every domain by default")
+
+    def handle(self, *args, **options):
+        days = options["days"] if options["days"] != None else DomainRevision.retentionDays()
+        before = timezone.now() - timedelta(days=days)
+        domains = Domain.objects.using(PRIMARY).order_by("id")
+        if options["domain"] != None:
+            domains = domains.filter(url__in=options["domain"])
+        pruned = 0
+        for domain_id, url in domains.values_list("id", "url"):
+            deleted = DomainRevision.prune(domain_id, before)
+            if deleted > 0:
+                self.stdout.write(f"Pruned {deleted} tombstones of {url}")
+            pruned += deleted
+        self.stdout.write(f"Pruned {pruned} tombstones")
@@ -0,0 +1,106 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from wordtag.id_cache import DomainIdCache
+from wordtag.models import Domain, Tag, Word, WordTombstone
+from wordtag.revisions import DomainRevision
+from wordtag.shards import PRIMARY, DomainShards
+from wordtag.views import SyncHandler
+
+
+class Command(BaseCommand):
+    """
+        Moves the Tag, Word and WordTombstone rows of domains from the database they are in into
+        their shard (see wordtag.shards), and records the shard on the Domain row.
+
+        A domain is copied in one transaction on the shard, then Domain.shard is switched over and
+        the rows are deleted from the old database. The rows get new ids in the shard, their text,
+        details and revisions are kept. A domain whose move was interrupted is copied again from
+        the start. The domain's revision and tombstone horizon move with its rows.
+
+        Run it with the workers stopped, a worker still writing to the old database of a domain
+        would leave its rows behind.
+    """
+
+    help = "Move the tags and words of domains into their shard databases (DOMAIN_SHARDS)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--domain", action="append", default=None, help="The url of a domain to move, every domain by default")
+        parser.add_argument("--shard", default=None, help="The shard to move the domains to, by default the one picked for their url")
+        parser.add_argument("--chunk-size", type=int, default=None, help="Rows per query, defaults to SYNC_BATCH_SIZE")
+
+    @classmethod
+    def copyDomain(cls, domain_id, source, target, chunk_size):
+        """
+            Copies the rows of a domain from source to target, replacing any rows the domain already has in target
+
+            @return {int}   The number of Word rows copied
+        """
+        DomainShards.copyDomain(domain_id, target)
+        copied = 0
+        with transaction.atomic(using=target):
+            Word.objects.using(target).filter(tag__domain_id=domain_id).delete()
+            WordTombstone.objects.using(target).filter(domain_id=domain_id).delete()
+            Tag.objects.using(target).filter(domain_id=domain_id).delete()
+            tags = list(Tag.objects.using(source).filter(domain_id=domain_id).order_by("id").values_list("id", "text"))
+            created = Tag.objects.using(target).bulk_create([Tag(text=text, domain_id=domain_id) for _, text in tags])
+            tag_ids = {old_id: tagObj.id for (old_id, _), tagObj in zip(tags, created)}
+            words = Word.objects.using(source).filter(tag__domain_id=domain_id).order_by("id").values_list("tag_id", "text", "details", "signature", "revision", "details_digest")
+            for batch in SyncHandler.iterBatches(words.iterator(chunk_size=chunk_size), chunk_size):
+                Word.objects.using(target).bulk_create(
+                    [
+                        Word(tag_id=tag_ids[tag_id], text=text, details=details, signature=signature, revision=revision, details_digest=details_digest or Word.digestOf(details))
+                        for tag_id, text, details, signature, revision, details_digest in batch
+                    ]
+                )
+                copied += len(batch)
+            tombstones = WordTombstone.objects.using(source).filter(domain_id=domain_id).order_by("id").values_list("tag", "text", "revision", "deleted_at")
+            for batch in SyncHandler.iterBatches(tombstones.iterator(chunk_size=chunk_size), chunk_size):
+                WordTombstone.objects.using(target).bulk_create(
+                    [WordTombstone(domain_id=domain_id, tag=tag, text=text, revision=revision, deleted_at=deleted_at) for tag, text, revision, deleted_at in batch]
+                )
+            Domain.objects.using(target).filter(id=domain_id).update(
+                revision=DomainRevision.current(domain_id, using=source) or 0,
+                tombstone_horizon=DomainRevision.horizon(domain_id, using=source)
+            )
+        return copied
+
+    @classmethod
+    def deleteDomain(cls, domain_id, alias):
+        """
+            Deletes the rows of a domain left in the database it was moved out of
+        """
+        with transaction.atomic(using=alias):
+            Word.objects.using(alias).filter(tag__domain_id=domain_id).delete()
+            WordTombstone.objects.using(alias).filter(domain_id=domain_id).delete()
+            Tag.objects.using(alias).filter(domain_id=domain_id).delete()
+            if alias != PRIMARY:
+                Domain.objects.using(alias).filter(id=domain_id).delete()
+
+    def handle(self, *args, **options):
+        shards = DomainShards.shards()
+        if len(shards) == 0:
+            raise CommandError("There are no shards configured, set DOMAIN_SHARDS")
+        if options["shard"] != None and options["shard"] not in shards:
+            raise CommandError(f"Unknown shard {options['shard']}, expected one of {', '.join(shards)}")
+        chunk_size = options["chunk_size"] or SyncHandler.batchSize()
+        for shard in shards:
+            call_command("migrate", "wordtag", database=shard, verbosity=0)
+        domains = Domain.objects.using(PRIMARY).order_by("id")
+        if options["domain"] != None:
+            domains = domains.filter(url__in=options["domain"])
+        moved = 0
+        for domain in domains:
+            target = options["shard"] or DomainShards.assign(domain.url)
+            source = domain.shard if domain.shard in settings.DATABASES else PRIMARY
+            if source == target:
+                continue
+            copied = self.copyDomain(domain.id, source, target, chunk_size)
+            Domain.objects.using(PRIMARY).filter(id=domain.id).update(shard=target)
+            DomainShards.invalidate(domain.id)
+            DomainIdCache.invalidateDomain(domain.id)
+            self.deleteDomain(domain.id, source)
+            moved += 1
+            self.stdout.write(f"Moved {domain.url} from {source} to {target} ({copied} words)")
+        self.stdout.write(f"Moved {moved} domains")
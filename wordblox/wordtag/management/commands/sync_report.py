@@ -0,0 +1,33 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from wordtag.sync_runs import DomainSyncRuns
+
+
+class Command(BaseCommand):
+    """
+        Prints the pull history aggregated per domain (see wordtag.sync_runs), the slowest
+        domains first, to find the domains that need a bigger batch size, another sync engine or
+        a longer SYNC_FRESHNESS_TTL.
+    """
+
+    help = "Report the pull statistics of each domain from the sync run history"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=float, default=None, help="Only the runs of the last days, every run kept by default")
+        parser.add_argument("--order", default="avg_seconds", help="The aggregate to sort by, such as avg_seconds, max_seconds, failed or written_rows")
+        parser.add_argument("--limit", type=int, default=20, help="The number of domains to list")
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options["days"]) if options["days"] != None else None
+        try:
+            rows = DomainSyncRuns.domains(since, options["order"], options["limit"])
+        except ValueError as e:
+            raise CommandError(f"{e}")
+        for row in rows:
+            self.stdout.write(
+                f"{row['domain']}: {row['runs']} runs, {row['failed']} failed, "
+                f"{row['avg_seconds']:.2f}s average ({row['avg_fetch_seconds']:.2f}s fetch, {row['avg_load_seconds']:.2f}s load, {row['avg_sync_seconds']:.2f}s sync), "
+                f"{row['max_seconds']:.2f}s max, {row['avg_payload_bytes']:.0f} bytes average payload, "
+                f"{row['written_rows']} rows written, {row['unchanged_rows']} unchanged"
+            )
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from wordtag.warmup import Warmup
+
+
+class Command(BaseCommand):
+    """
+        Runs the warm-up of wordtag.warmup in this process. The caches it fills die with the
+        command, what outlasts it are the search tables and, with --build-snapshots, the domain
+        snapshots the workers map on their own warm-up.
+    """
+
+    help = "Preload the id caches, snapshots and word indexes of the most recently pulled domains"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--domain", action="append", default=None, help="The url of a domain to warm, the WARMUP_DOMAINS most recently pulled by default")
+        parser.add_argument("--build-snapshots", action="store_true", help="Write the snapshots of domains that have none up to date (needs DOMAIN_SNAPSHOTS)")
+
+    def handle(self, *args, **options):
+        stats = Warmup.run(options["domain"], options["build_snapshots"])
+        self.stdout.write(f"Warmed up {stats['domains']} domains ({stats['snapshots']} from snapshots) in {stats['seconds']}s")
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:13
+
+from django.db import migrations, models
+
+
+def fill_signatures(apps, schema_editor):
+    Word = apps.get_model("wordtag", "Word")
+    words = Word.objects.using(schema_editor.connection.alias)
+    batch = []
+    for word_id, text in words.values_list("id", "text").iterator(chunk_size=2000):
+        batch.append(Word(id=word_id, signature="".join(sorted(char for char in text.lower() if char.isalpha()))))
+        if len(batch) >= 2000:
+            words.bulk_update(batch, ["signature"])
+            batch = []
+    if len(batch) > 0:
+        words.bulk_update(batch, ["signature"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordtag', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='word',
+            name='signature',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=75),
+        ),
+        migrations.RunPython(fill_signatures, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordtag', '0002_word_signature'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domain',
+            name='last_synced',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='domain',
+            name='sync_ttl',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordtag', '0003_domain_last_synced_sync_ttl'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domain',
+            name='revision',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='word',
+            name='revision',
+            field=models.PositiveBigIntegerField(db_index=True, default=0),
+        ),
+        migrations.CreateModel(
+            name='WordTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(max_length=75)),
+                ('text', models.CharField(max_length=75)),
+                ('revision', models.PositiveBigIntegerField()),
+                ('domain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tombstones', to='wordtag.domain')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['domain', 'revision'], name='wordtag_wor_domain__5077a6_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordtag', '0004_revisions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domain',
+            name='shard',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordtag', '0005_domain_shard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField()),
+                ('engine', models.CharField(max_length=16)),
+                ('sync_method', models.CharField(max_length=16)),
+                ('sync_priority', models.CharField(max_length=16)),
+                ('sync_control', models.CharField(max_length=16)),
+                ('old_rows', models.PositiveIntegerField(default=0)),
+                ('new_rows', models.PositiveIntegerField(default=0)),
+                ('changed_rows', models.PositiveIntegerField(default=0)),
+                ('unchanged_rows', models.PositiveIntegerField(default=0)),
+                ('deleted_rows', models.PositiveIntegerField(default=0)),
+                ('fetch_seconds', models.FloatField(default=0)),
+                ('load_seconds', models.FloatField(default=0)),
+                ('sync_seconds', models.FloatField(default=0)),
+                ('total_seconds', models.FloatField(default=0)),
+                ('payload_bytes', models.PositiveBigIntegerField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('error', models.TextField(blank=True, default='')),
+                ('domain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_runs', to='wordtag.domain')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['domain', 'started'], name='wordtag_syn_domain__84a252_idx'), models.Index(fields=['started'], name='wordtag_syn_started_a4d68c_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordtag', '0006_syncrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncrun',
+            name='tags',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:14
+
+import hashlib
+from django.db import migrations, models
+
+
+def fill_digests(apps, schema_editor):
+    Word = apps.get_model("wordtag", "Word")
+    words = Word.objects.using(schema_editor.connection.alias)
+    batch = []
+    for word_id, details in words.values_list("id", "details").iterator(chunk_size=2000):
+        batch.append(Word(id=word_id, details_digest=hashlib.blake2b(details.encode("utf-8"), digest_size=16).hexdigest()))
+        if len(batch) >= 2000:
+            words.bulk_update(batch, ["details_digest"])
+            batch = []
+    if len(batch) > 0:
+        words.bulk_update(batch, ["details_digest"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordtag', '0007_syncrun_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='word',
+            name='details_digest',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.RunPython(fill_digests, migrations.RunPython.noop),
+    ]
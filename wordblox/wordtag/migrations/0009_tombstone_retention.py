@@ -0,0 +1,24 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:18
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordtag', '0008_word_details_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domain',
+            name='tombstone_horizon',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='wordtombstone',
+            name='deleted_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
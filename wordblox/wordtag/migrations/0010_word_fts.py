@@ -0,0 +1,67 @@
+from django.db import migrations
+
+# The FTS table searched by wordtag.search, kept in step with the Word and Tag tables by triggers.
+# Only created on SQLite, other backends search with LIKE.
+
+TABLE = "wordtag_word_fts"
+
+ROW = "SELECT {w}.id, {w}.text, {w}.details, t.text, 'd' || t.domain_id FROM wordtag_tag t WHERE t.id = {w}.tag_id"
+
+CREATE = [
+    f"CREATE VIRTUAL TABLE {TABLE} USING fts5(text, details, tag, domain, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    f"""CREATE TRIGGER {TABLE}_ai AFTER INSERT ON wordtag_word BEGIN
+        INSERT INTO {TABLE}(rowid, text, details, tag, domain) {ROW.format(w="new")};
+    END""",
+    f"""CREATE TRIGGER {TABLE}_ad AFTER DELETE ON wordtag_word BEGIN
+        DELETE FROM {TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER {TABLE}_au AFTER UPDATE OF text, details, tag_id ON wordtag_word BEGIN
+        DELETE FROM {TABLE} WHERE rowid = old.id;
+        INSERT INTO {TABLE}(rowid, text, details, tag, domain) {ROW.format(w="new")};
+    END""",
+    f"""CREATE TRIGGER {TABLE}_tag_au AFTER UPDATE OF text, domain_id ON wordtag_tag BEGIN
+        DELETE FROM {TABLE} WHERE rowid IN (SELECT id FROM wordtag_word WHERE tag_id = new.id);
+        INSERT INTO {TABLE}(rowid, text, details, tag, domain)
+            SELECT w.id, w.text, w.details, new.text, 'd' || new.domain_id FROM wordtag_word w WHERE w.tag_id = new.id;
+    END""",
+    f"""INSERT INTO {TABLE}(rowid, text, details, tag, domain)
+        SELECT w.id, w.text, w.details, t.text, 'd' || t.domain_id FROM wordtag_word w JOIN wordtag_tag t ON t.id = w.tag_id""",
+]
+
+DROP = [
+    f"DROP TRIGGER IF EXISTS {TABLE}_tag_au",
+    f"DROP TRIGGER IF EXISTS {TABLE}_au",
+    f"DROP TRIGGER IF EXISTS {TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {TABLE}_ai",
+    f"DROP TABLE IF EXISTS {TABLE}",
+]
+
+
+def createIndex(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        # Databases that predate this migration may have had the table created at runtime
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [TABLE])
+        if cursor.fetchone() != None:
+            return
+    for statement in CREATE:
+        schema_editor.execute(statement)
+
+
+def dropIndex(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in DROP:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordtag', '0009_tombstone_retention'),
+    ]
+
+    operations = [
+        migrations.RunPython(createIndex, dropIndex),
+    ]
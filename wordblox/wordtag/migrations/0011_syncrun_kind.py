@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordtag', '0010_word_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncrun',
+            name='kind',
+            field=models.CharField(default='pull', max_length=8),
+        ),
+    ]
@@ -1,4 +1,6 @@
+import hashlib
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 
@@ -10,6 +12,11 @@ class TextAbstractModel(models.Model):
 
 class Domain(models.Model): # Questionable, consider before migrating
     url = models.URLField(unique=True)
+    last_synced = models.DateTimeField(null=True, blank=True) # When the last pull from the external server completed
+    sync_ttl = models.PositiveIntegerField(null=True, blank=True) # Seconds a pull stays fresh, settings.SYNC_FRESHNESS_TTL when not set
+    revision = models.PositiveBigIntegerField(default=0) # Bumped by every write to the domain's words, see wordtag.revisions
+    tombstone_horizon = models.PositiveBigIntegerField(default=0) # The tombstones up to this revision were pruned, see wordtag.revisions
+    shard = models.CharField(max_length=64, blank=True, default="") # Database alias holding the domain's tags and words, "" for the primary, see wordtag.shards
 
 class Tag(TextAbstractModel):
     domain = models.ForeignKey(Domain, related_name="tags", on_delete=models.CASCADE)
@@ -17,6 +24,81 @@ class Tag(TextAbstractModel):
 class Word(TextAbstractModel):
     tag = models.ForeignKey(Tag, related_name="words", on_delete=models.CASCADE)
     details = models.TextField()
+    signature = models.CharField(max_length=75, default="", editable=False, db_index=True) # sorted letters of text, for anagram lookups
+    revision = models.PositiveBigIntegerField(default=0, db_index=True) # Domain revision this row was last written at
+    details_digest = models.CharField(max_length=32, default="", editable=False) # digestOf(details), compared by the syncs instead of the details
 
     class Meta:
-        unique_together = ("text", "tag")
\ No newline at end of file
+        unique_together = ("text", "tag")
+
+    @staticmethod
+    def signatureOf(text: str):
+        """
+            The letters of the text, lower cased and sorted. Words that can be spelled with the
+            same letter blocks share a signature.
+        """
+        return "".join(sorted(char for char in text.lower() if char.isalpha()))
+
+    @staticmethod
+    def digestOf(details: str):
+        """
+            A 128 bit digest of the details, so that a sync can tell whether the details of a row
+            change without reading them
+        """
+        return hashlib.blake2b(details.encode("utf-8"), digest_size=16).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.signature = Word.signatureOf(self.text)
+        update_fields = kwargs.get("update_fields", None)
+        if update_fields != None and "text" in update_fields:
+            kwargs["update_fields"] = set(update_fields) | {"signature"}
+        if "details" not in self.get_deferred_fields():
+            self.details_digest = Word.digestOf(self.details)
+            update_fields = kwargs.get("update_fields", None)
+            if update_fields != None and "details" in update_fields:
+                kwargs["update_fields"] = set(update_fields) | {"details_digest"}
+        super().save(*args, **kwargs)
+
+
+class WordTombstone(models.Model):
+    """
+        Records a deleted word and the domain revision it was deleted at, for the changes feed
+    """
+    domain = models.ForeignKey(Domain, related_name="tombstones", on_delete=models.CASCADE)
+    tag = models.CharField(max_length=75)
+    text = models.CharField(max_length=75)
+    revision = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now) # For the pruning, see DomainRevision.prune
+
+    class Meta:
+        indexes = [models.Index(fields=["domain", "revision"])]
+
+
+class SyncRun(models.Model):
+    """
+        One pull of a domain from the external server, or push to it: the settings it ran with,
+        what it did to the cached rows and how long each phase took. See wordtag.sync_runs
+    """
+    domain = models.ForeignKey(Domain, related_name="sync_runs", on_delete=models.CASCADE)
+    started = models.DateTimeField()
+    kind = models.CharField(max_length=8, default="pull") # "pull" or "push", a push leaves the settings and row counts empty
+    engine = models.CharField(max_length=16) # SYNC_ENGINE the pull ran with
+    sync_method = models.CharField(max_length=16)
+    sync_priority = models.CharField(max_length=16)
+    sync_control = models.CharField(max_length=16)
+    tags = models.TextField(blank=True, default="") # Comma separated tags of a partial pull, "" for the whole domain
+    old_rows = models.PositiveIntegerField(default=0) # Only in the collection without priority
+    new_rows = models.PositiveIntegerField(default=0) # Only in the collection with priority
+    changed_rows = models.PositiveIntegerField(default=0) # In both and written
+    unchanged_rows = models.PositiveIntegerField(default=0) # In both and left as they were
+    deleted_rows = models.PositiveIntegerField(default=0)
+    fetch_seconds = models.FloatField(default=0) # Fetching and parsing the external data
+    load_seconds = models.FloatField(default=0) # Loading the cached data, python engine only
+    sync_seconds = models.FloatField(default=0) # Diffing and writing
+    total_seconds = models.FloatField(default=0)
+    payload_bytes = models.PositiveBigIntegerField(default=0) # Size of the external server's response
+    completed = models.BooleanField(default=False)
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        indexes = [models.Index(fields=["domain", "started"]), models.Index(fields=["started"])]
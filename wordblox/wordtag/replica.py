@@ -0,0 +1,234 @@
+"""
+    Read replica routing.
+
+    When a "replica" database is configured, reads of the wordtag models made inside
+    replicaReads() go to it and everything else stays on the primary ("default"). Only the
+    reads that can be served slightly stale opt in: the list/retrieve actions of the API
+    viewsets and the snapshot builder. The sync writers read and write on the primary, as a
+    diff against a lagging copy would undo recent writes.
+
+    Once a request has written a model to the primary its later reads of that model stay
+    there, so a client always reads its own writes. Writes to other apps (the session, the
+    user) pin nothing. PrimaryPinMiddleware scopes the pinning to the request.
+
+    With SQLite the replica is a second file refreshed from the primary by copyToReplica(), run
+    by the copy_replica command, or after completed pulls when REPLICA_COPY_ON_SYNC is set. The
+    copy is a full backup of the database, so the pulls only schedule it: a background thread
+    waits REPLICA_COPY_DELAY seconds, so the pulls landing in that time share one copy, and
+    pulls finishing while it copies get one more copy after it. A PostgreSQL replica is kept up
+    to date by the server's own replication.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+PRIMARY = "default"
+
+_replica_reads = ContextVar("wordtag_replica_reads", default=False)
+_pinned = ContextVar("wordtag_pinned_to_primary", default=frozenset())    # labels of the models written
+
+_copy_lock = threading.Lock()
+_copy_thread = None
+_copy_pending = False
+_copy_callbacks = []
+
+logger = logging.getLogger(__name__)
+
+
+def replicaAlias():
+    """
+        @return {str}   The alias of the replica database, or None if there is none
+    """
+    alias = getattr(settings, "REPLICA_DB_ALIAS", "replica")
+    return alias if alias in settings.DATABASES else None
+
+
+@contextmanager
+def replicaReads():
+    """
+        Sends the wordtag reads made inside the block to the replica
+    """
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def pinToPrimary(model):
+    """
+        Sends the later reads of the model in this request to the primary
+    """
+    pinned = _pinned.get()
+    if model._meta.label not in pinned:
+        _pinned.set(pinned | {model._meta.label})
+
+
+class PrimaryReplicaRouter:
+
+    app_label = "wordtag"
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != self.app_label or not _replica_reads.get() or model._meta.label in _pinned.get():
+            return None
+        return replicaAlias()
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            pinToPrimary(model)
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema and rows from the primary
+        return db != replicaAlias()
+
+
+class PrimaryPinMiddleware:
+    """
+        Limits the read-your-writes pinning to the request that wrote
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _pinned.set(frozenset())
+        try:
+            return self.get_response(request)
+        finally:
+            _pinned.reset(token)
+
+    async def __acall__(self, request):
+        token = _pinned.set(frozenset())
+        try:
+            return await self.get_response(request)
+        finally:
+            _pinned.reset(token)
+
+
+class ReplicaReadMixin:
+    """
+        Serves the list and retrieve actions of a viewset from the replica
+    """
+
+    def list(self, request, *args, **kwargs):
+        with replicaReads():
+            return super().list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        with replicaReads():
+            return super().retrieve(request, *args, **kwargs)
+
+
+def copyToReplica():
+    """
+        Copies the primary SQLite database into the replica file with SQLite's online backup,
+        which gives a consistent copy while the primary is in use.
+
+        @return {bool}  False if there is no SQLite replica to copy to
+    """
+    if not hasSqliteReplica():
+        return False
+    alias = replicaAlias()
+    source = sqlite3.connect(settings.DATABASES[PRIMARY]["NAME"])
+    target = sqlite3.connect(settings.DATABASES[alias]["NAME"])
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    logger.info("Copied %s to the replica %s", settings.DATABASES[PRIMARY]["NAME"], settings.DATABASES[alias]["NAME"])
+    return True
+
+
+def hasSqliteReplica():
+    alias = replicaAlias()
+    return alias != None and settings.DATABASES[PRIMARY]["ENGINE"] == "django.db.backends.sqlite3" and settings.DATABASES[alias]["ENGINE"] == "django.db.backends.sqlite3"
+
+
+def scheduleCopy():
+    """
+        Copies the primary into the SQLite replica in a background thread after
+        REPLICA_COPY_DELAY seconds. A copy already scheduled covers this one, and a copy already
+        running is followed by one more.
+
+        @return {bool}  False if there is no SQLite replica to copy to
+    """
+    global _copy_thread, _copy_pending
+    if not hasSqliteReplica():
+        return False
+    with _copy_lock:
+        _copy_pending = True
+        if _copy_thread != None:
+            return True
+        _copy_thread = threading.Thread(target=_copyLoop, name="wordtag-replica-copy", daemon=True)
+        thread = _copy_thread
+    thread.start()
+    return True
+
+
+def afterCopy(callback):
+    """
+        Runs callback in the copy thread once the replica holds what is committed now.
+
+        @return {bool}  False if no copy is scheduled, the caller runs callback itself then
+    """
+    global _copy_pending
+    with _copy_lock:
+        if _copy_thread == None:
+            return False
+        # A copy that is already running may have started before the commit
+        _copy_pending = True
+        _copy_callbacks.append(callback)
+        return True
+
+
+def _copyLoop():
+    global _copy_thread, _copy_pending, _copy_callbacks
+    try:
+        while True:
+            time.sleep(getattr(settings, "REPLICA_COPY_DELAY", 1))
+            with _copy_lock:
+                _copy_pending = False
+                callbacks = _copy_callbacks
+                _copy_callbacks = []
+            try:
+                copyToReplica()
+            except sqlite3.Error as e:
+                logger.error("Could not copy the database to the replica: %s", e)
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error("A callback waiting for the replica copy failed: %s", e)
+            with _copy_lock:
+                if not _copy_pending:
+                    _copy_thread = None
+                    return
+    finally:
+        with _copy_lock:
+            if _copy_thread is threading.current_thread():
+                _copy_thread = None
+        for conn in connections.all(initialized_only=True):
+            conn.close()
+
+
+def onDomainSynced(sender, domain_id, completed, error="", **kwargs):
+    if completed and getattr(settings, "REPLICA_COPY_ON_SYNC", False):
+        scheduleCopy()
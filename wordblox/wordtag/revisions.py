@@ -0,0 +1,143 @@
+"""
+    Domain revisions and the changes feed.
+
+    Every write to the words of a domain bumps Domain.revision once and stamps the rows it
+    creates or updates with the new revision. Deleted words leave a WordTombstone at the
+    revision they were deleted at. A client holding revision N then only needs the words and
+    tombstones with a revision above N to catch up.
+
+    Tombstones older than TOMBSTONE_RETENTION_DAYS are deleted by the prune_tombstones command,
+    which raises Domain.tombstone_horizon to the newest revision it pruned. A client holding a
+    revision below the horizon may have missed deletes, so it is told to download the whole
+    word list again instead (ResyncRequired).
+
+    The revision and the horizon are kept with the rows of the domain, on the Domain row of the
+    database holding them (see wordtag.shards): the primary's, or the copy in the domain's
+    shard. A bump is then part of the transaction writing the rows, so it is never seen before
+    them and is undone with them.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max
+from .models import Domain, WordTombstone, Word
+from .shards import DomainShards
+from .signals import notify_domain_revised
+
+
+class ResyncRequired(Exception):
+
+    def __init__(self, revision, horizon):
+        super().__init__(f"The tombstones up to revision {horizon} were pruned, download the word list again")
+        self.revision = revision
+        self.horizon = horizon
+
+
+class RevisionScope:
+    """
+        Hands out one revision per domain for a whole write (a sync, an import or a batch).
+        The revision of a domain is bumped the first time it is asked for, so a write that
+        ends up changing nothing leaves the revision alone.
+    """
+
+    def __init__(self):
+        self._revisions = {}
+
+    def revision(self, domain_id):
+        revision = self._revisions.get(domain_id, None)
+        if revision == None:
+            revision = DomainRevision.bump(domain_id)
+            self._revisions[domain_id] = revision
+        return revision
+
+    def revisions(self):
+        """
+            @return {dict}  domain_id -> revision, for the domains that were bumped
+        """
+        return dict(self._revisions)
+
+
+class DomainRevision:
+
+    @classmethod
+    def bump(cls, domain_id):
+        """
+            Bumps the revision in the database of the domain, inside the transaction open there
+
+            @return {int}   The new revision of the domain
+        """
+        alias = DomainShards.alias(domain_id)
+        with transaction.atomic(using=alias):
+            Domain.objects.using(alias).filter(id=domain_id).update(revision=F("revision") + 1)
+            revision = Domain.objects.using(alias).filter(id=domain_id).values_list("revision", flat=True).get()
+            notify_domain_revised(cls, domain_id, revision)
+            return revision
+
+    @classmethod
+    def current(cls, domain_id, using=None):
+        """
+            @param  {str}   using   The database to read from, by default the one of the domain
+        """
+        return Domain.objects.using(using or DomainShards.alias(domain_id)).filter(id=domain_id).values_list("revision", flat=True).first()
+
+    @classmethod
+    def recordDeleted(cls, domain_id, revision, rows):
+        """
+            Leaves a tombstone for each deleted (tag, word) pair
+        """
+        WordTombstone.objects.bulk_create(
+            [WordTombstone(domain_id=domain_id, tag=tag, text=word, revision=revision) for tag, word in rows],
+            batch_size=getattr(settings, "SYNC_BATCH_SIZE", 1000)
+        )
+
+    @classmethod
+    def horizon(cls, domain_id, using=None):
+        return Domain.objects.using(using or DomainShards.alias(domain_id)).filter(id=domain_id).values_list("tombstone_horizon", flat=True).first() or 0
+
+    @classmethod
+    def retentionDays(cls):
+        return getattr(settings, "TOMBSTONE_RETENTION_DAYS", 30)
+
+    @classmethod
+    def prune(cls, domain_id, before):
+        """
+            Deletes the tombstones of a domain deleted before a time, along with every tombstone
+            at or below their revisions, and raises the domain's horizon to match
+
+            @param  {datetime}  before  Tombstones deleted before then are pruned
+            @return {int}   The number of tombstones deleted
+        """
+        with DomainShards.use(domain_id) as alias, DomainShards.atomic():
+            horizon = WordTombstone.objects.filter(domain_id=domain_id, deleted_at__lt=before).aggregate(revision=Max("revision"))["revision"]
+            if horizon == None:
+                return 0
+            deleted = WordTombstone.objects.filter(domain_id=domain_id, revision__lte=horizon).delete()[0]
+            Domain.objects.using(alias).filter(id=domain_id, tombstone_horizon__lt=horizon).update(tombstone_horizon=horizon)
+        return deleted
+
+    @classmethod
+    def changes(cls, domain_id, since):
+        """
+            The words written and deleted in a domain after revision since.
+
+            A tombstone is left out when the word was written again after it was deleted.
+
+            @return {dict}  {revision, since, changed: [{id, tag, word, details, revision}], deleted: [{tag, word, revision}]}
+            @raise  {ResyncRequired}    If since is below the tombstone horizon of the domain
+        """
+        revision = cls.current(domain_id)
+        horizon = cls.horizon(domain_id)
+        # A client starting from 0 has no words to delete
+        if since > 0 and since < horizon:
+            raise ResyncRequired(revision, horizon)
+        changed = []
+        written = {}
+        rows = Word.objects.filter(tag__domain_id=domain_id, revision__gt=since).order_by("revision", "id")
+        for word_id, tag, text, details, word_revision in rows.values_list("id", "tag__text", "text", "details", "revision").iterator():
+            changed.append({"id": word_id, "tag": tag, "word": text, "details": details, "revision": word_revision})
+            written[(tag, text)] = word_revision
+        deleted = []
+        tombstones = WordTombstone.objects.filter(domain_id=domain_id, revision__gt=since).order_by("revision", "id")
+        for tag, text, deleted_revision in tombstones.values_list("tag", "text", "revision").iterator():
+            if written.get((tag, text), -1) < deleted_revision:
+                deleted.append({"tag": tag, "word": text, "revision": deleted_revision})
+        return {"revision": revision, "since": since, "changed": changed, "deleted": deleted}
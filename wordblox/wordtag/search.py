@@ -0,0 +1,152 @@
+"""
+    Full text search over the words of a domain.
+
+    On SQLite this is backed by an FTS5 table mirroring Word.text, Word.details and the tag
+    text, with the word id as its rowid. Triggers on the Word and Tag tables keep it in step
+    with every writer (the API, the batch endpoints and the sync), so nothing else has to
+    maintain it. The table and triggers are created, and filled, by the 0010_word_fts migration.
+
+    The domain is stored as a token ("d<id>") in its own column so that a search is scoped to a
+    domain inside the FTS index instead of by filtering its results.
+
+    When the domains are sharded each shard has its own FTS table, kept by its own triggers.
+
+    Other database backends, and SQLite databases the migration has not created the table in,
+    fall back to a LIKE based query on the Word table.
+"""
+import re
+from django.db import connections, transaction
+from .models import Tag, Word
+from .shards import PRIMARY, DomainShards
+
+
+class WordSearchIndex:
+
+    table = "wordtag_word_fts"
+
+    word_table = Word._meta.db_table
+    tag_table = Tag._meta.db_table
+
+    # bm25 weights for the text, details, tag and domain columns
+    rank_weights = (10.0, 1.0, 5.0, 0.0)
+
+    default_limit = 20
+    max_limit = 200
+
+    token_regex = re.compile(r"\w+", re.UNICODE)
+
+    _supported = {}     # database alias -> whether it has the FTS table
+
+    @classmethod
+    def isSupported(cls, alias=PRIMARY):
+        """
+            @return {bool}  Whether the database has the FTS table, checked once per alias
+        """
+        supported = cls._supported.get(alias, None)
+        if supported == None:
+            supported = connections[alias].vendor == "sqlite"
+            if supported:
+                with connections[alias].cursor() as cursor:
+                    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [cls.table])
+                    supported = cursor.fetchone() != None
+            cls._supported[alias] = supported
+        return supported
+
+    @classmethod
+    def domainToken(cls, domain_id):
+        return f"d{domain_id}"
+
+    @classmethod
+    def _fill(cls, cursor):
+        cursor.execute(
+            f"INSERT INTO {cls.table}(rowid, text, details, tag, domain) "
+            f"SELECT w.id, w.text, w.details, t.text, 'd' || t.domain_id FROM {cls.word_table} w JOIN {cls.tag_table} t ON t.id = w.tag_id"
+        )
+
+    @classmethod
+    def rebuild(cls, alias=PRIMARY):
+        """
+            Refills the FTS table of a database from its Word and Tag tables
+        """
+        if not cls.isSupported(alias):
+            return
+        with transaction.atomic(using=alias):
+            with connections[alias].cursor() as cursor:
+                cursor.execute(f"DELETE FROM {cls.table}")
+                cls._fill(cursor)
+
+    @classmethod
+    def buildQuery(cls, query, domain_id, prefix=True, tag=None):
+        """
+            Builds an FTS5 MATCH expression from free text. Every word of the query has to match,
+            the last one as a prefix when prefix is set.
+
+            @return {str}   The expression, or None if the query has no searchable words
+        """
+        tokens = cls.token_regex.findall(query or "")
+        if len(tokens) == 0:
+            return None
+        terms = [f'"{token}"' for token in tokens]
+        if prefix:
+            terms[-1] = terms[-1] + "*"
+        expression = f'domain : "{cls.domainToken(domain_id)}" AND ({" AND ".join(terms)})'
+        if tag != None:
+            tag_tokens = cls.token_regex.findall(tag)
+            if len(tag_tokens) > 0:
+                expression += " AND tag : (" + " AND ".join(f'"{token}"' for token in tag_tokens) + ")"
+        return expression
+
+    @classmethod
+    def sanitizeLimit(cls, limit):
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            return cls.default_limit
+        return min(max(limit, 1), cls.max_limit)
+
+    @classmethod
+    def search(cls, query, domain_id, prefix=True, tag=None, limit=None):
+        """
+            Searches the words of a domain, best matches first.
+
+            @param  {str}   query   Free text, every word has to match
+            @param  {int}   domain_id   The domain to search in
+            @param  {bool}  prefix  Match the last word as a prefix
+            @param  {str}   tag     Optionally restrict the search to a tag
+            @param  {int}   limit   The maximum number of results
+
+            @return {list}  Dicts with the id, tag, word and details of each match
+        """
+        limit = cls.sanitizeLimit(limit)
+        alias = DomainShards.alias(domain_id)
+        if not cls.isSupported(alias):
+            with DomainShards.use(domain_id):
+                return cls._searchFallback(query, domain_id, prefix, tag, limit)
+        expression = cls.buildQuery(query, domain_id, prefix, tag)
+        if expression == None:
+            return []
+        weights = ", ".join(str(weight) for weight in cls.rank_weights)
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, tag, text, details FROM {cls.table} WHERE {cls.table} MATCH %s "
+                f"ORDER BY bm25({cls.table}, {weights}) LIMIT %s",
+                [expression, limit]
+            )
+            rows = cursor.fetchall()
+        return [{"id": word_id, "tag": tag_text, "word": text, "details": details} for word_id, tag_text, text, details in rows]
+
+    @classmethod
+    def _searchFallback(cls, query, domain_id, prefix, tag, limit):
+        """
+            Unranked search for databases without FTS5, every word has to be in the text or details
+        """
+        words = Word.objects.filter(tag__domain_id=domain_id)
+        tokens = cls.token_regex.findall(query or "")
+        if len(tokens) == 0:
+            return []
+        for token in tokens:
+            words = words.filter(text__icontains=token) | words.filter(details__icontains=token)
+        if tag != None:
+            words = words.filter(tag__text=tag)
+        rows = words.values_list("id", "tag__text", "text", "details")[:limit]
+        return [{"id": word_id, "tag": tag_text, "word": text, "details": details} for word_id, tag_text, text, details in rows]
@@ -40,11 +40,14 @@ class WordSerializer(AuthenticatedSerializer):
 
     class Meta:
         model = Word
-        fields = ['id', 'text', 'details', "tag", "tag_id"]
+        fields = ['id', 'text', 'details', "details_digest", "tag", "tag_id"]
+        read_only_fields = ["details_digest"]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if self.instance: # will not exist on creation
             self.fields['text'].ready_only = True
+        if self.context.get("omit_details", False): # the list was read with the details deferred
+            self.fields.pop('details')
 
 
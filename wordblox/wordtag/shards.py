@@ -0,0 +1,199 @@
+"""
+    Optional per domain sharding of the Tag, Word and WordTombstone rows.
+
+    With DOMAIN_SHARDS set, every new domain is given one of the shard databases, picked by a
+    hash of its url, and its rows are written there. A long sync of one domain then only holds
+    the write lock of its own shard instead of the one of the whole database, so writes scale
+    with the number of shards.
+
+    The Domain rows, and with them the sync state, stay on the primary ("default").
+    Domain.shard names the database holding the rows of a domain, "" being the primary. Each
+    shard keeps a copy of the Domain rows of its domains for the foreign keys, and that copy
+    holds the domain's revision and tombstone horizon (see wordtag.revisions), so they are
+    written in the same transaction as the rows.
+
+    The code that knows the domain picks the database:
+
+        with DomainShards.use(domain_id), DomainShards.atomic():
+            ...
+
+    sends the queries made in the block on the sharded models to the domain's database
+    (through DomainShardRouter) and opens the transaction there. The handlers, the sync
+    writers, the batch endpoints and the commands do this, so the code they call reads as if
+    there was one database. The API viewsets do it for the domain named by their domain_id
+    query parameter and use the primary without one.
+
+    Existing domains are moved into a shard by the shard_domains command.
+"""
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import transaction
+from utils.lru_cache import LRUCache
+from .models import Domain
+
+PRIMARY = "default"
+
+_shard = ContextVar("wordtag_shard", default=None)
+
+
+class DomainShards:
+
+    sharded_models = {"tag", "word", "wordtombstone"}
+
+    _aliases = None     # domain id -> Domain.shard
+    _copied = set()     # (alias, domain id) of the Domain rows known to be copied to a shard
+
+    @classmethod
+    def shards(cls):
+        """
+            @return {list}  The aliases of the shard databases, empty when sharding is off
+        """
+        return [alias for alias in getattr(settings, "DOMAIN_SHARDS", []) if alias in settings.DATABASES]
+
+    @classmethod
+    def isEnabled(cls):
+        return len(cls.shards()) > 0
+
+    @classmethod
+    def isSharded(cls, model):
+        return model._meta.app_label == "wordtag" and model._meta.model_name in cls.sharded_models
+
+    @classmethod
+    def assign(cls, url):
+        """
+            @return {str}   The shard a new domain is placed in, "" for the primary
+        """
+        shards = cls.shards()
+        if len(shards) == 0:
+            return ""
+        return shards[zlib.crc32(url.encode("utf-8")) % len(shards)]
+
+    @classmethod
+    def _cache(cls):
+        if cls._aliases == None:
+            cls._aliases = LRUCache(getattr(settings, "ID_CACHE_SIZE", 10000), getattr(settings, "ID_CACHE_TTL", 300))
+        return cls._aliases
+
+    @classmethod
+    def alias(cls, domain_id):
+        """
+            @return {str}   The database holding the rows of the domain
+        """
+        if domain_id == None or not cls.isEnabled():
+            return PRIMARY
+        shard = cls._cache().get(domain_id, None)
+        if shard == None:
+            shard = Domain.objects.using(PRIMARY).filter(id=domain_id).values_list("shard", flat=True).first() or ""
+            cls._cache().set(domain_id, shard)
+        return shard if shard in settings.DATABASES else PRIMARY
+
+    @classmethod
+    def current(cls):
+        """
+            @return {str}   The database of the domain in use, the primary outside of use()
+        """
+        return _shard.get() or PRIMARY
+
+    @classmethod
+    def copyDomain(cls, domain_id, alias):
+        """
+            Copies the Domain row into a shard, which its Tag and WordTombstone rows point to.
+            A new copy starts from the revision and horizon on the primary.
+        """
+        if alias == PRIMARY or (alias, domain_id) in cls._copied:
+            return
+        row = Domain.objects.using(PRIMARY).filter(id=domain_id).values("url", "revision", "tombstone_horizon").first()
+        if row == None:
+            return
+        Domain.objects.using(alias).get_or_create(id=domain_id, defaults=row)
+        cls._copied.add((alias, domain_id))
+
+    @classmethod
+    @contextmanager
+    def use(cls, domain_id):
+        """
+            Sends the queries on the sharded models made inside the block to the database of the
+            domain. Does nothing when domain_id is None or sharding is off.
+        """
+        alias = cls.alias(domain_id)
+        if alias == PRIMARY:
+            token = _shard.set(None)
+        else:
+            cls.copyDomain(domain_id, alias)
+            token = _shard.set(alias)
+        try:
+            yield alias
+        finally:
+            _shard.reset(token)
+
+    @classmethod
+    def atomic(cls):
+        """
+            A transaction on the database of the domain in use
+        """
+        return transaction.atomic(using=cls.current())
+
+    @classmethod
+    def invalidate(cls, domain_id):
+        cls._cache().pop(domain_id)
+        cls._copied = {key for key in cls._copied if key[1] != domain_id}
+
+    # ----- Signal receivers, connected in WordtagConfig.ready -----
+
+    @classmethod
+    def onDomainSaved(cls, sender, instance, using=PRIMARY, **kwargs):
+        if using == PRIMARY:
+            cls.invalidate(instance.id)
+
+    @classmethod
+    def onDomainDeleted(cls, sender, instance, using=PRIMARY, **kwargs):
+        # The rows in the shard go with the domain, as they would through the cascade on the primary
+        if using == PRIMARY and instance.shard in cls.shards():
+            Domain.objects.using(instance.shard).filter(id=instance.id).delete()
+        cls.onDomainSaved(sender, instance, using, **kwargs)
+
+
+class DomainShardRouter:
+    """
+        Routes the sharded models to the database chosen by DomainShards.use(). Everything
+        else is left to the next router, or to the primary.
+    """
+
+    def _route(self, model):
+        if not DomainShards.isSharded(model):
+            return None
+        return _shard.get()
+
+    def db_for_read(self, model, **hints):
+        return self._route(model)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # A shard only holds the wordtag tables
+        if db in DomainShards.shards():
+            return app_label == "wordtag"
+        return None
+
+
+class DomainShardMixin:
+    """
+        Runs a viewset's actions against the shard of the domain named by the domain_id query
+        parameter, and against the primary without one
+    """
+
+    shard_param_key = "domain_id"
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            domain_id = int(request.GET.get(self.shard_param_key, ""))
+        except ValueError:
+            domain_id = None
+        with DomainShards.use(domain_id):
+            return super().dispatch(request, *args, **kwargs)
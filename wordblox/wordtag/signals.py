@@ -0,0 +1,66 @@
+"""
+    Signals sent by the wordtag app.
+
+    domain_changed is sent once a write to the Tag/Word rows of a domain has been committed.
+    It is how the in-process indexes and caches built from those rows learn about changes.
+
+    Keyword arguments:
+        domain_id   The id of the domain that changed
+        added       List of (tag, word) pairs that now exist, or None
+        removed     List of (tag, word) pairs that no longer exist, or None
+
+    When added and removed are both None the change is not known row by row and listeners
+    should rebuild or drop whatever they hold for the domain.
+
+    domain_revised is sent once a write that bumped the revision of a domain (see
+    wordtag.revisions) has been committed. Unlike domain_changed it is also sent for writes
+    that only change the details of words.
+
+    Keyword arguments:
+        domain_id   The id of the domain
+        revision    The revision the write was made at
+
+    domain_synced is sent once a pull of a domain from the external server has finished.
+
+    Keyword arguments:
+        domain_id   The id of the domain that was pulled
+        completed   True if the sync was written
+        error       The error message of a failed sync, or an empty string
+"""
+from django.db import transaction
+from django.dispatch import Signal
+from .shards import DomainShards
+
+domain_changed = Signal()
+
+domain_revised = Signal()
+
+domain_synced = Signal()
+
+
+def notify_domain_changed(sender, domain_id, added=None, removed=None):
+    """
+        Sends domain_changed once the current transaction on the domain's database commits, or
+        straight away outside of one
+    """
+    if domain_id == None:
+        return
+    transaction.on_commit(lambda: domain_changed.send(sender=sender, domain_id=domain_id, added=added, removed=removed), using=DomainShards.alias(domain_id))
+
+
+def notify_domain_revised(sender, domain_id, revision):
+    """
+        Sends domain_revised once the current transaction on the domain's database commits, or
+        straight away outside of one
+    """
+    transaction.on_commit(lambda: domain_revised.send(sender=sender, domain_id=domain_id, revision=revision), using=DomainShards.alias(domain_id))
+
+
+def notify_domain_synced(sender, domain_id, completed, error=""):
+    """
+        Sends domain_synced once the current transaction on the domain's database commits, or
+        straight away outside of one
+    """
+    if domain_id == None:
+        return
+    transaction.on_commit(lambda: domain_synced.send(sender=sender, domain_id=domain_id, completed=completed, error=error), using=DomainShards.alias(domain_id))
@@ -0,0 +1,152 @@
+"""
+    Per domain snapshot files shared by every worker process.
+
+    After each completed pull the rows of the domain are written to a snapshot file (see
+    utils.snapshot) stamped with the domain revision, and swapped in place of the previous
+    one. Workers memory-map the file, so the rows are held once in the page cache for the whole
+    host instead of once per worker, and a freshly started worker can serve from the file
+    straight away.
+
+    The rows are streamed into the file in index order straight from the database, ordered
+    with a binary collation so that the database order is the UTF-8 byte order of the file.
+
+    A snapshot is only used while its revision is the current revision of the domain, so
+    writes made after the last pull (through the API or the batch endpoints) are not hidden.
+    Until the next pull rebuilds it the readers fall back to the database. The revision is not
+    read on every request: once checked it is trusted for SNAPSHOT_REVISION_TTL seconds, or
+    until domain_changed or domain_revised reports a write in this process, so writes of other worker processes
+    are seen at most that many seconds late.
+"""
+import logging
+import os
+import threading
+import time
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models.functions import Collate
+from utils.snapshot import SnapshotError, SnapshotReader, writeSnapshot
+from .models import Tag, Word
+from . import replica
+from .replica import replicaReads
+from .revisions import DomainRevision
+from .shards import DomainShards
+
+
+class DomainSnapshots:
+
+    logger = logging.getLogger(__name__)
+
+    _readers = {}   # domain id -> SnapshotReader
+    _checked = {}   # domain id -> (revision, time.monotonic() it was read at)
+    _lock = threading.Lock()
+
+    # Collations ordering text by code point, which for UTF-8 is the byte order of the file
+    _binary_collations = {
+        "sqlite": "BINARY",
+        "postgresql": "C",
+        "mysql": "utf8mb4_bin",
+    }
+
+    @classmethod
+    def isEnabled(cls):
+        return getattr(settings, "DOMAIN_SNAPSHOTS", False)
+
+    @classmethod
+    def path(cls, domain_id):
+        snapshot_dir = getattr(settings, "SNAPSHOT_DIR", os.path.join(settings.BASE_DIR, "snapshots"))
+        return os.path.join(snapshot_dir, f"domain-{domain_id}.snap")
+
+    @classmethod
+    def revisionTtl(cls):
+        return getattr(settings, "SNAPSHOT_REVISION_TTL", 5)
+
+    @classmethod
+    def _ordered(cls, field, alias):
+        collation = cls._binary_collations.get(connections[alias].vendor, None)
+        if collation == None:
+            raise SnapshotError(f"No binary collation known for the {connections[alias].vendor} database")
+        return Collate(field, collation).asc()
+
+    @classmethod
+    def build(cls, domain_id):
+        """
+            Writes the snapshot of a domain and swaps it in. The rows are read from the replica
+            unless the current request has written words to the primary.
+
+            @return {int}   The revision the snapshot was built at
+        """
+        with DomainShards.use(domain_id), replicaReads():
+            alias = router.db_for_read(Word)
+        # The revision is kept with the rows, so one transaction reads both from the same state
+        # of the same database, be it the primary, a shard or the replica
+        with transaction.atomic(using=alias):
+            revision = DomainRevision.current(domain_id, using=alias)
+            tags = Tag.objects.using(alias).filter(domain_id=domain_id).values_list("text", flat=True)
+            rows = Word.objects.using(alias).filter(tag__domain_id=domain_id).values_list("tag__text", "text", "details")
+            rows = rows.order_by(cls._ordered("text", alias), cls._ordered("tag__text", alias))
+            count = writeSnapshot(cls.path(domain_id), revision or 0, rows.iterator(chunk_size=getattr(settings, "SYNC_BATCH_SIZE", 1000)), tags)
+        cls.logger.info("Wrote the snapshot of domain %s at revision %s, %s rows", domain_id, revision, count)
+        return revision
+
+    @classmethod
+    def _reader(cls, domain_id):
+        with cls._lock:
+            reader = cls._readers.get(domain_id, None)
+            if reader != None and reader.isCurrent():
+                return reader
+            try:
+                new_reader = SnapshotReader(cls.path(domain_id))
+            except FileNotFoundError:
+                new_reader = None
+            except SnapshotError as e:
+                cls.logger.warning("Ignoring the snapshot of domain %s: %s", domain_id, e)
+                new_reader = None
+            # The old map is not closed here as another thread may still be reading it, it is
+            # unmapped once the last reference to it goes
+            if new_reader != None:
+                cls._readers[domain_id] = new_reader
+            else:
+                cls._readers.pop(domain_id, None)
+            return new_reader
+
+    @classmethod
+    def get(cls, domain_id):
+        """
+            @return {SnapshotReader}    The snapshot of the domain if it is enabled and up to date, otherwise None
+        """
+        if not cls.isEnabled() or domain_id == None:
+            return None
+        reader = cls._reader(domain_id)
+        if reader == None:
+            return None
+        now = time.monotonic()
+        checked = cls._checked.get(domain_id, None)
+        if checked != None and checked[0] == reader.revision and now - checked[1] < cls.revisionTtl():
+            return reader
+        revision = DomainRevision.current(domain_id)
+        cls._checked[domain_id] = (revision, now)
+        if reader.revision != revision:
+            return None
+        return reader
+
+    @classmethod
+    def onDomainChanged(cls, sender, domain_id, **kwargs):
+        """
+            Forgets the checked revision of the domain so the next read sees the write
+        """
+        cls._checked.pop(domain_id, None)
+
+    @classmethod
+    def _buildLogged(cls, domain_id):
+        try:
+            cls.build(domain_id)
+        except Exception as e:
+            cls.logger.error("Could not write the snapshot of domain %s: %s", domain_id, e)
+
+    @classmethod
+    def onDomainSynced(cls, sender, domain_id, completed, error="", **kwargs):
+        if completed and cls.isEnabled():
+            # When a copy of the pull to the replica is scheduled the snapshot is built from the
+            # replica after it, otherwise straight away from the primary the pull wrote to
+            if not replica.afterCopy(lambda: cls._buildLogged(domain_id)):
+                cls._buildLogged(domain_id)
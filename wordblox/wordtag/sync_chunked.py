@@ -0,0 +1,211 @@
+"""
+    Bounded memory sync engine.
+
+    SyncHandler.syncExternalAndCached holds the whole cached domain, the external domain and the
+    three diff collections at once, about five copies of the domain. This engine never loads
+    the cached domain: it goes through the domain a tag at a time, and within a tag streams the
+    cached rows in pages keyed by Word id. A page is read with .iterator(chunk_size=...) until it
+    holds SYNC_CHUNK_BUDGET bytes, then diffed against the external rows with the same keys and
+    written before the next page is read. The external rows that matched no cached row are
+    inserted last, in batches of SYNC_BATCH_SIZE.
+
+    The pages hold the details digests, not the details. The details of a cached row are only
+    read when SyncMethod.JOIN has to append to them.
+
+    The external collection is the one copy of the domain still held, as it is the payload of
+    the pull. What the sync adds to it is bounded by the budget instead of the domain size.
+
+    The results are the same as SyncHandler.syncExternalAndCached for every combination of
+    SyncMethod, CollectionPriority and SyncControl.
+"""
+from contextlib import closing
+from django.conf import settings
+from utils.word_tag_data import SyncMethod, TupleKeyCollection
+from .id_cache import DomainIdCache
+from .models import Tag, Word
+from .revisions import DomainRevision, RevisionScope
+from .shards import DomainShards
+from .signals import notify_domain_changed
+from .views import CollectionPriority, DomainError, SyncControl, SyncHandler
+
+
+class ChunkedSyncHandler(SyncHandler):
+
+    row_overhead = 250  # Rough bytes of Python objects per cached row held in a page, its digest included, on top of its text
+
+    @classmethod
+    def budget(cls):
+        return getattr(settings, "SYNC_CHUNK_BUDGET", 16 * 1024 * 1024)
+
+    @classmethod
+    def rowCost(cls, text):
+        return len(text) + cls.row_overhead
+
+    @classmethod
+    def pages(cls, tag_id, batch_size, budget):
+        """
+            Yields the cached rows of a tag as lists of (id, text, details_digest, signature), each
+            list ending once it holds budget bytes. The query of a page is closed before the
+            page is handed out, so it can be written to straight away.
+        """
+        last_id = 0
+        while True:
+            page = []
+            cost = 0
+            rows = Word.objects.filter(tag_id=tag_id, id__gt=last_id).order_by("id").values_list("id", "text", "details_digest", "signature")
+            with closing(rows.iterator(chunk_size=batch_size)) as cursor:
+                for row in cursor:
+                    page.append(row)
+                    cost += cls.rowCost(row[1])
+                    if cost >= budget:
+                        break
+            if len(page) == 0:
+                return
+            yield page
+            if cost < budget:
+                return
+            last_id = page[-1][0]
+
+    @classmethod
+    def mergedDetails(cls, cached, external, syncMethod, syncPriority):
+        """
+            @return {str}   The details a row in both collections ends up with, the same as TupleKeyCollection.sync
+        """
+        if syncPriority == CollectionPriority.EXTERNAL:
+            return cached + external if syncMethod == SyncMethod.JOIN else external
+        elif syncPriority == CollectionPriority.CACHED:
+            return external + cached if syncMethod == SyncMethod.JOIN else cached
+        else:
+            # This is only raised if there is a sync priority value added the enum, but not implemented
+            raise NotImplementedError(f"Sync Priority was a value that is not implemented as yet. {syncPriority.name}: {syncPriority.value}")
+
+    @classmethod
+    def syncPage(cls, page, tag, externalData, domain_id, syncMethod, syncPriority, syncControl, revision_scope, batch_size, stats):
+        """
+            Diffs one page of cached rows against the external rows with the same keys and writes the result
+        """
+        to_update = []  # Rows getting new details
+        to_join = {}    # id -> (external details, signature) of the rows getting the external details joined to theirs
+        to_fill = {}    # id -> Word keeping its details, with a signature or digest to fill in
+        to_delete = []
+        for word_id, text, details_digest, signature in page:
+            external = externalData.get(tag, text)
+            new_signature = Word.signatureOf(text)
+            if external == None:
+                # Only in the cached data, old for EXTERNAL and new for CACHED priority
+                if syncPriority == CollectionPriority.EXTERNAL:
+                    stats["old"] += 1
+                    if syncControl == SyncControl.DELETE:
+                        to_delete.append((word_id, text))
+                    # Old rows that are kept are left as they are
+                    continue
+                stats["new"] += 1
+            else:
+                stats["both"] += 1
+                external = cls.sanitizeDetails(external)
+                if syncMethod == SyncMethod.JOIN and external != "":
+                    to_join[word_id] = (external, new_signature)
+                    continue
+                if syncPriority == CollectionPriority.EXTERNAL and syncMethod == SyncMethod.OVERRIDE:
+                    external_digest = Word.digestOf(external)
+                    if external_digest != details_digest or new_signature != signature:
+                        to_update.append(Word(id=word_id, details=external, signature=new_signature, details_digest=external_digest))
+                    continue
+            if new_signature != signature or details_digest == "":
+                # rows written before the signature or digest columns existed get them filled in here
+                to_fill[word_id] = Word(id=word_id, signature=new_signature, details_digest=details_digest)
+        # The only details read: those the external details are joined to, and those of rows without a digest
+        missing_digests = [word_id for word_id, wordObj in to_fill.items() if wordObj.details_digest == ""]
+        if len(to_join) > 0 or len(missing_digests) > 0:
+            for word_id, details in Word.objects.filter(id__in=list(to_join) + missing_digests).values_list("id", "details"):
+                if word_id in to_join:
+                    external, new_signature = to_join[word_id]
+                    new_details = cls.mergedDetails(details, external, syncMethod, syncPriority)
+                    to_update.append(Word(id=word_id, details=new_details, signature=new_signature, details_digest=Word.digestOf(new_details)))
+                else:
+                    to_fill[word_id].details_digest = Word.digestOf(details)
+        if len(to_update) > 0 or len(to_fill) > 0 or len(to_delete) > 0:
+            revision = revision_scope.revision(domain_id)
+            if len(to_update) > 0:
+                for wordObj in to_update:
+                    wordObj.revision = revision
+                Word.objects.bulk_update(to_update, ["details", "signature", "details_digest", "revision"], batch_size=batch_size)
+            if len(to_fill) > 0:
+                for wordObj in to_fill.values():
+                    wordObj.revision = revision
+                Word.objects.bulk_update(list(to_fill.values()), ["signature", "details_digest", "revision"], batch_size=batch_size)
+            stats["changed"] += len(to_update) + len(to_fill)
+            if len(to_delete) > 0:
+                removed = [(tag, text) for _, text in to_delete]
+                DomainRevision.recordDeleted(domain_id, revision, removed)
+                for start in range(0, len(to_delete), batch_size):
+                    stats["deleted"] += Word.objects.filter(id__in=[word_id for word_id, _ in to_delete[start:start + batch_size]]).delete()[0]
+                notify_domain_changed(cls, domain_id, removed=removed)
+
+    @classmethod
+    def insertMissing(cls, externalData, domain_id, syncPriority, revision_scope, batch_size, stats, tags=None):
+        """
+            Finds the external rows that are not cached, a batch at a time, and inserts them for EXTERNAL priority
+        """
+        create = syncPriority == CollectionPriority.EXTERNAL
+        row_logger = cls.rowLogger()
+        for batch in cls.iterBatches(cls.validRows(externalData, row_logger, tags), batch_size):
+            tag_map = cls.resolveTags(domain_id, {tag for tag, _, _ in batch}, create=create)
+            existing = set(Word.objects.filter(tag_id__in=set(tag_map.values()), text__in={word for _, word, _ in batch}).values_list("tag_id", "text"))
+            missing = [(tag, word, details) for tag, word, details in batch if (tag_map.get(tag, None), word) not in existing]
+            if len(missing) == 0:
+                continue
+            if not create:
+                # Only in the external data, old for CACHED priority and never written
+                stats["old"] += len(missing)
+                continue
+            stats["new"] += len(missing)
+            revision = revision_scope.revision(domain_id)
+            Word.objects.bulk_create(
+                [Word(text=word, tag_id=tag_map[tag], details=details, signature=Word.signatureOf(word), details_digest=Word.digestOf(details), revision=revision) for tag, word, details in missing]
+            )
+            stats["inserted"] += len(missing)
+            notify_domain_changed(cls, domain_id, added=[(tag, word) for tag, word, _ in missing])
+        row_logger.flush()
+
+    @classmethod
+    def syncExternal(cls, externalData, domain, syncMethod: SyncMethod = SyncMethod.OVERRIDE, syncPriority: CollectionPriority = CollectionPriority.EXTERNAL, syncControl: SyncControl = SyncControl.MERGE, batch_size=None, budget=None, tags=None):
+        """
+            Syncs the Cache database with the External data for a given domain, holding at most about
+            budget bytes of cached rows at once.
+
+            @param  {TupleKeyCollection}    externalData    The data from the external server
+            @param  {string}    domain  This controls the scope of database operations
+            @param  {int}   batch_size  Rows per query, defaults to settings.SYNC_BATCH_SIZE
+            @param  {int}   budget  Bytes of cached rows per page, defaults to settings.SYNC_CHUNK_BUDGET
+            @param  {set}   tags    Only sync the rows of these tags, SyncControl.DELETE included, every tag by default
+
+            @return {dict}  Row counts: old (only in the collection without priority), new (only in the
+                            collection with priority), both, changed (rows updated), inserted and deleted
+        """
+        if not cls.isValidDomain(domain):
+            raise DomainError(f"Can not process the given domain: {domain}")
+        if not isinstance(externalData, TupleKeyCollection):
+            raise TypeError(f"Expected a TupleKeyCollection for parameter externalData, instead got: {externalData.__class__}")
+        syncMethod = cls.sanitizeSyncMethod(syncMethod)
+        syncPriority = cls.sanitizeSyncPriority(syncPriority)
+        syncControl = cls.sanitizeSyncControl(syncControl)
+        batch_size = batch_size or cls.batchSize()
+        budget = budget or cls.budget()
+        tags = cls.sanitizeTags(tags)
+        revision_scope = RevisionScope()
+        stats = {"old": 0, "new": 0, "both": 0, "changed": 0, "inserted": 0, "deleted": 0}
+        try:
+            domain_id = DomainIdCache.domainId(domain, create=True)
+            with DomainShards.use(domain_id), DomainShards.atomic():
+                cached_tags = Tag.objects.filter(domain_id=domain_id)
+                if tags != None:
+                    cached_tags = cached_tags.filter(text__in=tags)
+                for tag_id, tag in list(cached_tags.order_by("id").values_list("id", "text")):
+                    for page in cls.pages(tag_id, batch_size, budget):
+                        cls.syncPage(page, tag, externalData, domain_id, syncMethod, syncPriority, syncControl, revision_scope, batch_size, stats)
+                cls.insertMissing(externalData, domain_id, syncPriority, revision_scope, batch_size, stats, tags)
+        except Exception as e:
+            cls.logger.error("Chunked sync failed for domain %s: %s", domain, e)
+            raise e
+        return stats
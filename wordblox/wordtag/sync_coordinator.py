@@ -0,0 +1,121 @@
+"""
+    Per domain single-flight for pulls.
+
+    When several editors of a domain log in at once, only one of them fetches from the external
+    server and syncs. The others, in the same process or in another worker on the host, wait for
+    it and are handed its result. A result is also reused by pulls starting within
+    SYNC_COALESCE_WINDOW seconds after it finished.
+
+    Pulls of only some tags of a domain are shared under their own key, but every pull of a
+    domain runs under the one file lock of the domain, so a tag-scoped pull and a full pull never
+    write the domain at once. The lock file keeps the last result of each key.
+
+    Pulls of a domain whose cache is stale but usable run in the background through revalidate().
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from django.conf import settings
+from django.db import connections
+from utils.single_flight import FileLock, SingleFlight
+
+
+class DomainSyncCoordinator:
+
+    logger = logging.getLogger(__name__)
+
+    _flight = None
+
+    _revalidating = set()   # Domains with a background pull running in this process
+    _revalidating_lock = threading.Lock()
+
+    @classmethod
+    def window(cls):
+        return getattr(settings, "SYNC_COALESCE_WINDOW", 5)
+
+    @classmethod
+    def lockTimeout(cls):
+        return getattr(settings, "SYNC_LOCK_TIMEOUT", 300)
+
+    @classmethod
+    def lockPath(cls, domain):
+        lock_dir = getattr(settings, "SYNC_LOCK_DIR", os.path.join(settings.BASE_DIR, "locks"))
+        os.makedirs(lock_dir, exist_ok=True)
+        return os.path.join(lock_dir, hashlib.sha1(f"{domain}".encode("utf-8")).hexdigest() + ".lock")
+
+    @classmethod
+    def flight(cls):
+        if cls._flight == None:
+            cls._flight = SingleFlight(cls.window())
+        return cls._flight
+
+    @classmethod
+    def run(cls, domain, fn, shareable=lambda result: True, key=None):
+        """
+            Runs fn for the domain unless another pull of it is running or just finished.
+
+            @param  {string}    domain  The domain being pulled
+            @param  {function}  fn      The fetch and sync, returning a JSON serializable result
+            @param  {function}  shareable   Whether a result may be handed to other pulls
+            @param  {string}    key     The pulls sharing a result, the domain if None
+
+            @return {dict}  The result of fn, or of the pull it was coalesced with
+
+            @raise  {SingleFlightTimeout|FileLockTimeout}   If the running pull takes longer than SYNC_LOCK_TIMEOUT
+        """
+        if key == None:
+            key = domain
+        result, _ = cls.flight().do(key, lambda: cls._runLocked(domain, key, fn, shareable), cls.lockTimeout())
+        return result
+
+    @classmethod
+    def _runLocked(cls, domain, key, fn, shareable):
+        with FileLock(cls.lockPath(domain), cls.lockTimeout()) as lock:
+            shared = lock.state().get(key, {})
+            finished = shared.get("finished", None)
+            if finished != None and time.time() - finished <= cls.window():
+                # Another process finished the same pull while this one waited on the lock
+                return shared.get("result", None)
+            result = fn()
+            if shareable(result):
+                now = time.time()
+                # Read again, fn may have taken long enough for other results to expire
+                state = {k: v for k, v in lock.state().items() if isinstance(v, dict) and now - v.get("finished", 0) <= cls.window()}
+                state[key] = {"finished": now, "result": result}
+                lock.setState(state)
+            return result
+
+    @classmethod
+    def revalidate(cls, domain, fn, on_done=None, shareable=lambda result: True):
+        """
+            Runs the pull in a background thread, unless this process is already revalidating the domain.
+
+            @param  {string}    domain  The domain being pulled
+            @param  {function}  fn      The fetch and sync
+            @param  {function}  on_done Called once the thread is finished, whether fn succeeded or not
+
+            @return {bool}  True if a background pull was started
+        """
+        with cls._revalidating_lock:
+            if domain in cls._revalidating:
+                if on_done != None:
+                    on_done()
+                return False
+            cls._revalidating.add(domain)
+
+        def target():
+            try:
+                cls.run(domain, fn, shareable)
+            except Exception as e:
+                cls.logger.error("Background pull of %s failed: %s", domain, e)
+            finally:
+                with cls._revalidating_lock:
+                    cls._revalidating.discard(domain)
+                if on_done != None:
+                    on_done()
+                connections.close_all()
+
+        threading.Thread(target=target, name=f"revalidate-{domain}", daemon=True).start()
+        return True
@@ -0,0 +1,198 @@
+"""
+    Sync run history.
+
+    Every pull leaves a SyncRun row: the engine and sync settings it ran with, the rows it found
+    only in one collection or in both, how many of those it wrote or deleted, the time spent
+    fetching, loading the cached data and syncing, the size of the external payload and the
+    error if it failed. Every push leaves one too, with the time spent fetching the rows of the
+    other tags (scoped pushes only), loading the cached data and sending it, and its error.
+    The newest SYNC_RUN_KEEP runs of each domain are kept.
+
+    DomainSyncRuns.summary and DomainSyncRuns.domains aggregate the pulls in the database, to
+    find the domains whose pulls are getting slow or rewrite a lot of rows on every pull.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Avg, Count, F, Max, Q, Sum
+from django.utils import timezone
+from .id_cache import DomainIdCache
+from .models import SyncRun
+
+
+class SyncRunRecorder:
+    """
+        Collects the statistics of one pull or push and saves them as a SyncRun
+    """
+
+    PULL = "pull"
+    PUSH = "push"
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, domain, engine=None, syncMethod=None, syncPriority=None, syncControl=None, tags=None, kind=PULL):
+        """
+            @param  {string}    domain  The domain synced
+            @param  {SyncEngine}    engine  The engine of a pull, None for a push, as are the sync settings
+            @param  {set}   tags    The tags of a scoped pull or push, None for the whole domain
+            @param  {string}    kind    PULL or PUSH
+        """
+        self.domain = domain
+        self.settings = {
+            "kind": kind,
+            "engine": engine.value if engine != None else "",
+            "sync_method": syncMethod.name if syncMethod != None else "",
+            "sync_priority": syncPriority.name if syncPriority != None else "",
+            "sync_control": syncControl.name if syncControl != None else "",
+            "tags": ",".join(sorted(tags)) if tags != None else ""
+        }
+        self.started = timezone.now()
+        self._start = time.monotonic()
+        self.seconds = {"fetch": 0, "load": 0, "sync": 0}
+        self.stats = {}
+        self.payload_bytes = 0
+
+    @contextmanager
+    def phase(self, name):
+        """
+            Adds the time spent in the block to the phase
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.monotonic() - start
+
+    def setStats(self, stats):
+        """
+            @param  {dict}  stats   The row counts returned by the sync engine: old, new, both, changed and deleted
+        """
+        self.stats = stats or {}
+
+    def save(self, completed, error=""):
+        """
+            Saves the run, a failure to save is logged and does not fail the pull
+
+            @return {SyncRun}   The saved run, None if the domain does not exist or the save failed
+        """
+        domain_id = DomainIdCache.domainId(self.domain)
+        if domain_id == None:
+            return None
+        both = self.stats.get("both", 0)
+        changed = self.stats.get("changed", 0)
+        try:
+            run = SyncRun.objects.create(
+                domain_id=domain_id,
+                started=self.started,
+                **self.settings,
+                old_rows=self.stats.get("old", 0),
+                new_rows=self.stats.get("new", 0),
+                changed_rows=changed,
+                unchanged_rows=max(both - changed, 0),
+                deleted_rows=self.stats.get("deleted", 0),
+                fetch_seconds=self.seconds["fetch"],
+                load_seconds=self.seconds["load"],
+                sync_seconds=self.seconds["sync"],
+                total_seconds=time.monotonic() - self._start,
+                payload_bytes=self.payload_bytes,
+                completed=completed,
+                error=error,
+            )
+            DomainSyncRuns.prune(domain_id)
+        except DatabaseError as e:
+            self.logger.warning("Could not record the sync run of %s: %s", self.domain, e)
+            return None
+        return run
+
+
+class DomainSyncRuns:
+
+    @classmethod
+    def keep(cls):
+        return getattr(settings, "SYNC_RUN_KEEP", 500)
+
+    @classmethod
+    def prune(cls, domain_id):
+        """
+            Deletes the runs of a domain older than its newest SYNC_RUN_KEEP, 0 keeps every run
+        """
+        keep = cls.keep()
+        if keep <= 0:
+            return
+        oldest_kept = SyncRun.objects.filter(domain_id=domain_id).order_by("-id").values_list("id", flat=True)[keep - 1:keep].first()
+        if oldest_kept != None:
+            SyncRun.objects.filter(domain_id=domain_id, id__lt=oldest_kept).delete()
+
+    @classmethod
+    def toDict(cls, run):
+        return {
+            "started": run["started"].isoformat(),
+            "kind": run["kind"],
+            "engine": run["engine"],
+            "sync_method": run["sync_method"],
+            "sync_priority": run["sync_priority"],
+            "sync_control": run["sync_control"],
+            "tags": run["tags"].split(",") if run["tags"] != "" else None,
+            "rows": {"old": run["old_rows"], "new": run["new_rows"], "changed": run["changed_rows"], "unchanged": run["unchanged_rows"], "deleted": run["deleted_rows"]},
+            "seconds": {"fetch": run["fetch_seconds"], "load": run["load_seconds"], "sync": run["sync_seconds"], "total": run["total_seconds"]},
+            "payload_bytes": run["payload_bytes"],
+            "completed": run["completed"],
+            "error": run["error"],
+        }
+
+    @classmethod
+    def recent(cls, domain_id, limit):
+        """
+            @return {list}  The newest runs of a domain as dicts, newest first
+        """
+        runs = SyncRun.objects.filter(domain_id=domain_id).order_by("-started", "-id").values()[:limit]
+        return [cls.toDict(run) for run in runs]
+
+    @classmethod
+    def aggregates(cls):
+        """
+            The aggregates computed over a set of runs by summary and domains
+        """
+        return {
+            "runs": Count("id"),
+            "failed": Count("id", filter=Q(completed=False)),
+            "avg_seconds": Avg("total_seconds"),
+            "max_seconds": Max("total_seconds"),
+            "avg_fetch_seconds": Avg("fetch_seconds"),
+            "avg_load_seconds": Avg("load_seconds"),
+            "avg_sync_seconds": Avg("sync_seconds"),
+            "avg_payload_bytes": Avg("payload_bytes"),
+            "written_rows": Sum(F("new_rows") + F("changed_rows") + F("deleted_rows")),
+            "unchanged_rows": Sum("unchanged_rows"),
+        }
+
+    @classmethod
+    def summary(cls, domain_id, since=None):
+        """
+            @param  {datetime}  since   Only the runs started from then on, every run kept by default
+
+            @return {dict}  The aggregates of the pulls of a domain
+        """
+        runs = SyncRun.objects.filter(domain_id=domain_id, kind=SyncRunRecorder.PULL)
+        if since != None:
+            runs = runs.filter(started__gte=since)
+        return runs.aggregate(**cls.aggregates())
+
+    @classmethod
+    def domains(cls, since=None, order="avg_seconds", limit=20):
+        """
+            The aggregates per domain, the slowest domains first by default
+
+            @param  {str}   order   The aggregate to sort by, descending
+            @return {list}  [{domain, runs, failed, avg_seconds, ...}]
+        """
+        aggregates = cls.aggregates()
+        if order not in aggregates:
+            raise ValueError(f"Can not order by {order}, expected one of {', '.join(aggregates)}")
+        runs = SyncRun.objects.filter(kind=SyncRunRecorder.PULL)
+        if since != None:
+            runs = runs.filter(started__gte=since)
+        rows = runs.values("domain__url").annotate(**aggregates).order_by(F(order).desc(nulls_last=True))[:limit]
+        return [{"domain": row.pop("domain__url"), **row} for row in rows]
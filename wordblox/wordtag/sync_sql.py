@@ -0,0 +1,198 @@
+"""
+    Set based sync engine.
+
+    Instead of loading the cached rows of a domain into a TupleKeyCollection and diffing it in
+    Python, the external rows are bulk loaded into a temporary staging table and the old/new/both
+    classification and the writes are done by a handful of SQL statements. Python memory use no
+    longer depends on the size of the cached domain.
+
+    The details are compared by their digests. The digests of details joined in SQL are filled
+    in afterwards from the rows that were written.
+
+    The results are the same as SyncHandler.syncExternalAndCached for every combination of
+    SyncMethod, CollectionPriority and SyncControl.
+"""
+from django.db import connections
+from django.utils import timezone
+from utils.word_tag_data import SyncMethod, TupleKeyCollection
+from .id_cache import DomainIdCache
+from .models import Tag, Word, WordTombstone
+from .revisions import RevisionScope
+from .shards import DomainShards
+from .signals import notify_domain_changed
+from .views import CollectionPriority, DomainError, SyncControl, SyncHandler
+
+
+class StagingSyncHandler(SyncHandler):
+
+    stage_table = "wordtag_sync_stage"
+
+    word_table = Word._meta.db_table
+    tag_table = Tag._meta.db_table
+    tombstone_table = WordTombstone._meta.db_table
+
+    @classmethod
+    def _createStage(cls, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {cls.stage_table}")
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {cls.stage_table} ("
+            "tag VARCHAR(75) NOT NULL, word VARCHAR(75) NOT NULL, details TEXT NOT NULL, "
+            "signature VARCHAR(75) NOT NULL, details_digest VARCHAR(32) NOT NULL, tag_id BIGINT NULL, PRIMARY KEY (tag, word))"
+        )
+
+    @classmethod
+    def _loadStage(cls, cursor, collection, batch_size, tags=None):
+        row_logger = cls.rowLogger()
+        loaded = 0
+        for batch in cls.iterBatches(cls.validRows(collection, row_logger, tags), batch_size):
+            cursor.executemany(
+                f"INSERT INTO {cls.stage_table} (tag, word, details, signature, details_digest) VALUES (%s, %s, %s, %s, %s)",
+                [(tag, word, details, Word.signatureOf(word), Word.digestOf(details)) for tag, word, details in batch]
+            )
+            loaded += len(batch)
+        row_logger.flush()
+        return loaded
+
+    @classmethod
+    def _fillDigests(cls, cursor, in_domain, scope, batch_size):
+        """
+            Fills in the details_digest of the rows that have none, the rows whose details were
+            joined in SQL and the rows written before the column existed
+        """
+        cursor.execute(f"SELECT id, details FROM {cls.word_table} WHERE {in_domain} AND details_digest = ''", scope)
+        rows = [(Word.digestOf(details), word_id) for word_id, details in cursor.fetchall()]
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(f"UPDATE {cls.word_table} SET details_digest = %s WHERE id = %s", rows[start:start + batch_size])
+
+    @classmethod
+    def _count(cls, cursor, sql, params):
+        cursor.execute(sql, params)
+        return cursor.fetchone()[0]
+
+    @classmethod
+    def _tagScope(cls, column, tags):
+        """
+            @return {tuple} (sql, params) restricting a tag text column to tags, nothing when tags is None
+        """
+        if tags == None:
+            return "", []
+        if len(tags) == 0:
+            return " AND 1 = 0", []
+        return f" AND {column} IN ({', '.join(['%s'] * len(tags))})", sorted(tags)
+
+    @classmethod
+    def syncExternal(cls, externalData, domain, syncMethod: SyncMethod = SyncMethod.OVERRIDE, syncPriority: CollectionPriority = CollectionPriority.EXTERNAL, syncControl: SyncControl = SyncControl.MERGE, batch_size=None, tags=None):
+        """
+            Syncs the Cache database with the External data for a given domain, without loading the cached data.
+
+            @param  {TupleKeyCollection}    externalData    The data from the external server
+            @param  {string}    domain  This controls the scope of database operations
+            @param  {set}   tags    Only sync the rows of these tags, SyncControl.DELETE included, every tag by default
+
+            @return {dict}  Row counts: old (only cached), new (only external), both, changed (rows whose
+                            details were updated), inserted and deleted
+        """
+        if not cls.isValidDomain(domain):
+            raise DomainError(f"Can not process the given domain: {domain}")
+        if not isinstance(externalData, TupleKeyCollection):
+            raise TypeError(f"Expected a TupleKeyCollection for parameter externalData, instead got: {externalData.__class__}")
+        syncMethod = cls.sanitizeSyncMethod(syncMethod)
+        syncPriority = cls.sanitizeSyncPriority(syncPriority)
+        syncControl = cls.sanitizeSyncControl(syncControl)
+        batch_size = batch_size or cls.batchSize()
+        tags = cls.sanitizeTags(tags)
+        stage = cls.stage_table
+        words = cls.word_table
+        tag_table = cls.tag_table
+        tombstones = cls.tombstone_table
+        revision_scope = RevisionScope()
+        # Rows of the domain's Word table matching a staged row, and the reverse
+        matched = f"EXISTS (SELECT 1 FROM {stage} s WHERE s.tag_id = {words}.tag_id AND s.word = {words}.text)"
+        tag_scope, tag_params = cls._tagScope("text", tags)
+        in_domain = f"{words}.tag_id IN (SELECT id FROM {tag_table} WHERE domain_id = %s{tag_scope})"
+        stats = {"old": 0, "new": 0, "both": 0, "changed": 0, "inserted": 0, "deleted": 0}
+        try:
+            domain_id = DomainIdCache.domainId(domain, create=True)
+            with DomainShards.use(domain_id) as alias, DomainShards.atomic():
+                with connections[alias].cursor() as cursor:
+                    cls._createStage(cursor)
+                    loaded = cls._loadStage(cursor, externalData, batch_size, tags)
+                    # The params of in_domain
+                    scope = [domain_id] + tag_params
+                    if syncPriority == CollectionPriority.EXTERNAL:
+                        cursor.execute(
+                            f"INSERT INTO {tag_table} (text, domain_id) SELECT DISTINCT s.tag, %s FROM {stage} s "
+                            f"WHERE NOT EXISTS (SELECT 1 FROM {tag_table} t WHERE t.domain_id = %s AND t.text = s.tag)",
+                            [domain_id, domain_id]
+                        )
+                    # The oldest tag wins when a tag text exists more than once, the same as resolveTags
+                    cursor.execute(
+                        f"UPDATE {stage} SET tag_id = (SELECT MIN(t.id) FROM {tag_table} t WHERE t.domain_id = %s AND t.text = {stage}.tag)",
+                        [domain_id]
+                    )
+                    stats["both"] = cls._count(cursor, f"SELECT COUNT(*) FROM {words} WHERE {in_domain} AND {matched}", scope)
+                    cached = cls._count(cursor, f"SELECT COUNT(*) FROM {words} WHERE {in_domain}", scope)
+                    only_external = loaded - stats["both"]
+                    only_cached = cached - stats["both"]
+                    # The details updates the sync method calls for, as (new details, condition, new digest) on
+                    # a matched row. Joined details get their digest from _fillDigests
+                    if syncPriority == CollectionPriority.EXTERNAL and syncMethod == SyncMethod.JOIN:
+                        update = (f"{words}.details || s.details", "s.details <> ''", "''")
+                    elif syncPriority == CollectionPriority.EXTERNAL:
+                        update = ("s.details", f"s.details_digest <> {words}.details_digest", "s.details_digest")
+                    elif syncPriority == CollectionPriority.CACHED and syncMethod == SyncMethod.JOIN:
+                        # The cached rows win, JOIN prepends the external details
+                        update = (f"s.details || {words}.details", "s.details <> ''", "''")
+                    elif syncPriority == CollectionPriority.CACHED:
+                        update = None
+                    else:
+                        # This is only raised if there is a sync priority value added the enum, but not implemented
+                        raise NotImplementedError(f"Sync Priority was a value that is not implemented as yet. {syncPriority.name}: {syncPriority.value}")
+                    to_update = f"{in_domain} AND EXISTS (SELECT 1 FROM {stage} s WHERE s.tag_id = {words}.tag_id AND s.word = {words}.text AND {update[1]})" if update != None else None
+                    pending_updates = cls._count(cursor, f"SELECT COUNT(*) FROM {words} WHERE {to_update}", scope) if update != None else 0
+                    if syncPriority == CollectionPriority.EXTERNAL:
+                        stats["old"], stats["new"] = only_cached, only_external
+                        deleting = syncControl == SyncControl.DELETE and only_cached > 0
+                        writing = deleting or only_external > 0 or pending_updates > 0
+                    else:
+                        stats["old"], stats["new"] = only_external, only_cached
+                        deleting = False
+                        writing = pending_updates > 0
+                    revision = revision_scope.revision(domain_id) if writing else None
+                    if deleting:
+                        cursor.execute(
+                            f"INSERT INTO {tombstones} (domain_id, tag, text, revision, deleted_at) SELECT %s, t.text, w.text, %s, %s FROM {words} w JOIN {tag_table} t ON t.id = w.tag_id "
+                            f"WHERE t.domain_id = %s{cls._tagScope('t.text', tags)[0]} AND NOT EXISTS (SELECT 1 FROM {stage} s WHERE s.tag_id = w.tag_id AND s.word = w.text)",
+                            [domain_id, revision, connections[alias].ops.adapt_datetimefield_value(timezone.now())] + scope
+                        )
+                        cursor.execute(f"DELETE FROM {words} WHERE {in_domain} AND NOT {matched}", scope)
+                        stats["deleted"] = cursor.rowcount
+                    if pending_updates > 0:
+                        cursor.execute(
+                            f"UPDATE {words} SET details = (SELECT {update[0]} FROM {stage} s WHERE s.tag_id = {words}.tag_id AND s.word = {words}.text), "
+                            f"details_digest = (SELECT {update[2]} FROM {stage} s WHERE s.tag_id = {words}.tag_id AND s.word = {words}.text), revision = %s "
+                            f"WHERE {to_update}",
+                            [revision] + scope
+                        )
+                        stats["changed"] = cursor.rowcount
+                    if syncPriority == CollectionPriority.EXTERNAL and only_external > 0:
+                        cursor.execute(
+                            f"INSERT INTO {words} (text, details, tag_id, signature, details_digest, revision) SELECT s.word, s.details, s.tag_id, s.signature, s.details_digest, %s FROM {stage} s "
+                            f"WHERE NOT EXISTS (SELECT 1 FROM {words} w WHERE w.tag_id = s.tag_id AND w.text = s.word)",
+                            [revision]
+                        )
+                        stats["inserted"] = cursor.rowcount
+                    # Rows written before the signature column existed
+                    cursor.execute(
+                        f"UPDATE {words} SET signature = (SELECT s.signature FROM {stage} s WHERE s.tag_id = {words}.tag_id AND s.word = {words}.text) "
+                        f"WHERE {in_domain} AND signature = '' AND {matched}",
+                        scope
+                    )
+                    cls._fillDigests(cursor, in_domain, scope, batch_size)
+                    cursor.execute(f"DROP TABLE {stage}")
+                if stats["inserted"] > 0 or stats["deleted"] > 0:
+                    notify_domain_changed(cls, domain_id)
+        except Exception as e:
+            cls.logger.error("Staging sync failed for domain %s: %s", domain, e)
+            raise e
+        return stats
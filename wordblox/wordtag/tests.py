@@ -1,3 +1,1143 @@
-from django.test import TestCase
+import contextvars
+import json
+import itertools
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+from django.core.management import CommandError, call_command
+from django.apps import apps
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.db.models import F
+from django.http import JsonResponse
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.serializer_helpers import ReturnDict
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from utils.snapshot import SnapshotError, writeSnapshot
+from utils import fast_json, wire_format
+from utils.log_utils import QueueListenerHandler
+from utils.fetch_word_data import ExternalServerFetchException
+from utils.rate_limit import ConcurrencyLimiter, RateLimited, RateLimiter
+from utils import single_flight
+from utils.single_flight import FileLock, FileLockTimeout, SingleFlight
+from utils.trie import Trie
+from utils.word_tag_data import SyncMethod, TupleKeyCollection
+from .batch import WordBatchHandler
+from .events import DomainEvents
+from .id_cache import DomainIdCache
+from . import replica
+from .admission import SyncAdmission
+from .models import Domain, SyncRun, Tag, Word, WordTombstone
+from .revisions import DomainRevision, ResyncRequired
+from .search import WordSearchIndex
+from .shards import PRIMARY, DomainShards
+from .signals import domain_changed
+from .sync_coordinator import DomainSyncCoordinator
+from .warmup import Warmup
+from .snapshots import DomainSnapshots
+from .sync_chunked import ChunkedSyncHandler
+from .sync_sql import StagingSyncHandler
+from .views import CollectionPriority, Freshness, SpellinBloxHandler, SpellinBloxPullHandler, SyncControl, SyncHandler
+from .word_index import DomainAnagramIndex, DomainSampleIndex, DomainTrieIndex
 
 # Create your tests here.
+
+def authedClient(client):
+    """
+        Gives the test client the session a /login leaves behind
+    """
+    session = client.session
+    session["auth"] = True
+    session["ip"] = "127.0.0.1"
+    session.save()
+    return client
+
+
+class WordBatchTests(TestCase):
+
+    def setUp(self):
+        self.domain = Domain.objects.create(url="https://example.com/")
+        self.noun = Tag.objects.create(text="noun", domain=self.domain)
+        self.apple = Word.objects.create(text="apple", details="red", tag=self.noun)
+        self.pear = Word.objects.create(text="pear", details="", tag=self.noun)
+
+    def test_applies_creates_updates_and_deletes(self):
+        applied, results = WordBatchHandler.run({
+            "create": [{"text": "kiwi", "details": "green", "tag_id": self.noun.id}],
+            "update": [{"id": self.apple.id, "details": "green"}],
+            "delete": [self.pear.id],
+        })
+        self.assertTrue(applied)
+        self.assertEqual([res["status"] for res in results], ["ok", "ok", "ok"])
+        kiwi = Word.objects.get(id=results[0]["id"])
+        self.assertEqual((kiwi.text, kiwi.details, kiwi.signature, kiwi.details_digest), ("kiwi", "green", "iikw", Word.digestOf("green")))
+        self.apple.refresh_from_db()
+        self.assertEqual((self.apple.details, self.apple.details_digest), ("green", Word.digestOf("green")))
+        self.assertFalse(Word.objects.filter(id=self.pear.id).exists())
+
+    def test_one_invalid_item_writes_nothing(self):
+        applied, results = WordBatchHandler.run({
+            "create": [{"text": "kiwi", "tag_id": self.noun.id}, {"text": "", "tag_id": self.noun.id}],
+            "delete": [self.pear.id],
+        })
+        self.assertFalse(applied)
+        self.assertEqual([res["status"] for res in results], ["ok", "invalid", "ok"])
+        self.assertIn("text", results[1]["errors"])
+        self.assertEqual(Word.objects.count(), 2)
+
+    def test_unique_conflicts(self):
+        # Taken by a row that stays
+        applied, results = WordBatchHandler.run({"create": [{"text": "apple", "tag_id": self.noun.id}]})
+        self.assertFalse(applied)
+        self.assertEqual(results[0]["errors"]["non_field_errors"], WordBatchHandler.unique_error)
+        # Freed by a delete in the same batch
+        applied, results = WordBatchHandler.run({"create": [{"text": "apple", "tag_id": self.noun.id}], "delete": [self.apple.id]})
+        self.assertTrue(applied)
+        # Within the batch
+        applied, results = WordBatchHandler.run({"create": [{"text": "fig", "tag_id": self.noun.id}, {"text": "fig", "tag_id": self.noun.id}]})
+        self.assertFalse(applied)
+        self.assertEqual([res["status"] for res in results], ["ok", "invalid"])
+
+    def test_endpoint_needs_auth(self):
+        payload = {"create": [{"text": "kiwi", "tag_id": self.noun.id}]}
+        response = self.client.post("/api/words/batch/", payload, content_type="application/json")
+        self.assertEqual(response.status_code, 403)
+        response = authedClient(self.client).post("/api/words/batch/", payload, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["applied"])
+        self.assertTrue(Word.objects.filter(text="kiwi", tag=self.noun).exists())
+
+
+class WordSearchTests(TestCase):
+
+    def setUp(self):
+        self.domain = Domain.objects.create(url="https://example.com/")
+        self.other = Domain.objects.create(url="https://example.org/")
+        noun = Tag.objects.create(text="noun", domain=self.domain)
+        verb = Tag.objects.create(text="verb", domain=self.domain)
+        Word.objects.create(text="apple", details="a red fruit", tag=noun)
+        Word.objects.create(text="apply", details="", tag=verb)
+        Word.objects.create(text="banana", details="apple shaped", tag=noun)
+        Word.objects.create(text="apple", details="", tag=Tag.objects.create(text="noun", domain=self.other))
+
+    def words(self, results):
+        return sorted((res["tag"], res["word"]) for res in results)
+
+    def test_prefix_search_scoped_to_domain(self):
+        self.assertEqual(self.words(WordSearchIndex.search("appl", self.domain.id)), [("noun", "apple"), ("noun", "banana"), ("verb", "apply")])
+        self.assertEqual(self.words(WordSearchIndex.search("appl", self.domain.id, prefix=False)), [])
+        self.assertEqual(self.words(WordSearchIndex.search("appl", self.domain.id, tag="verb")), [("verb", "apply")])
+        # The word text ranks above the details
+        self.assertEqual(WordSearchIndex.search("apple", self.domain.id)[0]["word"], "apple")
+
+    def test_index_follows_writes(self):
+        self.assertTrue(WordSearchIndex.isSupported())
+        Word.objects.filter(text="apply").update(text="applied")
+        Word.objects.filter(text="banana").delete()
+        self.assertEqual(self.words(WordSearchIndex.search("appl", self.domain.id)), [("noun", "apple"), ("verb", "applied")])
+
+    def test_falls_back_without_the_fts_table(self):
+        with mock.patch.dict(WordSearchIndex._supported, {"default": False}):
+            self.assertEqual(self.words(WordSearchIndex.search("red fruit", self.domain.id)), [("noun", "apple")])
+
+    def test_like_fallback(self):
+        results = WordSearchIndex._searchFallback("appl", self.domain.id, True, None, 20)
+        self.assertEqual(self.words(results), [("noun", "apple"), ("noun", "banana"), ("verb", "apply")])
+        self.assertEqual(self.words(WordSearchIndex._searchFallback("red fruit", self.domain.id, True, "noun", 20)), [("noun", "apple")])
+        self.assertEqual(WordSearchIndex._searchFallback("!!", self.domain.id, True, None, 20), [])
+
+
+class DomainTrieIndexTests(TestCase):
+
+    def setUp(self):
+        DomainTrieIndex.invalidate()
+        self.domain = Domain.objects.create(url="https://example.com/")
+        noun = Tag.objects.create(text="noun", domain=self.domain)
+        verb = Tag.objects.create(text="verb", domain=self.domain)
+        for text, tag in [("apple", noun), ("apply", verb), ("apt", noun), ("run", verb)]:
+            Word.objects.create(text=text, details="", tag=tag)
+
+    def tearDown(self):
+        DomainTrieIndex.invalidate()
+
+    def test_validate_and_complete(self):
+        self.assertEqual(DomainTrieIndex.validate(self.domain.id, "apply"), {"verb"})
+        self.assertEqual(DomainTrieIndex.validate(self.domain.id, "apply", "noun"), set())
+        self.assertEqual(DomainTrieIndex.validate(self.domain.id, "app"), set())
+        self.assertEqual(sorted(DomainTrieIndex.complete(self.domain.id, "ap")), ["apple", "apply", "apt"])
+        self.assertEqual(sorted(DomainTrieIndex.complete(self.domain.id, "ap", "noun")), ["apple", "apt"])
+
+    def test_follows_domain_changed(self):
+        DomainTrieIndex.warm(self.domain.id)
+        domain_changed.send(sender=self.__class__, domain_id=self.domain.id, added=[("noun", "apricot")], removed=[("noun", "apt")])
+        self.assertEqual(DomainTrieIndex.validate(self.domain.id, "apricot"), {"noun"})
+        self.assertEqual(DomainTrieIndex.validate(self.domain.id, "apt"), set())
+
+    @override_settings(WORD_INDEX_TTL=-1)
+    def test_expired_index_is_rebuilt_in_the_background(self):
+        DomainTrieIndex.warm(self.domain.id)
+        release = threading.Event()
+        rebuilt = Trie()
+        rebuilt.add("noun", "kiwi")
+        def build(domain_id):
+            release.wait(5)
+            return rebuilt
+        with mock.patch.object(DomainTrieIndex, "build", side_effect=build):
+            # The old index answers while the new one is built
+            self.assertEqual(DomainTrieIndex.validate(self.domain.id, "apple"), {"noun"})
+            thread = DomainTrieIndex._refreshing[self.domain.id]
+            self.assertEqual(DomainTrieIndex.validate(self.domain.id, "apple"), {"noun"})
+            release.set()
+            thread.join(5)
+        self.assertNotIn(self.domain.id, DomainTrieIndex._refreshing)
+        with DomainTrieIndex._domainLock(self.domain.id):
+            self.assertIs(DomainTrieIndex._indexes[self.domain.id][0], rebuilt)
+
+
+class DomainAnagramIndexTests(TestCase):
+
+    def setUp(self):
+        DomainAnagramIndex.invalidate()
+        self.domain = Domain.objects.create(url="https://example.com/")
+        noun = Tag.objects.create(text="noun", domain=self.domain)
+        verb = Tag.objects.create(text="verb", domain=self.domain)
+        for text, tag in [("stop", noun), ("pots", noun), ("tops", verb), ("top", noun), ("post", verb), ("spotless", noun)]:
+            Word.objects.create(text=text, details="", tag=tag)
+
+    def tearDown(self):
+        DomainAnagramIndex.invalidate()
+
+    def test_signature(self):
+        self.assertEqual(Word.signatureOf("Stop-s"), "opsst")
+        self.assertEqual(Word.objects.get(text="pots").signature, "opst")
+
+    def test_formable(self):
+        words = DomainAnagramIndex.formable(self.domain.id, "tsop")
+        self.assertEqual([cur["word"] for cur in words], ["post", "pots", "stop", "tops", "top"])
+        self.assertEqual(words[0]["tags"], ["verb"])
+        self.assertEqual([cur["word"] for cur in DomainAnagramIndex.formable(self.domain.id, "tsop", tag="verb")], ["post", "tops"])
+        self.assertEqual([cur["word"] for cur in DomainAnagramIndex.formable(self.domain.id, "tsop", min_length=4, limit=2)], ["post", "pots"])
+        self.assertEqual(DomainAnagramIndex.formable(self.domain.id, "xyz"), [])
+
+    def test_large_rack_scans_signatures(self):
+        with mock.patch.object(DomainAnagramIndex, "max_subsets", 1):
+            self.assertEqual([cur["word"] for cur in DomainAnagramIndex.formable(self.domain.id, "spotlessx")][:1], ["spotless"])
+            self.assertEqual(len(DomainAnagramIndex.formable(self.domain.id, "tsop")), 5)
+
+
+class DomainSampleIndexTests(TestCase):
+
+    def setUp(self):
+        DomainSampleIndex.invalidate()
+        self.domain = Domain.objects.create(url="https://example.com/")
+        noun = Tag.objects.create(text="noun", domain=self.domain)
+        verb = Tag.objects.create(text="verb", domain=self.domain)
+        self.nouns = {Word.objects.create(text=f"n{i}", details="", tag=noun).id for i in range(20)}
+        self.verbs = {Word.objects.create(text=f"v{i}", details="", tag=verb).id for i in range(5)}
+
+    def tearDown(self):
+        DomainSampleIndex.invalidate()
+
+    def test_sample(self):
+        words = DomainSampleIndex.sample(self.domain.id, 10)
+        self.assertEqual(len({cur["id"] for cur in words}), 10)
+        self.assertTrue({cur["id"] for cur in words} <= self.nouns | self.verbs)
+        words = DomainSampleIndex.sample(self.domain.id, 10, tag="verb")
+        self.assertEqual({cur["id"] for cur in words}, self.verbs)
+        self.assertEqual(DomainSampleIndex.sample(self.domain.id, 10, tag="adj"), [])
+
+    def test_exclude(self):
+        exclude = set(list(self.nouns)[:18])
+        words = DomainSampleIndex.sample(self.domain.id, 10, tag="noun", exclude=exclude)
+        self.assertEqual({cur["id"] for cur in words}, self.nouns - exclude)
+
+    def test_deleted_ids_are_skipped(self):
+        DomainSampleIndex.warm(self.domain.id)
+        # Deleted without a domain_changed, as by another process
+        Word.objects.filter(id__in=list(self.verbs)[:3]).delete()
+        words = DomainSampleIndex.sample(self.domain.id, 5, tag="verb")
+        self.assertEqual({cur["id"] for cur in words}, set(list(self.verbs)[3:]))
+
+
+class SyncEngineTests(TestCase):
+    """
+        The python, staging and chunked sync engines have to leave the same rows and tombstones
+        behind for every combination of SyncMethod, CollectionPriority and SyncControl
+    """
+
+    domain = "https://example.com/"
+
+    def rows(self, rand, count):
+        return [(rand.choice(["noun", "verb", "adj"]), f"w{rand.randint(0, 40)}", rand.choice(["", "d1", "long" * 20])) for _ in range(count)]
+
+    def collection(self, rows, tags=None):
+        collection = TupleKeyCollection()
+        for tag, word, details in rows:
+            if tags == None or tag in tags:
+                collection.add(tag, word, details)
+        return collection
+
+    def reset(self, cached):
+        WordTombstone.objects.all().delete()
+        Word.objects.all().delete()
+        Tag.objects.all().delete()
+        Domain.objects.all().delete()
+        DomainIdCache.clear()
+        SyncHandler.bulkAddToCache(self.collection(cached), self.domain)
+
+    def state(self):
+        words = sorted(Word.objects.filter(tag__domain__url=self.domain).values_list("tag__text", "text", "details", "signature", "details_digest"))
+        tombstones = sorted(WordTombstone.objects.values_list("tag", "text"))
+        return words, tombstones
+
+    def syncPython(self, external, syncMethod, syncPriority, syncControl, tags=None):
+        cached = SpellinBloxHandler.getAllCachedData(self.domain, tags, details=SyncHandler.needsCachedDetails(syncMethod, syncPriority))
+        SyncHandler.syncExternalAndCached(self.collection(external, tags), cached, self.domain, syncMethod, syncPriority, syncControl)
+
+    def assertEnginesAgree(self, cached, external, tags=None):
+        for syncMethod, syncPriority, syncControl in itertools.product(SyncMethod, CollectionPriority, SyncControl):
+            with self.subTest(syncMethod=syncMethod, syncPriority=syncPriority, syncControl=syncControl, tags=tags):
+                self.reset(cached)
+                self.syncPython(external, syncMethod, syncPriority, syncControl, tags)
+                expected = self.state()
+                for engine in (StagingSyncHandler, ChunkedSyncHandler):
+                    self.reset(cached)
+                    engine.syncExternal(self.collection(external), self.domain, syncMethod, syncPriority, syncControl, tags=tags)
+                    self.assertEqual(self.state(), expected, engine.__name__)
+
+    def test_engines_agree(self):
+        rand = random.Random(1)
+        for _ in range(2):
+            self.assertEnginesAgree(self.rows(rand, 60), self.rows(rand, 60))
+
+    def test_engines_agree_on_tag_scoped_syncs(self):
+        rand = random.Random(2)
+        self.assertEnginesAgree(self.rows(rand, 60), self.rows(rand, 60), frozenset({"noun", "missing"}))
+
+    def test_chunked_pages(self):
+        rand = random.Random(3)
+        cached, external = self.rows(rand, 60), self.rows(rand, 60)
+        self.reset(cached)
+        self.syncPython(external, SyncMethod.JOIN, CollectionPriority.EXTERNAL, SyncControl.DELETE)
+        expected = self.state()
+        self.reset(cached)
+        # A budget of one row per page
+        ChunkedSyncHandler.syncExternal(self.collection(external), self.domain, SyncMethod.JOIN, CollectionPriority.EXTERNAL, SyncControl.DELETE, batch_size=7, budget=1)
+        self.assertEqual(self.state(), expected)
+
+
+class DomainRevisionTests(TestCase):
+
+    domain = "https://example.com/"
+
+    def setUp(self):
+        DomainIdCache.clear()
+        collection = TupleKeyCollection()
+        collection.add("noun", "apple", "red")
+        collection.add("noun", "pear", "")
+        SyncHandler.bulkAddToCache(collection, self.domain)
+        self.domain_id = DomainIdCache.domainId(self.domain)
+        WordBatchHandler.run({"delete": [Word.objects.get(text="pear").id]})
+
+    def test_changes(self):
+        self.assertEqual(DomainRevision.current(self.domain_id), 2)
+        changes = DomainRevision.changes(self.domain_id, 1)
+        self.assertEqual((changes["revision"], changes["changed"]), (2, []))
+        self.assertEqual(changes["deleted"], [{"tag": "noun", "word": "pear", "revision": 2}])
+        changes = DomainRevision.changes(self.domain_id, 0)
+        self.assertEqual([(row["word"], row["revision"]) for row in changes["changed"]], [("apple", 1)])
+        self.assertEqual(DomainRevision.changes(self.domain_id, 2)["deleted"], [])
+
+    def test_rewritten_word_hides_its_tombstone(self):
+        WordBatchHandler.run({"create": [{"text": "pear", "tag_id": Tag.objects.get(text="noun").id}]})
+        changes = DomainRevision.changes(self.domain_id, 1)
+        self.assertEqual([row["word"] for row in changes["changed"]], ["pear"])
+        self.assertEqual(changes["deleted"], [])
+
+    def test_prune(self):
+        self.assertEqual(DomainRevision.prune(self.domain_id, timezone.now() - timedelta(days=1)), 0)
+        WordTombstone.objects.update(deleted_at=timezone.now() - timedelta(days=40))
+        out = StringIO()
+        call_command("prune_tombstones", days=30, stdout=out)
+        self.assertIn("Pruned 1 tombstones", out.getvalue())
+        self.assertFalse(WordTombstone.objects.exists())
+        self.assertEqual(DomainRevision.horizon(self.domain_id), 2)
+        with self.assertRaises(ResyncRequired):
+            DomainRevision.changes(self.domain_id, 1)
+        self.assertEqual(DomainRevision.changes(self.domain_id, 2)["deleted"], [])
+        self.assertEqual(len(DomainRevision.changes(self.domain_id, 0)["changed"]), 1)
+        response = self.client.get("/changes", {"domain": self.domain, "since": 1})
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.json(), {"resync": True, "revision": 2, "horizon": 2})
+        self.assertEqual(self.client.get("/changes", {"domain": self.domain, "since": 2}).status_code, 200)
+
+
+class DomainEventsTests(TestCase):
+
+    domain = "https://example.com/"
+
+    def setUp(self):
+        DomainIdCache.clear()
+        self.domain_id = Domain.objects.create(url=self.domain, revision=3).id
+
+    def test_wsgi_stream_sends_each_event(self):
+        response = self.client.get("/events", {"domain": self.domain})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        chunks = iter(response.streaming_content)
+        self.assertEqual(next(chunks), f'event: hello\nid: 3\ndata: {{"domain_id": {self.domain_id}, "revision": 3}}\n\n'.encode())
+        DomainEvents.publish(self.domain_id, "sync", {"domain_id": self.domain_id, "completed": True, "error": ""})
+        self.assertTrue(next(chunks).startswith(b"event: sync\n"))
+        response.close()
+        self.assertEqual(DomainEvents.bus().count(self.domain_id), 0)
+
+    async def test_asgi_stream_sends_the_hello(self):
+        response = await self.async_client.get("/events", {"domain": self.domain})
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b"event: hello\nid: 3\n"))
+        await chunks.aclose()
+
+    def test_unknown_domain(self):
+        self.assertEqual(self.client.get("/events", {"domain": "https://example.org/"}).status_code, 404)
+
+    def test_details_only_edit_publishes_a_revision(self):
+        tag = Tag.objects.create(domain_id=self.domain_id, text="noun")
+        word = Word.objects.create(tag=tag, text="apple", details="red")
+        sub = DomainEvents.bus().subscribeSync(self.domain_id)
+        self.addCleanup(DomainEvents.bus().unsubscribe, sub)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = authedClient(self.client).patch(f"/api/words/{word.id}/", {"details": "green"}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sub.get(timeout=1), {"event": "revision", "data": {"domain_id": self.domain_id, "revision": 4}})
+
+
+class DomainIdCacheTests(TestCase):
+
+    domain = "https://example.com/"
+
+    def setUp(self):
+        DomainIdCache.clear()
+
+    def test_tag_deleted_by_another_process(self):
+        domain_id = DomainIdCache.domainId(self.domain, create=True)
+        noun_id = DomainIdCache.tagIds(domain_id, {"noun"})["noun"]
+        DomainIdCache._cache("_tags").set((domain_id, "noun"), noun_id)
+        # Deleted without the signals of this process seeing it
+        Tag.objects.filter(id=noun_id)._raw_delete("default")
+        tag_map = DomainIdCache.tagIds(domain_id, {"noun"})
+        self.assertNotEqual(tag_map["noun"], noun_id)
+        self.assertEqual(Tag.objects.get(domain_id=domain_id, text="noun").id, tag_map["noun"])
+        collection = TupleKeyCollection()
+        collection.add("noun", "apple", "")
+        SyncHandler.bulkAddToCache(collection, self.domain)
+        self.assertEqual(Word.objects.get(text="apple").tag_id, tag_map["noun"])
+
+
+class DomainSnapshotTests(TestCase):
+
+    domain = "https://example.com/"
+
+    def setUp(self):
+        DomainIdCache.clear()
+        self.snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.snapshot_dir.cleanup)
+        settings = override_settings(DOMAIN_SNAPSHOTS=True, SNAPSHOT_DIR=self.snapshot_dir.name, SNAPSHOT_REVISION_TTL=60)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        collection = TupleKeyCollection()
+        for tag, word in (("noun", "zoo"), ("noun", "éclair"), ("verb", "Zap"), ("noun", "Zap"), ("noun", "apple")):
+            collection.add(tag, word, word.upper())
+        SyncHandler.bulkAddToCache(collection, self.domain)
+        self.domain_id = DomainIdCache.domainId(self.domain)
+        DomainSnapshots._readers.clear()
+        DomainSnapshots._checked.clear()
+
+    def test_rows_are_written_in_byte_order(self):
+        self.assertEqual(DomainSnapshots.build(self.domain_id), DomainRevision.current(self.domain_id))
+        reader = DomainSnapshots.get(self.domain_id)
+        self.assertEqual([(tag, word) for tag, word, _ in reader.rows()], [("noun", "Zap"), ("verb", "Zap"), ("noun", "apple"), ("noun", "zoo"), ("noun", "éclair")])
+        self.assertEqual(reader.find("éclair"), [("noun", "éclair", "ÉCLAIR")])
+        self.assertEqual(reader.tags(), ["noun", "verb"])
+
+    def test_unsorted_rows_are_refused(self):
+        path = os.path.join(self.snapshot_dir.name, "unsorted.snap")
+        with self.assertRaises(SnapshotError):
+            writeSnapshot(path, 1, [("noun", "b", ""), ("noun", "a", "")], ["noun"])
+        with self.assertRaises(SnapshotError):
+            writeSnapshot(path, 1, [("verb", "a", "")], ["noun"])
+        self.assertEqual(os.listdir(self.snapshot_dir.name), [])
+
+    def test_revision_is_checked_after_a_change(self):
+        DomainSnapshots.build(self.domain_id)
+        self.assertIsNotNone(DomainSnapshots.get(self.domain_id))
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(DomainSnapshots.get(self.domain_id))
+        with self.captureOnCommitCallbacks(execute=True):
+            WordBatchHandler.run({"delete": [Word.objects.get(text="zoo").id]})
+        self.assertIsNone(DomainSnapshots.get(self.domain_id))
+
+    def test_revision_is_checked_after_the_ttl(self):
+        DomainSnapshots.build(self.domain_id)
+        self.assertIsNotNone(DomainSnapshots.get(self.domain_id))
+        # Written by another process, this one gets no signal
+        Domain.objects.filter(id=self.domain_id).update(revision=F("revision") + 1)
+        self.assertIsNotNone(DomainSnapshots.get(self.domain_id))
+        with override_settings(SNAPSHOT_REVISION_TTL=0):
+            self.assertIsNone(DomainSnapshots.get(self.domain_id))
+
+
+class WireFormatTests(TestCase):
+
+    domain = "https://example.com/"
+
+    def setUp(self):
+        DomainIdCache.clear()
+        collection = TupleKeyCollection()
+        collection.add("noun", "apple", "red")
+        collection.add("noun", "éclair", "")
+        collection.add("verb", "run", "x" * 300)
+        SyncHandler.bulkAddToCache(collection, self.domain)
+        self.domain_id = DomainIdCache.domainId(self.domain)
+        WordBatchHandler.run({"delete": [Word.objects.get(text="run").id]})
+
+    def test_varints(self):
+        for val in (0, 1, 127, 128, 300, 2 ** 35 + 5):
+            self.assertEqual(wire_format.Decoder(wire_format.varint(val)).varint(), val)
+        with self.assertRaises(wire_format.WireFormatError):
+            wire_format.Decoder(b"\x80").varint()
+
+    def test_words_round_trip(self):
+        rows = [("noun", "apple", "red"), ("verb", "é" * 100, "d" * 200), ("noun", "pear", None)]
+        decoded = wire_format.Decoder(wire_format.encodeWords(300, rows)).decode()
+        self.assertEqual(decoded["revision"], 300)
+        self.assertEqual([(row["tag"], row["word"], row["details"]) for row in decoded["words"]], [(tag, word, details or "") for tag, word, details in rows])
+
+    def test_accept(self):
+        self.assertTrue(wire_format.acceptsBinary("application/json;q=0.5, application/vnd.wordblox.words"))
+        self.assertFalse(wire_format.acceptsBinary("application/vnd.wordblox.words;q=0"))
+        self.assertFalse(wire_format.acceptsBinary(None))
+
+    def assertSameAsJson(self, path, params):
+        json_response = self.client.get(path, params)
+        binary_response = self.client.get(path, params, HTTP_ACCEPT=wire_format.CONTENT_TYPE)
+        self.assertEqual(binary_response["Content-Type"], wire_format.CONTENT_TYPE)
+        self.assertEqual(binary_response["Vary"], "Accept")
+        self.assertEqual(wire_format.Decoder(binary_response.content).decode(), json_response.json())
+        return json_response.json()
+
+    def test_words_endpoint(self):
+        data = self.assertSameAsJson("/words", {"domain": self.domain})
+        self.assertEqual([row["word"] for row in data["words"]], ["apple", "éclair"])
+
+    def test_changes_endpoint(self):
+        data = self.assertSameAsJson("/changes", {"domain": self.domain, "since": 0})
+        self.assertEqual(len(data["changed"]), 2)
+        data = self.assertSameAsJson("/changes", {"domain": self.domain, "since": 1})
+        self.assertEqual(data["deleted"], [{"tag": "verb", "word": "run", "revision": 2}])
+
+
+class FastJsonTests(TestCase):
+
+    values = [
+        {"word": "éclair", "tags": ["noun", "ü"], "id": 2 ** 40, "ok": True, "none": None},
+        {"sep": "line\u2028para\u2029end", "quote": "\"\\\n"},
+        {"at": timezone.now(), "uuid": uuid.uuid4(), "date": timezone.now().date()},
+        {"error": ErrorDetail("Not valid", code="invalid"), "big": 2 ** 70, "nested": [{"a": []}]},
+        ReturnDict({"text": "apple"}, serializer=None),
+    ]
+
+    def assertSameBytes(self):
+        for value in self.values:
+            self.assertEqual(fast_json.FastJSONRenderer().render(value), JSONRenderer().render(value))
+            self.assertEqual(fast_json.FastJsonResponse(value).content, JsonResponse(value).content)
+            self.assertEqual(fast_json.dumps(value, fast_json.COMPACT, JSONRenderer.encoder_class), JSONRenderer().render(value))
+
+    def test_same_bytes_as_the_stdlib(self):
+        self.assertSameBytes()
+
+    @override_settings(FAST_JSON=False)
+    def test_same_bytes_without_the_fast_encoder(self):
+        self.assertSameBytes()
+
+    def test_handler_style(self):
+        self.assertEqual(self.client.get("/is_auth").content, b'{"auth": false}')
+        with override_settings(JSON_HANDLER_STYLE=fast_json.COMPACT):
+            self.assertEqual(self.client.get("/is_auth").content, b'{"auth":false}')
+
+
+class QueueListenerHandlerTests(TestCase):
+
+    def setUp(self):
+        self.handler = QueueListenerHandler()
+        self.addCleanup(self.handler.stopListener)
+
+    def record(self, msg, args, exc_info=None):
+        return logging.LogRecord("wordtag", logging.ERROR, __file__, 1, msg, args, exc_info)
+
+    def test_message_is_merged_before_queueing(self):
+        rows = ["apple"]
+        record = self.handler.prepare(self.record("rows %s", (rows,)))
+        rows.append("pear")
+        self.assertEqual((record.msg, record.args), ("rows ['apple']", None))
+        self.assertEqual(record.getMessage(), "rows ['apple']")
+
+    def test_exception_is_rendered_into_the_message(self):
+        try:
+            raise ValueError("bad row")
+        except ValueError:
+            record = self.handler.prepare(self.record("sync %s failed", ("x",), sys.exc_info()))
+        self.assertIsNone(record.exc_info)
+        self.assertIsNone(record.exc_text)
+        self.assertTrue(record.msg.startswith("sync x failed\nTraceback"))
+        self.assertIn("ValueError: bad row", record.msg)
+
+
+class ReplicaTests(TestCase):
+
+    def test_writes_pin_only_their_model(self):
+        router = replica.PrimaryReplicaRouter()
+
+        def reads():
+            with replica.replicaReads():
+                return router.db_for_read(Word), router.db_for_read(Tag)
+
+        def run():
+            self.assertEqual(reads(), ("replica", "replica"))
+            router.db_for_write(Session)
+            self.assertEqual(reads(), ("replica", "replica"))
+            self.assertEqual(router.db_for_write(Word), replica.PRIMARY)
+            self.assertEqual(reads(), (None, "replica"))
+            self.assertEqual(router.db_for_read(Word), None)
+
+        with mock.patch.object(replica, "replicaAlias", return_value="replica"):
+            contextvars.copy_context().run(run)
+
+    @override_settings(REPLICA_COPY_DELAY=0.05)
+    def test_copies_are_coalesced(self):
+        done = threading.Event()
+        with mock.patch.object(replica, "hasSqliteReplica", return_value=True), mock.patch.object(replica, "copyToReplica") as copy:
+            self.assertFalse(replica.afterCopy(done.set))
+            for _ in range(3):
+                self.assertTrue(replica.scheduleCopy())
+            self.assertTrue(replica.afterCopy(done.set))
+            self.assertTrue(done.wait(5))
+            for _ in range(50):
+                if replica._copy_thread == None:
+                    break
+                time.sleep(0.05)
+        self.assertIsNone(replica._copy_thread)
+        self.assertEqual(copy.call_count, 1)
+
+    def test_no_copy_without_a_sqlite_replica(self):
+        self.assertFalse(replica.scheduleCopy())
+
+
+@skipUnless(DomainShards.isEnabled(), "Needs DOMAIN_SHARDS")
+class DomainShardRevisionTests(TestCase):
+
+    databases = "__all__"
+    domain = "https://example.com/"
+
+    def setUp(self):
+        DomainIdCache.clear()
+        collection = TupleKeyCollection()
+        collection.add("noun", "apple", "")
+        SyncHandler.bulkAddToCache(collection, self.domain)
+        self.domain_id = DomainIdCache.domainId(self.domain)
+        self.alias = DomainShards.alias(self.domain_id)
+
+    def test_revision_is_kept_with_the_rows(self):
+        self.assertNotEqual(self.alias, PRIMARY)
+        self.assertEqual(Domain.objects.using(self.alias).get(id=self.domain_id).revision, 1)
+        self.assertEqual(DomainRevision.current(self.domain_id), 1)
+        self.assertEqual(DomainRevision.changes(self.domain_id, 0)["revision"], 1)
+
+    def test_bump_rolls_back_with_the_rows(self):
+        with self.assertRaises(ValueError):
+            with DomainShards.use(self.domain_id), DomainShards.atomic():
+                applied, _ = WordBatchHandler.run({"domain_id": self.domain_id, "delete": [Word.objects.get(text="apple").id]})
+                self.assertTrue(applied)
+                self.assertEqual(DomainRevision.current(self.domain_id), 2)
+                raise ValueError()
+        self.assertEqual(DomainRevision.current(self.domain_id), 1)
+        self.assertTrue(Word.objects.using(self.alias).filter(text="apple").exists())
+
+
+class AdmissionTests(TestCase):
+
+    domain = "https://example.com/"
+
+    def setUp(self):
+        self.resetLimiters()
+        self.addCleanup(self.resetLimiters)
+        patcher = mock.patch("wordtag.views.FetchController")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(lock_dir.cleanup)
+        settings = override_settings(SYNC_LOCK_DIR=lock_dir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def resetLimiters(self):
+        SyncAdmission._ip_limiter = None
+        SyncAdmission._domain_limiter = None
+        SyncAdmission._in_flight = None
+        DomainSyncCoordinator._flight = None
+
+    def login(self, **data):
+        return self.client.post("/login", json.dumps({"domain": self.domain, "username": "u", "password": "p", **data}), content_type="application/json")
+
+    def test_bucket_refills(self):
+        now = [100.0]
+        limiter = RateLimiter(1, 2)
+        with mock.patch("utils.rate_limit.time.monotonic", side_effect=lambda: now[0]):
+            self.assertEqual(limiter.take("a"), 0)
+            self.assertEqual(limiter.take("a"), 0)
+            self.assertAlmostEqual(limiter.take("a"), 1)
+            self.assertEqual(limiter.take("b"), 0)
+            now[0] += 1
+            self.assertEqual(limiter.take("a"), 0)
+        self.assertEqual(RateLimiter(0, 1).take("a"), 0)
+
+    def test_concurrency_cap(self):
+        limiter = ConcurrencyLimiter(1)
+        with limiter.slot(0, "busy", 5):
+            with self.assertRaises(RateLimited) as raised:
+                with limiter.slot(0, "busy", 5):
+                    pass
+        self.assertEqual(raised.exception.retryAfterHeader(), "5")
+        with limiter.slot(0, "busy", 5):
+            pass
+
+    @override_settings(RATE_LIMIT_IP_BURST=1)
+    def test_client_limit(self):
+        Domain.objects.create(url=self.domain, last_synced=timezone.now())
+        self.assertEqual(self.login().status_code, 200)
+        response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+
+    @override_settings(RATE_LIMIT_DOMAIN_BURST=1)
+    def test_domain_is_charged_only_for_pulls(self):
+        Domain.objects.create(url=self.domain, last_synced=timezone.now())
+        for _ in range(3):
+            self.assertTrue(self.login().json()["fresh"])
+        with mock.patch.object(SpellinBloxPullHandler, "pullAndSync", return_value={"syncCompleted": True, "syncErr": ""}) as pull:
+            self.assertEqual(self.login(tags=["noun"]).status_code, 200)
+            # Handed the result of the pull that just finished
+            self.assertEqual(self.login(tags=["noun"]).status_code, 200)
+            with override_settings(SYNC_COALESCE_WINDOW=0):
+                DomainSyncCoordinator._flight = None
+                self.assertEqual(self.login(tags=["noun"]).status_code, 429)
+        self.assertEqual(pull.call_count, 1)
+
+    def test_tag_pull_shares_the_domain_lock(self):
+        def tagPull():
+            # A full pull of the domain waits for the tag-scoped one
+            with self.assertRaises(FileLockTimeout):
+                FileLock(DomainSyncCoordinator.lockPath(self.domain), 0).acquire()
+            return {"syncCompleted": True, "pulled": "noun"}
+        key = SpellinBloxPullHandler.flightKey(self.domain, ["noun"])
+        self.assertEqual(DomainSyncCoordinator.run(self.domain, tagPull, key=key)["pulled"], "noun")
+        # Another worker process: only the lock file is shared
+        DomainSyncCoordinator._flight = None
+        self.assertEqual(DomainSyncCoordinator.run(self.domain, lambda: {"pulled": "all"})["pulled"], "all")
+        DomainSyncCoordinator._flight = None
+        self.assertEqual(DomainSyncCoordinator.run(self.domain, lambda: {"pulled": "again"}, key=key)["pulled"], "noun")
+        self.assertEqual(DomainSyncCoordinator.run(self.domain, lambda: {"pulled": "again"})["pulled"], "all")
+
+
+class SingleFlightTests(TestCase):
+
+    class CountingEvent(threading.Event):
+
+        def __init__(self):
+            super().__init__()
+            self.waiting = 0
+            self.lock = threading.Lock()
+
+        def wait(self, timeout=None):
+            with self.lock:
+                self.waiting += 1
+            return super().wait(timeout)
+
+    def runConcurrently(self, flight, fn, callers=4):
+        """
+            Calls flight.do from callers threads while the first call is still running
+
+            @return {list}  The (result, shared) tuple or the exception of each caller
+        """
+        started = threading.Event()
+        release = threading.Event()
+        outcomes = [None] * callers
+
+        def job():
+            started.set()
+            release.wait(5)
+            return fn()
+
+        def caller(i):
+            try:
+                outcomes[i] = flight.do("key", job, 5)
+            except Exception as e:
+                outcomes[i] = e
+
+        threads = [threading.Thread(target=caller, args=(i,)) for i in range(callers)]
+        threads[0].start()
+        self.assertTrue(started.wait(5))
+        event = flight._calls["key"].event = self.CountingEvent()
+        for thread in threads[1:]:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while event.waiting < callers - 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_callers_share_one_run(self):
+        runs = []
+        flight = SingleFlight(0)
+        outcomes = self.runConcurrently(flight, lambda: runs.append(1) or {"n": len(runs)})
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(outcomes[0], ({"n": 1}, False))
+        self.assertEqual(outcomes[1:], [({"n": 1}, True)] * 3)
+        # Without a window a later call runs again
+        self.assertEqual(flight.do("key", lambda: "again"), ("again", False))
+
+    def test_callers_share_the_exception(self):
+        runs = []
+
+        def fail():
+            runs.append(1)
+            raise ValueError("fetch failed")
+        flight = SingleFlight(60)
+        outcomes = self.runConcurrently(flight, fail)
+        self.assertEqual(len(runs), 1)
+        self.assertTrue(all(isinstance(outcome, ValueError) for outcome in outcomes))
+        # A failure is not reused within the window
+        self.assertEqual(flight.do("key", lambda: "retried"), ("retried", False))
+
+    def test_result_reused_within_window(self):
+        flight = SingleFlight(60)
+        self.assertEqual(flight.do("key", lambda: 1), (1, False))
+        self.assertEqual(flight.do("key", lambda: 2), (1, True))
+        self.assertEqual(flight.do("other", lambda: 3), (3, False))
+
+
+class FileLockTests(TestCase):
+
+    def setUp(self):
+        lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(lock_dir.cleanup)
+        self.path = os.path.join(lock_dir.name, "domain.lock")
+
+    def acquireInProcess(self):
+        """
+            @return {str}   The state another process finds once it gets the lock, or "timeout"
+        """
+        script = (
+            "import sys\n"
+            "from utils.single_flight import FileLock, FileLockTimeout\n"
+            "try:\n"
+            "    with FileLock(sys.argv[1], 0.2) as lock:\n"
+            "        print(lock.state().get('holder'))\n"
+            "except FileLockTimeout:\n"
+            "    print('timeout')\n"
+        )
+        env = {**os.environ, "PYTHONPATH": os.path.dirname(os.path.dirname(os.path.abspath(single_flight.__file__)))}
+        return subprocess.run([sys.executable, "-c", script, self.path], capture_output=True, text=True, timeout=30, env=env).stdout.strip()
+
+    def test_excludes_a_second_thread(self):
+        with FileLock(self.path):
+            with self.assertRaises(FileLockTimeout):
+                FileLock(self.path, 0.1).acquire()
+        with FileLock(self.path, 0.1):
+            pass
+
+    @skipUnless(single_flight.fcntl != None, "fcntl locks are not available")
+    def test_excludes_a_second_process(self):
+        with FileLock(self.path) as lock:
+            lock.setState({"holder": "first"})
+            self.assertEqual(self.acquireInProcess(), "timeout")
+        self.assertEqual(self.acquireInProcess(), "first")
+
+
+class WarmupTests(TestCase):
+
+    def setUp(self):
+        Warmup._done = None
+        self.addCleanup(setattr, Warmup, "_done", None)
+
+    @override_settings(WARMUP_ON_START=True)
+    def test_only_the_server_entry_points_warm_up(self):
+        with mock.patch.object(Warmup, "run") as run:
+            apps.get_app_config("wordtag").ready()
+            call_command("check", stdout=StringIO())
+            self.assertIsNone(Warmup._done)
+            self.assertTrue(Warmup.serverStart())
+        run.assert_called_once_with()
+
+    def test_off_by_default(self):
+        with mock.patch.object(Warmup, "run") as run:
+            self.assertTrue(Warmup.serverStart())
+        run.assert_not_called()
+        self.assertIsNone(Warmup._done)
+
+
+class ScopedPushTests(TestCase):
+
+    domain = "https://example.com/"
+
+    def setUp(self):
+        DomainIdCache.clear()
+        SyncAdmission._ip_limiter = None
+        SyncAdmission._domain_limiter = None
+        collection = TupleKeyCollection()
+        collection.add("noun", "apple", "new")
+        collection.add("verb", "run", "stale")
+        SyncHandler.bulkAddToCache(collection, self.domain)
+        patcher = mock.patch("wordtag.views.FetchController")
+        self.controller = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.controller.payload_bytes = 0
+        self.controller.getData.return_value = {"wordtags": [
+            {"tag": "noun", "word": "apple", "details": "old"},
+            {"tag": "noun", "word": "pear", "details": ""},
+            {"tag": "verb", "word": "run", "details": "server"},
+        ]}
+        self.controller.sendData.return_value = {"saved": True}
+
+    def push(self, **data):
+        return authedClient(self.client).post("/push_data", json.dumps({"domain": self.domain, "username": "u", "password": "p", **data}), content_type="application/json")
+
+    def sent(self):
+        payload = self.controller.sendData.call_args[0][0]
+        return sorted((row["tag"], row["word"], row["details"]) for row in payload["words"])
+
+    def test_scoped_push_keeps_the_other_tags(self):
+        self.assertEqual(self.push(tags=["noun"]).json(), {"saved": True})
+        self.assertEqual(self.sent(), [("noun", "apple", "new"), ("verb", "run", "server")])
+
+    def test_push_sends_the_cache(self):
+        self.assertEqual(self.push().status_code, 200)
+        self.controller.getData.assert_not_called()
+        self.assertEqual(self.sent(), [("noun", "apple", "new"), ("verb", "run", "stale")])
+
+    def test_scoped_push_needs_the_external_rows(self):
+        self.controller.getData.side_effect = RuntimeError("down")
+        self.assertEqual(self.push(tags=["noun"]).status_code, 500)
+        self.controller.sendData.assert_not_called()
+
+
+class DetailsDigestTests(TestCase):
+
+    domain = "https://example.com/"
+
+    def setUp(self):
+        DomainIdCache.clear()
+        collection = TupleKeyCollection()
+        collection.add("noun", "apple", "red")
+        SyncHandler.bulkAddToCache(collection, self.domain)
+
+    def test_sync_compares_digests(self):
+        self.assertEqual(Word.objects.get(text="apple").details_digest, Word.digestOf("red"))
+        collection = TupleKeyCollection()
+        collection.add("noun", "apple", "green")
+        SyncHandler.bulkAddToCache(collection, self.domain)
+        word = Word.objects.get(text="apple")
+        self.assertEqual((word.details, word.details_digest), ("green", Word.digestOf("green")))
+
+    def test_list_without_details(self):
+        client = authedClient(self.client)
+        row = client.get("/api/words/").json()[0]
+        self.assertEqual((row["details"], row["details_digest"]), ("red", Word.digestOf("red")))
+        row = client.get("/api/words/", {"details": "0"}).json()[0]
+        self.assertNotIn("details", row)
+        self.assertEqual(row["details_digest"], Word.digestOf("red"))
+
+
+class TagApiTests(TestCase):
+
+    domain = "https://example.com/"
+    other_domain = "https://example.org/"
+
+    def setUp(self):
+        DomainIdCache.clear()
+        collection = TupleKeyCollection()
+        collection.add("noun", "apple", "")
+        collection.add("noun", "pear", "")
+        SyncHandler.bulkAddToCache(collection, self.domain)
+        self.domain_id = DomainIdCache.domainId(self.domain)
+        self.tag = Tag.objects.get(text="noun")
+        self.client = authedClient(self.client)
+
+    def deleted(self, domain_id):
+        return sorted(WordTombstone.objects.filter(domain_id=domain_id).values_list("tag", "text"))
+
+    def test_delete_tag(self):
+        response = self.client.delete(f"/api/tags/{self.tag.id}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Word.objects.exists())
+        self.assertEqual(self.deleted(self.domain_id), [("noun", "apple"), ("noun", "pear")])
+        self.assertEqual(DomainRevision.current(self.domain_id), 2)
+
+    def test_move_tag_to_another_domain(self):
+        other_id = DomainIdCache.domainId(self.other_domain, create=True)
+        response = self.client.patch(f"/api/tags/{self.tag.id}/", {"domain_id": other_id}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Tag.objects.get(id=self.tag.id).domain_id, other_id)
+        self.assertEqual(self.deleted(self.domain_id), [("noun", "apple"), ("noun", "pear")])
+        self.assertEqual(DomainRevision.current(other_id), 1)
+        self.assertEqual(sorted(row["word"] for row in DomainRevision.changes(other_id, 0)["changed"]), ["apple", "pear"])
+
+
+class FreshnessTests(TestCase):
+
+    domain = "https://example.com/"
+
+    def setUp(self):
+        DomainIdCache.clear()
+        self.controller = mock.Mock()
+        self.controller.payload_bytes = 0
+        self.controller.getData.return_value = {"wordtags": [{"tag": "noun", "word": "apple", "details": ""}]}
+
+    def test_missing_fresh_and_stale(self):
+        self.assertEqual(SpellinBloxPullHandler.freshness(self.domain), Freshness.MISSING)
+        domain = Domain.objects.create(url=self.domain)
+        self.assertEqual(SpellinBloxPullHandler.freshness(self.domain), Freshness.MISSING)
+        Domain.objects.filter(id=domain.id).update(last_synced=timezone.now())
+        self.assertEqual(SpellinBloxPullHandler.freshness(self.domain), Freshness.FRESH)
+        Domain.objects.filter(id=domain.id).update(last_synced=timezone.now() - timedelta(seconds=120), sync_ttl=60)
+        self.assertEqual(SpellinBloxPullHandler.freshness(self.domain), Freshness.STALE)
+
+    def test_pull_makes_the_domain_fresh(self):
+        self.assertTrue(SpellinBloxPullHandler.pullAndSync(self.controller, self.domain)["syncCompleted"])
+        self.assertEqual(SpellinBloxPullHandler.freshness(self.domain), Freshness.FRESH)
+        self.assertTrue(Word.objects.filter(text="apple").exists())
+
+    def test_failed_fetch_of_a_new_domain(self):
+        self.controller.getData.side_effect = ExternalServerFetchException("ERROR: Data could not be fetched", 502)
+        result = SpellinBloxPullHandler.pullAndSync(self.controller, self.domain)
+        self.assertFalse(result["syncCompleted"])
+        self.assertIn("could not be fetched", result["syncErr"])
+        self.assertFalse(Domain.objects.filter(url=self.domain).exists())
+        self.assertEqual(SpellinBloxPullHandler.freshness(self.domain), Freshness.MISSING)
+
+    def test_failed_fetch_keeps_a_domain_stale(self):
+        self.assertTrue(SpellinBloxPullHandler.pullAndSync(self.controller, self.domain)["syncCompleted"])
+        last_synced = timezone.now() - timedelta(seconds=120)
+        Domain.objects.filter(url=self.domain).update(last_synced=last_synced, sync_ttl=60)
+        self.controller.getData.side_effect = ExternalServerFetchException("ERROR: Data could not be fetched", 502)
+        self.assertFalse(SpellinBloxPullHandler.pullAndSync(self.controller, self.domain)["syncCompleted"])
+        self.assertEqual(Domain.objects.get(url=self.domain).last_synced, last_synced)
+        self.assertEqual(SpellinBloxPullHandler.freshness(self.domain), Freshness.STALE)
+        # The cached rows are kept, an outage is not an empty domain
+        self.assertTrue(Word.objects.filter(text="apple").exists())
+
+
+class SyncRunTests(TestCase):
+
+    domain = "https://example.com/"
+
+    def setUp(self):
+        DomainIdCache.clear()
+        SyncAdmission._ip_limiter = None
+        SyncAdmission._domain_limiter = None
+        patcher = mock.patch("wordtag.views.FetchController")
+        self.controller = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.controller.payload_bytes = 64
+        self.controller.getData.return_value = {"wordtags": [{"tag": "noun", "word": "apple", "details": ""}]}
+        self.controller.sendData.return_value = {"saved": True}
+
+    def push(self):
+        return authedClient(self.client).post("/push_data", json.dumps({"domain": self.domain, "username": "u", "password": "p"}), content_type="application/json")
+
+    def runs(self):
+        return list(SyncRun.objects.order_by("id").values_list("kind", "completed", "error"))
+
+    def test_pulls_are_recorded(self):
+        self.assertTrue(SpellinBloxPullHandler.pullAndSync(self.controller, self.domain)["syncCompleted"])
+        run = SyncRun.objects.get()
+        self.assertEqual((run.kind, run.completed, run.new_rows, run.payload_bytes), ("pull", True, 1, 64))
+        self.controller.getData.side_effect = ExternalServerFetchException("ERROR: Data could not be fetched", 502)
+        self.assertFalse(SpellinBloxPullHandler.pullAndSync(self.controller, self.domain)["syncCompleted"])
+        self.assertEqual(self.runs()[1][:2], ("pull", False))
+        self.assertIn("could not be fetched", self.runs()[1][2])
+
+    def test_pushes_are_recorded(self):
+        SpellinBloxPullHandler.pullAndSync(self.controller, self.domain)
+        self.assertEqual(self.push().status_code, 200)
+        self.controller.sendData.side_effect = RuntimeError("down")
+        self.assertEqual(self.push().status_code, 500)
+        self.assertEqual(self.runs()[1:], [("push", True, ""), ("push", False, "down")])
+
+    def test_handler_needs_authentication(self):
+        SpellinBloxPullHandler.pullAndSync(self.controller, self.domain)
+        self.assertEqual(self.client.get("/sync_runs", {"domain": self.domain}).status_code, 403)
+        self.push()
+        response = authedClient(self.client).get("/sync_runs", {"domain": self.domain})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([run["kind"] for run in response.json()["runs"]], ["push", "pull"])
+        # Only the pulls are aggregated
+        self.assertEqual(response.json()["summary"]["runs"], 1)
+
+
+class ImportExportCommandTests(TestCase):
+
+    domain = "https://example.com/"
+
+    def setUp(self):
+        DomainIdCache.clear()
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        self.data_dir = data_dir.name
+        collection = TupleKeyCollection()
+        for tag, word, details in (("noun", "apple", "red"), ("noun", "pear", ""), ("verb", "run", "fast")):
+            collection.add(tag, word, details)
+        SyncHandler.bulkAddToCache(collection, self.domain)
+
+    def path(self, name):
+        return os.path.join(self.data_dir, name)
+
+    def rows(self, domain):
+        return sorted(Word.objects.filter(tag__domain__url=domain).values_list("tag__text", "text", "details"))
+
+    def test_round_trip(self):
+        other = "https://example.org/"
+        for name in ("words.jsonl", "words.csv"):
+            call_command("export_wordtags", self.path(name), domain=self.domain, stderr=StringIO())
+            out = StringIO()
+            call_command("import_wordtags", self.path(name), domain=other, stdout=out)
+            self.assertIn("Imported 3 rows", out.getvalue())
+            self.assertEqual(self.rows(other), self.rows(self.domain))
+
+    def test_delete_removes_words_not_in_the_file(self):
+        with open(self.path("words.jsonl"), "w", encoding="utf-8") as f:
+            f.write(json.dumps({"tag": "noun", "word": "apple", "details": "green"}) + "\n")
+        out = StringIO()
+        call_command("import_wordtags", self.path("words.jsonl"), domain=self.domain, delete=True, stdout=out)
+        self.assertIn("2 deleted", out.getvalue())
+        self.assertEqual(self.rows(self.domain), [("noun", "apple", "green")])
+
+    def test_missing_file(self):
+        with self.assertRaises(CommandError):
+            call_command("import_wordtags", self.path("missing.jsonl"), domain=self.domain, stdout=StringIO())
+
+    def test_unknown_domain(self):
+        with self.assertRaises(CommandError):
+            call_command("export_wordtags", self.path("words.jsonl"), domain="https://example.org/", stderr=StringIO())
+        self.assertFalse(os.path.exists(self.path("words.jsonl")))
@@ -1,13 +1,39 @@
-from rest_framework import viewsets
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 from utils.create_spellinblox_wordtag_dict import SpellinBloxPushDataCrafter
 from .models import Word, Tag, Domain
 from .serializers import DomainSerializer, TagSerializer, WordSerializer
+from .batch import BatchError, TagBatchHandler, WordBatchHandler
+from .search import WordSearchIndex
+from .signals import notify_domain_changed, notify_domain_synced
+from .word_index import DomainAnagramIndex, DomainSampleIndex, DomainTrieIndex
+from .sync_coordinator import DomainSyncCoordinator
+from .revisions import DomainRevision, ResyncRequired, RevisionScope
+from .events import DomainEvents
+from .id_cache import DomainIdCache
+from .snapshots import DomainSnapshots
+from .replica import ReplicaReadMixin
+from .shards import DomainShardMixin, DomainShards
+from .admission import SyncAdmission
+from .sync_runs import DomainSyncRuns, SyncRunRecorder
+from asgiref.sync import sync_to_async
+from utils.single_flight import FileLockTimeout, SingleFlightTimeout
+from utils.rate_limit import RateLimited
 from utils.fetch_word_data import ExternalServerFetchException, FetchController
-from django.http import HttpResponse, JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
 from utils.json_input_handler import LoginDomainLockedJsonHandler
 from utils.word_tag_data import TupleKeyCollection, SyncMethod
 from utils.session_auth import clear_session, set_auth_token, verify_auth
+from utils.log_utils import SampledLogger
+from utils import wire_format
+from django.conf import settings
 import json
+from array import array
+from datetime import timedelta
 from enum import Enum
 import logging
 
@@ -24,6 +50,16 @@ class SyncControl(Enum):
     MERGE = 0   # This refers to merging the rows that do not exist in both Cached and External
     DELETE = 1  # This refers to the completely overwritting the database based on CollectionPriority
 
+class Freshness(Enum):
+    MISSING = 0 # The domain has never been pulled, a pull has to finish before its data can be used
+    FRESH = 1   # Pulled within its TTL, no pull is needed
+    STALE = 2   # Pulled before, the cached data is served while a pull runs in the background
+
+class SyncEngine(Enum):
+    PYTHON = "python"   # Load the cached data and diff the two TupleKeyCollections in Python
+    STAGING = "staging" # Load the external data into a staging table and diff in SQL, see wordtag.sync_sql
+    CHUNKED = "chunked" # Diff the cached data a tag and a page of rows at a time, see wordtag.sync_chunked
+
 class DomainViewSet(viewsets.ModelViewSet):
     """
         Disabled fully to prevent any cross domain access at all for this demo
@@ -31,14 +67,124 @@ class DomainViewSet(viewsets.ModelViewSet):
     queryset = Domain.objects.all()
     serializer_class = DomainSerializer
 
+class BatchViewSetMixin:
+    """
+        Adds a POST {prefix}/batch/ action that applies a list of creates, updates and deletes
+        in one request and one transaction. See wordtag.batch for the payload.
+    """
+
+    batch_handler = None
+
+    @action(detail=False, methods=["post"])
+    def batch(self, request):
+        if not verify_auth(request):
+            return Response({"detail": "User must be authenticated"}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            applied, results = self.batch_handler.run(request.data)
+        except BatchError as e:
+            return Response({"detail": f"{e}"}, status=status.HTTP_400_BAD_REQUEST)
+        if applied:
+            return Response({"applied": True, "results": results})
+        else:
+            return Response({"applied": False, "results": results}, status=status.HTTP_400_BAD_REQUEST)
+
 # Create your views here.
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(DomainShardMixin, ReplicaReadMixin, BatchViewSetMixin, viewsets.ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    batch_handler = TagBatchHandler
+
+    def checkShard(self, domain):
+        """
+            A tag can only be written to a domain stored in the database the request uses
+        """
+        if domain != None and DomainShards.alias(domain.id) != DomainShards.current():
+            raise ValidationError({"domain_id": f"The domain is stored in another shard, pass {self.shard_param_key}={domain.id}"})
+
+    def perform_create(self, serializer):
+        self.checkShard(serializer.validated_data.get("domain", None))
+        super().perform_create(serializer)
+
+    def perform_update(self, serializer):
+        old_domain_id = serializer.instance.domain_id
+        new_domain = serializer.validated_data.get("domain", None)
+        self.checkShard(new_domain)
+        with DomainShards.atomic():
+            if new_domain != None and new_domain.id != old_domain_id:
+                # The words of the tag move with it, they are deleted from the old domain and written to the new one
+                words = list(serializer.instance.words.values_list("text", flat=True))
+                DomainRevision.recordDeleted(old_domain_id, DomainRevision.bump(old_domain_id), [(serializer.instance.text, text) for text in words])
+                serializer.instance.words.update(revision=DomainRevision.bump(new_domain.id))
+            super().perform_update(serializer)
+        notify_domain_changed(self.__class__, old_domain_id)
+        if serializer.instance.domain_id != old_domain_id:
+            notify_domain_changed(self.__class__, serializer.instance.domain_id)
+
+    def perform_destroy(self, instance):
+        domain_id = instance.domain_id
+        with DomainShards.atomic():
+            words = list(instance.words.values_list("text", flat=True))
+            if len(words) > 0:
+                DomainRevision.recordDeleted(domain_id, DomainRevision.bump(domain_id), [(instance.text, text) for text in words])
+            super().perform_destroy(instance)
+        notify_domain_changed(self.__class__, domain_id)
 
-class WordViewSet(viewsets.ModelViewSet):
+class WordViewSet(DomainShardMixin, ReplicaReadMixin, BatchViewSetMixin, viewsets.ModelViewSet):
     queryset = Word.objects.all()
     serializer_class = WordSerializer
+    batch_handler = WordBatchHandler
+    details_param_key = "details"
+
+    def omitDetails(self):
+        """
+            @return {bool}  True for a list asked for without the details, with details=0
+        """
+        return self.action == "list" and self.request.GET.get(self.details_param_key, "1") == "0"
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.omitDetails():
+            queryset = queryset.defer("details")
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["omit_details"] = self.omitDetails()
+        return context
+
+    def perform_create(self, serializer):
+        with DomainShards.atomic():
+            serializer.save(revision=DomainRevision.bump(serializer.validated_data["tag"].domain_id))
+        word = serializer.instance
+        notify_domain_changed(self.__class__, word.tag.domain_id, added=[(word.tag.text, word.text)])
+
+    def perform_update(self, serializer):
+        old_tag = serializer.instance.tag
+        old_key = (old_tag.text, serializer.instance.text)
+        with DomainShards.atomic():
+            new_tag = serializer.validated_data.get("tag", old_tag)
+            new_key = (new_tag.text, serializer.validated_data.get("text", serializer.instance.text))
+            revision = DomainRevision.bump(new_tag.domain_id)
+            if new_key != old_key or new_tag.domain_id != old_tag.domain_id:
+                old_revision = revision if new_tag.domain_id == old_tag.domain_id else DomainRevision.bump(old_tag.domain_id)
+                DomainRevision.recordDeleted(old_tag.domain_id, old_revision, [old_key])
+            serializer.save(revision=revision)
+        word = serializer.instance
+        new_key = (word.tag.text, word.text)
+        if new_key != old_key:
+            if word.tag.domain_id == old_tag.domain_id:
+                notify_domain_changed(self.__class__, old_tag.domain_id, added=[new_key], removed=[old_key])
+            else:
+                notify_domain_changed(self.__class__, old_tag.domain_id, removed=[old_key])
+                notify_domain_changed(self.__class__, word.tag.domain_id, added=[new_key])
+
+    def perform_destroy(self, instance):
+        domain_id = instance.tag.domain_id
+        key = (instance.tag.text, instance.text)
+        with DomainShards.atomic():
+            DomainRevision.recordDeleted(domain_id, DomainRevision.bump(domain_id), [key])
+            super().perform_destroy(instance)
+        notify_domain_changed(self.__class__, domain_id, removed=[key])
 
 def getWordTagObject(word_tag):
     word = word_tag.get('word', None)
@@ -73,11 +219,19 @@ class SyncHandler:
 
     logger = logging.getLogger(__name__)
 
+    @classmethod
+    def rowLogger(cls):
+        """
+            Logger for per row messages, sampled so that a bad payload does not log once per row.
+        """
+        return SampledLogger(cls.logger, getattr(settings, "LOG_SAMPLE_EVERY", 100))
+
     # ----- Default values for the Sync Settings -----
 
     _default_syncMethod = SyncMethod.OVERRIDE   # What to do in the case of key collisions
     _default_syncPriority = CollectionPriority.EXTERNAL # Which collection takes presendence when necessary
     _default_syncControls = SyncControl.MERGE   # The action to take when faced with data that does not exist in both Cached and External data stores
+    _default_syncEngine = SyncEngine.PYTHON     # How the diff and the writes are done
 
     # ------ Validation and Sanitization for the Database -----
 
@@ -128,7 +282,7 @@ class SyncHandler:
         if cls.isValidSyncControl(syncControl):
             return syncControl
         else:
-            return cls._default_syncControl
+            return cls._default_syncControls
 
     @classmethod
     def isValidSyncPriority(cls, syncPriority: CollectionPriority):
@@ -141,6 +295,38 @@ class SyncHandler:
         else:
             return cls._default_syncPriority
         
+    @classmethod
+    def isValidTags(cls, tags):
+        return tags == None or (type(tags) in (list, set, frozenset, tuple) and all(cls.isValidTag(tag) for tag in tags))
+
+    @classmethod
+    def sanitizeTags(cls, tags):
+        """
+            @return {frozenset} The tags a sync is scoped to, None for the whole domain
+        """
+        if tags == None or not cls.isValidTags(tags):
+            return None
+        return frozenset(tags)
+
+    @classmethod
+    def needsCachedDetails(cls, syncMethod: SyncMethod, syncPriority: CollectionPriority):
+        """
+            Whether syncExternalAndCached reads the details of the cached data. When the external
+            details override the cached ones it only needs the keys, bulkAddToCache compares the
+            details with the stored digests.
+        """
+        return syncMethod != SyncMethod.OVERRIDE or syncPriority != CollectionPriority.EXTERNAL
+
+    @classmethod
+    def syncEngine(cls):
+        """
+            The sync engine set by settings.SYNC_ENGINE
+        """
+        try:
+            return SyncEngine(getattr(settings, "SYNC_ENGINE", cls._default_syncEngine.value))
+        except ValueError:
+            return cls._default_syncEngine
+
     # ----- Methods for handling the sync process -----
 
     @classmethod
@@ -155,24 +341,28 @@ class SyncHandler:
             raise DomainError(f"Can not process the given domain: {domain}")
         #if isinstance(collection, TupleKeyCollection):
         if collection is TupleKeyCollection:
-            for tup in collection.toList():
-                if len(tup) == 3:
-                    tag, word, _ = tup
-                elif len(tup) == 2:
-                    tag, word = tup
-                else:
-                    continue
-                if not cls.isValidTag(tag) or not cls.isValidWord(word):
-                    cls.logger.error(f"Could not remove the tag, word tuple: ({tag}, {word})")
-                    continue
-                else:
-                    try:
-                        wordtag = Word.objects.get(text=word, tag__text=tag, tag__domian__url=domain)
-                    except Word.DoesNotExist:
-                        wordtag = None
-                    finally:
-                        if wordtag:
-                            wordtag.delete()
+            domain_id = DomainIdCache.domainId(domain)
+            row_logger = cls.rowLogger()
+            with DomainShards.use(domain_id):
+                for tup in collection.toList():
+                    if len(tup) == 3:
+                        tag, word, _ = tup
+                    elif len(tup) == 2:
+                        tag, word = tup
+                    else:
+                        continue
+                    if not cls.isValidTag(tag) or not cls.isValidWord(word):
+                        row_logger.log("Could not remove the tag, word tuple", "(%s, %s)", tag, word)
+                        continue
+                    else:
+                        try:
+                            wordtag = Word.objects.get(text=word, tag__text=tag, tag__domain_id=domain_id)
+                        except Word.DoesNotExist:
+                            wordtag = None
+                        finally:
+                            if wordtag:
+                                wordtag.delete()
+            row_logger.flush()
         else:
             raise TypeError(f"Expected a TupleKeyCollection, instead got: {collection.__class__}")
 
@@ -193,44 +383,241 @@ class SyncHandler:
             raise DomainError(f"Can not process the given domain: {domain}")
         if isinstance(collection, TupleKeyCollection):
         #if collection is TupleKeyCollection:
-            for tup in collection.toList():
-                if len(tup) == 3:
-                    tag, word, details = tup
-                elif len(tup) == 2:
-                    tag, word = tup
-                    details = ""
-                else:
-                    continue
-                if not cls.isValidTag(tag) or not cls.isValidWord(word):
-                    cls.logger.error(f"Could not add/update the tag, word tuple: ({tag}, {word})")
-                    continue
-                else:
-                    sanitized_details = cls.sanitizeDetails(details)
-                    try:
-                        wordtag = Word.objects.get(text=word, tag__text=tag, tag__domain__url=domain)
-                        if word.details != sanitized_details:
-                            wordtag.details = sanitized_details
-                            wordtag.save()
-                    except Word.DoesNotExist:
-                        tagObj = None
+            domain_id = DomainIdCache.domainId(domain, create=True)
+            row_logger = cls.rowLogger()
+            with DomainShards.use(domain_id):
+                for tup in collection.toList():
+                    if len(tup) == 3:
+                        tag, word, details = tup
+                    elif len(tup) == 2:
+                        tag, word = tup
+                        details = ""
+                    else:
+                        continue
+                    if not cls.isValidTag(tag) or not cls.isValidWord(word):
+                        row_logger.log("Could not add/update the tag, word tuple", "(%s, %s)", tag, word)
+                        continue
+                    else:
+                        sanitized_details = cls.sanitizeDetails(details)
+                        tag_id = DomainIdCache.tagIds(domain_id, {tag})[tag]
                         try:
-                            tagObj = Tag.objects.get(text=tag, domain__url=domain)
-                        except Tag.DoesNotExist:
-                            try:
-                                domainObj = Domain.objects.get(url=domain)
-                            except Domain.DoesNotExist:
-                                domainObj = Domain(url=domain)
-                                domainObj.save()
-                            finally:
-                                tagObj = Tag(text=tag, domain=domainObj)
-                                tagObj.save()
-                        finally:
-                            if tagObj != None:
-                                word = Word(text=word, tag=tagObj, details=sanitized_details)
-                                word.save()
+                            wordtag = Word.objects.defer("details").get(text=word, tag_id=tag_id)
+                            if wordtag.details_digest != Word.digestOf(sanitized_details):
+                                wordtag.details = sanitized_details
+                                wordtag.save()
+                        except Word.DoesNotExist:
+                            word = Word(text=word, tag_id=tag_id, details=sanitized_details)
+                            word.save()
+            row_logger.flush()
         else:
             raise TypeError(f"Expected a TupleKeyCollection, instead got: {collection.__class__}")
 
+    # ----- Bulk writers, used by the sync and by the import command -----
+
+    @classmethod
+    def batchSize(cls):
+        return getattr(settings, "SYNC_BATCH_SIZE", 1000)
+
+    @classmethod
+    def iterBatches(cls, rows, batch_size):
+        """
+            Splits an iterable of (tag, word, details) rows into lists of at most batch_size rows
+        """
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    @classmethod
+    def validRows(cls, collection, row_logger, tags=None):
+        """
+            Yields the valid (tag, word, details) rows of a collection, logging the invalid ones
+
+            @param  {set}   tags    Only yield the rows of these tags, every row by default
+        """
+        for tup in collection.iterRows():
+            if len(tup) == 3:
+                tag, word, details = tup
+            elif len(tup) == 2:
+                tag, word = tup
+                details = ""
+            else:
+                continue
+            if not cls.isValidTag(tag) or not cls.isValidWord(word):
+                row_logger.log("Invalid tag, word tuple", "(%s, %s)", tag, word)
+                continue
+            if tags != None and tag not in tags:
+                continue
+            yield tag, word, cls.sanitizeDetails(details)
+
+    @classmethod
+    def resolveTags(cls, domain_id, tag_texts, create=True):
+        """
+            Maps tag text to Tag id for a domain, through DomainIdCache so that only the tags
+            not seen before are looked up by text. The missing tags are created in bulk.
+
+            If a tag text exists more than once in the domain the oldest row is used.
+
+            @param  {int}   domain_id   The domain the tags belong to
+            @param  {set}   tag_texts   The tag texts to resolve
+            @param  {bool}  create      Create tags that do not exist yet
+
+            @return {dict}  Tag text to Tag id
+        """
+        return DomainIdCache.tagIds(domain_id, tag_texts, create)
+
+    @classmethod
+    def bulkAddToCache(cls, collection, domain, batch_size=None, revision_scope=None, stats=None):
+        """
+            Bulk version of addToCache. Rows are written in batches, each batch costs one query to
+            resolve its tags, one to find the existing words and one bulk insert and one bulk update.
+            The details of the existing words are compared by their digest and never read.
+
+            @param  {TupleKeyCollection}    collection  The collection to add.
+            @param  {string}    domain  This controls the scope of database operations
+            @param  {int}   batch_size  Number of rows per batch, defaults to settings.SYNC_BATCH_SIZE
+            @param  {RevisionScope} revision_scope  Shares one domain revision with the rest of a sync
+            @param  {dict}  stats   Counts the rows created ("inserted") and updated ("changed") when given
+
+            @return {array}    The ids of every Word row in the collection, created or already existing
+        """
+        if not cls.isValidDomain(domain):
+            raise DomainError(f"Can not process the given domain: {domain}")
+        if not isinstance(collection, TupleKeyCollection):
+            raise TypeError(f"Expected a TupleKeyCollection, instead got: {collection.__class__}")
+        batch_size = batch_size or cls.batchSize()
+        revision_scope = revision_scope or RevisionScope()
+        row_logger = cls.rowLogger()
+        word_ids = array("q")
+        # The Domain row is on the primary, created outside of the transaction on the domain's rows
+        domain_id = DomainIdCache.domainId(domain, create=True)
+        with DomainShards.use(domain_id), DomainShards.atomic():
+            for batch in cls.iterBatches(cls.validRows(collection, row_logger), batch_size):
+                tag_map = cls.resolveTags(domain_id, {tag for tag, _, _ in batch})
+                existing = {}
+                for word_id, tag_id, text, details_digest, signature in Word.objects.filter(tag_id__in=set(tag_map.values()), text__in={word for _, word, _ in batch}).values_list("id", "tag_id", "text", "details_digest", "signature"):
+                    existing[(tag_id, text)] = (word_id, details_digest, signature)
+                to_create = []
+                to_update = []
+                added = []
+                for tag, word, details in batch:
+                    tag_id = tag_map[tag]
+                    cur = existing.get((tag_id, word), None)
+                    if cur == None:
+                        to_create.append(Word(text=word, tag_id=tag_id, details=details, signature=Word.signatureOf(word), details_digest=Word.digestOf(details)))
+                        added.append((tag, word))
+                    else:
+                        word_ids.append(cur[0])
+                        signature = Word.signatureOf(word)
+                        details_digest = Word.digestOf(details)
+                        if cur[1] != details_digest or cur[2] != signature:
+                            # rows written before the signature or digest columns existed get them filled in here
+                            to_update.append(Word(id=cur[0], details=details, signature=signature, details_digest=details_digest))
+                if stats != None:
+                    stats["inserted"] += len(to_create)
+                    stats["changed"] += len(to_update)
+                if len(to_create) > 0 or len(to_update) > 0:
+                    revision = revision_scope.revision(domain_id)
+                    for wordObj in to_create + to_update:
+                        wordObj.revision = revision
+                if len(to_create) > 0:
+                    for wordObj in Word.objects.bulk_create(to_create):
+                        word_ids.append(wordObj.id)
+                if len(to_update) > 0:
+                    Word.objects.bulk_update(to_update, ["details", "signature", "details_digest", "revision"])
+                if len(added) > 0:
+                    notify_domain_changed(cls, domain_id, added=added)
+        row_logger.flush()
+        return word_ids
+
+    @classmethod
+    def bulkRemoveFromCache(cls, collection, domain, batch_size=None, revision_scope=None):
+        """
+            Bulk version of removeFromCache, one delete per tag in each batch.
+
+            @param  {TupleKeyCollection}    collection  The collection storing the data to remove
+            @param  {string}    domain  This controls the scope of database operations
+            @param  {int}   batch_size  Number of rows per batch, defaults to settings.SYNC_BATCH_SIZE
+            @param  {RevisionScope} revision_scope  Shares one domain revision with the rest of a sync
+
+            @return {int}   The number of Word rows deleted
+        """
+        if not cls.isValidDomain(domain):
+            raise DomainError(f"Can not process the given domain: {domain}")
+        if not isinstance(collection, TupleKeyCollection):
+            raise TypeError(f"Expected a TupleKeyCollection, instead got: {collection.__class__}")
+        batch_size = batch_size or cls.batchSize()
+        revision_scope = revision_scope or RevisionScope()
+        row_logger = cls.rowLogger()
+        deleted = 0
+        domain_id = DomainIdCache.domainId(domain)
+        if domain_id == None:
+            return deleted
+        with DomainShards.use(domain_id), DomainShards.atomic():
+            for batch in cls.iterBatches(cls.validRows(collection, row_logger), batch_size):
+                tag_map = cls.resolveTags(domain_id, {tag for tag, _, _ in batch}, create=False)
+                words_by_tag = {}
+                for tag, word, _ in batch:
+                    if tag in tag_map:
+                        words_by_tag.setdefault(tag_map[tag], set()).add(word)
+                tag_texts = {tag_id: tag for tag, tag_id in tag_map.items()}
+                removed = []
+                for tag_id, words in words_by_tag.items():
+                    found = list(Word.objects.filter(tag_id=tag_id, text__in=words).values_list("text", flat=True))
+                    if len(found) > 0:
+                        deleted += Word.objects.filter(tag_id=tag_id, text__in=found).delete()[0]
+                        removed.extend((tag_texts[tag_id], word) for word in found)
+                if len(removed) > 0:
+                    DomainRevision.recordDeleted(domain_id, revision_scope.revision(domain_id), removed)
+                if len(removed) > 0:
+                    notify_domain_changed(cls, domain_id, removed=removed)
+        row_logger.flush()
+        return deleted
+
+    @classmethod
+    def removeOthersFromCache(cls, domain, keep_ids, batch_size=None, revision_scope=None):
+        """
+            Deletes every Word in the domain whose id is not in keep_ids. Used for DELETE semantics
+            when the full collection is never held in memory at once, such as the import command.
+
+            @param  {string}    domain  This controls the scope of database operations
+            @param  {array}     keep_ids    The Word ids to keep
+            @param  {int}   batch_size  Number of ids per delete, defaults to settings.SYNC_BATCH_SIZE
+            @param  {RevisionScope} revision_scope  Shares one domain revision with the rest of an import
+
+            @return {int}   The number of Word rows deleted
+        """
+        batch_size = batch_size or cls.batchSize()
+        revision_scope = revision_scope or RevisionScope()
+        keep = array("q", sorted(keep_ids))
+        to_delete = array("q")
+        deleted = 0
+        domain_id = DomainIdCache.domainId(domain)
+        if domain_id == None:
+            return deleted
+        with DomainShards.use(domain_id), DomainShards.atomic():
+            # Merge join over the two sorted id lists. The deletes wait until the cursor is
+            # done as SQLite does not isolate queries on the same connection.
+            i = 0
+            cached_ids = Word.objects.filter(tag__domain_id=domain_id).order_by("id").values_list("id", flat=True)
+            for word_id in cached_ids.iterator(chunk_size=batch_size):
+                while i < len(keep) and keep[i] < word_id:
+                    i += 1
+                if i < len(keep) and keep[i] == word_id:
+                    continue
+                to_delete.append(word_id)
+            for start in range(0, len(to_delete), batch_size):
+                chunk = Word.objects.filter(id__in=to_delete[start:start + batch_size].tolist())
+                DomainRevision.recordDeleted(domain_id, revision_scope.revision(domain_id), list(chunk.values_list("tag__text", "text")))
+                deleted += chunk.delete()[0]
+            if deleted > 0:
+                notify_domain_changed(cls, domain_id)
+        return deleted
+
     @classmethod
     def syncExternalAndCached(cls, externalData, cachedData, domain, syncMethod: SyncMethod = SyncMethod.OVERRIDE, syncPriority: CollectionPriority=CollectionPriority.EXTERNAL, syncControl: SyncControl = SyncControl.MERGE):
         """
@@ -251,6 +638,9 @@ class SyncHandler:
                 the system builds two different collections (externalData & cachedData)
 
             @param  {TupleKeyCollection}    externalData    
+
+            @return {dict}  Row counts: old (only in the collection without priority), new (only in the
+                            collection with priority), both, changed (rows updated), inserted and deleted
         """
         if not cls.isValidDomain(domain):
             raise DomainError(f"Can not process the given domain: {domain}")
@@ -267,17 +657,26 @@ class SyncHandler:
                 else:
                     # This is only raised if there is a sync priority value added the enum, but not implemented
                     raise NotImplementedError(f"Sync Priority was a value that is not implemented as yet. {syncPriority.name}: {syncPriority.value}")
-                if syncControl == SyncControl.DELETE and syncPriority == CollectionPriority.EXTERNAL:
-                    # Delete old_collection as its the cached data
-                    cls.removeFromCache(old_collection, domain)
-                # Add the new_collection to the cache
-                cls.addToCache(new_collection, domain)
-                # update the both_collection if necessary
-                cls.addToCache(both_collection, domain)
-                # This needs to change to perform it on the models I think
+                stats = {
+                    "old": len(old_collection.tag_word_details), "new": len(new_collection.tag_word_details), "both": len(both_collection.tag_word_details),
+                    "changed": 0, "inserted": 0, "deleted": 0
+                }
+                revision_scope = RevisionScope()
+                domain_id = DomainIdCache.domainId(domain, create=True)
+                with DomainShards.use(domain_id), DomainShards.atomic():
+                    if syncControl == SyncControl.DELETE and syncPriority == CollectionPriority.EXTERNAL:
+                        # Delete old_collection as its the cached data
+                        stats["deleted"] = cls.bulkRemoveFromCache(old_collection, domain, revision_scope=revision_scope)
+                    # Add the new_collection to the cache
+                    cls.bulkAddToCache(new_collection, domain, revision_scope=revision_scope, stats=stats)
+                    # update the both_collection if necessary
+                    both_stats = {"inserted": 0, "changed": 0}
+                    cls.bulkAddToCache(both_collection, domain, revision_scope=revision_scope, stats=both_stats)
+                    stats["changed"] = both_stats["changed"]
             except Exception as e:
-                cls.logger.error(e)
+                cls.logger.error("Sync failed for domain %s: %s", domain, e)
                 raise e
+            return stats
         else:
             raise TypeError(f"Expected TupleKeyCollections for parameters externalData and cachedData, instead got: {externalData.__class__}, {cachedData.__class__}") 
 
@@ -296,17 +695,11 @@ class DomainLocker(LoginDomainLockedJsonHandler):
         data = json.loads(request.body)
         domain = data.get("domain", "")
         ret_data = {}
-        cls.logger.error("----------------------------------------------")
-        cls.logger.error(f"domain: {domain}")
-        cls.logger.error(f"mumain: {cls._lock_to_domain}")
+        cls.logger.debug("domain: %s, locked to: %s", domain, cls._lock_to_domain)
         if domain == cls._lock_to_domain:
-            try:
-                domainObj = Domain.objects.get(url=domain)
-                ret_data[cls.domain_id_key] = domainObj.id
-            except Domain.DoesNotExist:
-                ret_data[cls.domain_id_key] = -1
-            finally:
-                return JsonResponse(ret_data)
+            domain_id = DomainIdCache.domainId(domain)
+            ret_data[cls.domain_id_key] = domain_id if domain_id != None else -1
+            return cls.respond(ret_data)
         else:
             return HttpResponse("You do not have acces to that domain.", status=403)
 
@@ -319,12 +712,12 @@ class AuthChecker(LoginDomainLockedJsonHandler):
     @classmethod
     def get_input(cls, request):
         cls._extra_steps(request)
-        return JsonResponse({'auth': verify_auth(request)})
+        return cls.respond({'auth': verify_auth(request)})
     
     @classmethod
     def post_input(cls, request):
         cls._extra_steps(request)
-        return JsonResponse({'auth': verify_auth(request)})
+        return cls.respond({'auth': verify_auth(request)})
 
 
 class LogoutHandler(AuthChecker):
@@ -336,11 +729,47 @@ class LogoutHandler(AuthChecker):
 class SpellinBloxHandler(LoginDomainLockedJsonHandler):
 
     @classmethod
-    def getAllCachedData(cls, domain):
+    def getDomainId(cls, domain):
+        """
+            @return {int}   The id of the domain with the given url, or None if there is none
+        """
+        return DomainIdCache.domainId(domain)
+
+    @classmethod
+    def run(cls, request):
+        """
+            Runs a GET with its queries on the domain's words going to the domain's shard. The
+            POST handlers pick the shard in the sync writers.
+        """
+        domain_id = cls.getDomainId(request.GET.get(cls.domain_param_key, "")) if request.method == "GET" else None
+        with DomainShards.use(domain_id):
+            return super().run(request)
+
+    @classmethod
+    def negotiate(cls, request, json_data, binary_data):
+        """
+            Answers in the binary word list format if the Accept header asks for it and in JSON otherwise.
+            Only the chosen representation is built.
+
+            @param  json_data   Returns the dict to send as JSON
+            @param  binary_data     Returns the bytes to send in the binary format
+        """
+        if wire_format.acceptsBinary(request.META.get("HTTP_ACCEPT", None)):
+            response = HttpResponse(binary_data(), content_type=wire_format.CONTENT_TYPE)
+        else:
+            response = cls.respond(json_data())
+        response["Vary"] = "Accept"
+        return response
+
+    @classmethod
+    def getAllCachedData(cls, domain, tags=None, details=True):
         """
             Creates a TupleKeyCollection, scoped by a domain, from the internal cache database
 
             @param  {string}    domain  The domain that controlls the scope of the data fetched.
+            @param  {set}   tags    Only the rows of these tags, every row by default
+            @param  {bool}  details Read the details, with False every row gets "" details, for
+                                    a sync that only needs the keys (see SyncHandler.needsCachedDetails)
 
             @return {TupleKeyCollection}    The collection representing the data retreived.
         """
@@ -350,7 +779,20 @@ class SpellinBloxHandler(LoginDomainLockedJsonHandler):
             raise UnknownDomainError(f"Can not find domain with length: {len(domain)}")
         else:
             cached_wordtags = TupleKeyCollection()
-            words = Word.objects.filter(tag__domain__url=domain).values_list("tag__text", "text", "details")
+            domain_id = DomainIdCache.domainId(domain)
+            if domain_id == None:
+                return cached_wordtags
+            snapshot = DomainSnapshots.get(domain_id)
+            if snapshot != None:
+                for tag, word, row_details in snapshot.rows():
+                    if tags == None or tag in tags:
+                        cached_wordtags.add(tag, word, row_details if details else "")
+                return cached_wordtags
+            rows = Word.objects.filter(tag__domain_id=domain_id)
+            if tags != None:
+                rows = rows.filter(tag__text__in=tags)
+            with DomainShards.use(domain_id):
+                words = list(rows.values_list("tag__text", "text", "details") if details else rows.values_list("tag__text", "text"))
             if len(words) > 0:
                 for tup in words:
                     if len(tup) == 3:
@@ -364,6 +806,259 @@ class SpellinBloxHandler(LoginDomainLockedJsonHandler):
             return cached_wordtags
     
 
+class WordSearchHandler(SpellinBloxHandler):
+    """
+        Full text search over the words of a domain.
+
+        GET /search?domain=<url>&q=<text>[&tag=<tag>][&prefix=0][&limit=<n>]
+    """
+
+    query_param_key = "q"
+    tag_param_key = "tag"
+    prefix_param_key = "prefix"
+    limit_param_key = "limit"
+
+    @classmethod
+    def get_input(cls, request):
+        domain = request.GET.get(cls.domain_param_key, "")
+        query = request.GET.get(cls.query_param_key, "")
+        domain_id = cls.getDomainId(domain)
+        if domain_id == None:
+            return HttpResponse(f"Can Not Find {domain}", status=404)
+        results = WordSearchIndex.search(
+            query,
+            domain_id,
+            prefix=request.GET.get(cls.prefix_param_key, "1") != "0",
+            tag=request.GET.get(cls.tag_param_key, None),
+            limit=request.GET.get(cls.limit_param_key, None)
+        )
+        return cls.respond({'results': results})
+
+
+class WordValidateHandler(SpellinBloxHandler):
+    """
+        Checks whether a word exists in a domain, and in which tags, from the domain snapshot
+        when it is up to date and from the in-memory word index otherwise.
+
+        GET /validate?domain=<url>&word=<word>[&tag=<tag>]
+    """
+
+    word_param_key = "word"
+    tag_param_key = "tag"
+
+    @classmethod
+    def get_input(cls, request):
+        domain_id = cls.getDomainId(request.GET.get(cls.domain_param_key, ""))
+        if domain_id == None:
+            return HttpResponse("Can Not Find the domain", status=404)
+        word = request.GET.get(cls.word_param_key, "")
+        tag = request.GET.get(cls.tag_param_key, None)
+        snapshot = DomainSnapshots.get(domain_id)
+        if snapshot != None:
+            tags = {row_tag for row_tag, _, _ in snapshot.find(word) if tag == None or row_tag == tag}
+        else:
+            tags = DomainTrieIndex.validate(domain_id, word, tag)
+        return cls.respond({'word': word, 'valid': len(tags) > 0, 'tags': sorted(tags)})
+
+
+class WordCompleteHandler(SpellinBloxHandler):
+    """
+        Words of a domain starting with a prefix, from the domain snapshot when it is up to date
+        and from the in-memory word index otherwise.
+
+        GET /complete?domain=<url>&prefix=<prefix>[&tag=<tag>][&limit=<n>]
+    """
+
+    prefix_param_key = "prefix"
+    tag_param_key = "tag"
+    limit_param_key = "limit"
+
+    @classmethod
+    def get_input(cls, request):
+        domain_id = cls.getDomainId(request.GET.get(cls.domain_param_key, ""))
+        if domain_id == None:
+            return HttpResponse("Can Not Find the domain", status=404)
+        limit = WordSearchIndex.sanitizeLimit(request.GET.get(cls.limit_param_key, None))
+        prefix = request.GET.get(cls.prefix_param_key, "")
+        tag = request.GET.get(cls.tag_param_key, None)
+        snapshot = DomainSnapshots.get(domain_id)
+        if snapshot != None:
+            words = snapshot.complete(prefix, tag, limit)
+        else:
+            words = DomainTrieIndex.complete(domain_id, prefix, tag, limit)
+        return cls.respond({'words': words})
+
+
+class WordFormableHandler(SpellinBloxHandler):
+    """
+        Words of a domain that can be spelled with a rack of letter blocks, from the in-memory
+        anagram index.
+
+        GET /formable?domain=<url>&letters=<letters>[&tag=<tag>][&min_length=<n>][&limit=<n>]
+    """
+
+    letters_param_key = "letters"
+    tag_param_key = "tag"
+    min_length_param_key = "min_length"
+    limit_param_key = "limit"
+
+    @classmethod
+    def get_input(cls, request):
+        domain_id = cls.getDomainId(request.GET.get(cls.domain_param_key, ""))
+        if domain_id == None:
+            return HttpResponse("Can Not Find the domain", status=404)
+        try:
+            min_length = int(request.GET.get(cls.min_length_param_key, "1"))
+        except ValueError:
+            return HttpResponse("min_length must be a number", status=400)
+        limit = WordSearchIndex.sanitizeLimit(request.GET.get(cls.limit_param_key, WordSearchIndex.max_limit))
+        words = DomainAnagramIndex.formable(domain_id, request.GET.get(cls.letters_param_key, ""), request.GET.get(cls.tag_param_key, None), min_length, limit)
+        return cls.respond({'words': words})
+
+
+class WordSampleHandler(SpellinBloxHandler):
+    """
+        Random words of a domain for a game round.
+
+        GET /sample?domain=<url>[&n=<count>][&tag=<tag>][&exclude=<id>,<id>,...]
+    """
+
+    count_param_key = "n"
+    tag_param_key = "tag"
+    exclude_param_key = "exclude"
+
+    _default_count = 10
+
+    @classmethod
+    def get_input(cls, request):
+        domain_id = cls.getDomainId(request.GET.get(cls.domain_param_key, ""))
+        if domain_id == None:
+            return HttpResponse("Can Not Find the domain", status=404)
+        try:
+            count = min(int(request.GET.get(cls.count_param_key, cls._default_count)), WordSearchIndex.max_limit)
+            exclude = {int(word_id) for word_id in request.GET.get(cls.exclude_param_key, "").split(",") if len(word_id) > 0}
+        except ValueError:
+            return HttpResponse("n and exclude must be numbers", status=400)
+        words = DomainSampleIndex.sample(domain_id, count, request.GET.get(cls.tag_param_key, None), exclude)
+        return cls.respond({'words': words})
+
+
+class DomainChangesHandler(SpellinBloxHandler):
+    """
+        The words written and deleted in a domain since a revision, so that a client can catch
+        up without downloading the whole word list. See wordtag.revisions.
+
+        GET /changes?domain=<url>[&since=<revision>]
+
+        Answers with JSON, or with the binary format of utils.wire_format when the request
+        has "Accept: application/vnd.wordblox.words". When the tombstones after since were
+        pruned, answers 410 with {resync: true, revision, horizon} and the client has to fetch
+        /words again.
+    """
+
+    since_param_key = "since"
+
+    @classmethod
+    def get_input(cls, request):
+        domain_id = cls.getDomainId(request.GET.get(cls.domain_param_key, ""))
+        if domain_id == None:
+            return HttpResponse("Can Not Find the domain", status=404)
+        try:
+            since = max(int(request.GET.get(cls.since_param_key, 0)), 0)
+        except ValueError:
+            return HttpResponse("since must be a number", status=400)
+        try:
+            changes = DomainRevision.changes(domain_id, since)
+        except ResyncRequired as e:
+            return cls.respond({"resync": True, "revision": e.revision, "horizon": e.horizon}, status=410)
+        return cls.negotiate(request, lambda: changes, lambda: wire_format.encodeChanges(changes))
+
+
+class DomainWordsHandler(SpellinBloxHandler):
+    """
+        Every word of a domain, from the domain snapshot when it is up to date.
+
+        GET /words?domain=<url>
+
+        Answers with JSON, or with the binary format of utils.wire_format when the request
+        has "Accept: application/vnd.wordblox.words".
+    """
+
+    @classmethod
+    def get_input(cls, request):
+        domain_id = cls.getDomainId(request.GET.get(cls.domain_param_key, ""))
+        if domain_id == None:
+            return HttpResponse("Can Not Find the domain", status=404)
+        snapshot = DomainSnapshots.get(domain_id)
+        if snapshot != None:
+            revision = snapshot.revision
+            rows = list(snapshot.rows())
+        else:
+            # The revision is kept with the rows, one transaction reads both
+            with DomainShards.atomic():
+                revision = DomainRevision.current(domain_id)
+                rows = list(Word.objects.filter(tag__domain_id=domain_id).order_by("text", "tag_id").values_list("tag__text", "text", "details"))
+        return cls.negotiate(
+            request,
+            lambda: {'revision': revision, 'words': [SpellinBloxPushDataCrafter.createTagWordDetailsDict(tag, word, details) for tag, word, details in rows]},
+            lambda: wire_format.encodeWords(revision, rows)
+        )
+
+
+class SyncRunsHandler(SpellinBloxHandler):
+    """
+        The pull and push history of a domain, see wordtag.sync_runs. Needs a session authenticated by /login.
+
+        GET /sync_runs?domain=<url>[&limit=<runs>][&days=<days>]
+
+        Answers with the newest runs and the aggregates of the pulls of the last days (every pull
+        kept by default).
+    """
+
+    limit_param_key = "limit"
+    days_param_key = "days"
+
+    _default_limit = 20
+    _max_limit = 500
+
+    @classmethod
+    def get_input(cls, request):
+        if not verify_auth(request):
+            return HttpResponse("Must be Authenticated", status=403)
+        domain_id = cls.getDomainId(request.GET.get(cls.domain_param_key, ""))
+        if domain_id == None:
+            return HttpResponse("Can Not Find the domain", status=404)
+        try:
+            limit = min(max(int(request.GET.get(cls.limit_param_key, cls._default_limit)), 1), cls._max_limit)
+            days = request.GET.get(cls.days_param_key, None)
+            since = timezone.now() - timedelta(days=float(days)) if days != None else None
+        except ValueError:
+            return HttpResponse("limit and days must be numbers", status=400)
+        return cls.respond({'summary': DomainSyncRuns.summary(domain_id, since), 'runs': DomainSyncRuns.recent(domain_id, limit)})
+
+
+class DomainEventsHandler(SpellinBloxHandler):
+    """
+        Streams the change notifications of a domain as Server-Sent Events. See wordtag.events.
+
+        GET /events?domain=<url>
+    """
+
+    @classmethod
+    async def run(cls, request):
+        if request.method != "GET":
+            return HttpResponse(status=405)
+        domain_id = await sync_to_async(cls.getDomainId)(request.GET.get(cls.domain_param_key, ""))
+        if domain_id == None:
+            return HttpResponse("Can Not Find the domain", status=404)
+        # WSGI would read an async stream to its end before sending any of it
+        stream = DomainEvents.stream(domain_id) if isinstance(request, ASGIRequest) else DomainEvents.streamSync(domain_id)
+        response = StreamingHttpResponse(stream, content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # Stops nginx from buffering the stream
+        return response
+
+
 class SpellinBloxPullHandler(SpellinBloxHandler):
     """
         Handler for handling pull communication with the External SpellinBlox server.
@@ -377,14 +1072,18 @@ class SpellinBloxPullHandler(SpellinBloxHandler):
 
         
     @classmethod
-    def getAllExternalData(cls, controller, domain):
+    def getAllExternalData(cls, controller, domain, tags=None):
         """
             Creates a TupleKeyCollection, scoped by a domain, from the External SpellinBlox server
 
             @param  {FetchController}   controller  The controller for fetching over the Internet
             @param  {string}    domain  The domain that controlls the scope of the data fetched.
+            @param  {set}   tags    Only keep the rows of these tags, every row by default. The
+                                    external server always sends the whole domain.
 
             @return {TupleKeyCollection}    The collection representing the data retreived.
+            @raise  {ExternalServerFetchException}  If the data could not be fetched, so that a
+                                                    failed fetch is never taken for an empty domain
         """
         #if isinstance(controller, FetchController):
         if controller is FetchController:
@@ -395,28 +1094,150 @@ class SpellinBloxPullHandler(SpellinBloxHandler):
         elif len(domain) <= 0:
             raise UnknownDomainError(f"Can not find domain with length: {len(domain)}")
         else:
-            domain_data = {}
-            try:
-                domain_data = controller.getData(domain)
-            except ExternalServerFetchException as e:
-                cls.logger.error(f"Fetch Data Error: {e}")
-            except Exception as e:
-                cls.logger.error(f"Unknown Error: {e}")
-            finally:
-                word_tag_collection = TupleKeyCollection()
-                if type(domain_data) == dict:
-                    wordtag_list = domain_data.get("wordtags", [])
-                    for i in range(len(wordtag_list)):
-                        tag, word, details = getWordTagObject(wordtag_list[i])
-                        try:
-                            word_tag_collection.add(tag, word, details)
-                        except TypeError as e:
-                            cls.logger.error(f"Collection Add Error: {e}")
-                        except Exception as e:
-                            cls.logger.error(f"Unknown Error: {e}")
-                return word_tag_collection
+            domain_data = controller.getData(domain)
+            if type(domain_data) != dict:
+                raise ExternalServerFetchException(f"ERROR: Expected the data of the domain, instead got: {type(domain_data)}", 200)
+            return cls.parseExternalData(domain_data, tags)
+
+    @classmethod
+    def parseExternalData(cls, domain_data, tags=None, exclude_tags=None):
+        """
+            Creates a TupleKeyCollection from the payload sent by the External SpellinBlox server
+
+            @param  {dict}  domain_data     As returned by FetchController.getData
+            @param  {set}   tags    Only keep the rows of these tags, every row by default
+            @param  {set}   exclude_tags    Leave out the rows of these tags
+
+            @return {TupleKeyCollection}
+        """
+        word_tag_collection = TupleKeyCollection()
+        row_logger = SyncHandler.rowLogger()
+        if type(domain_data) == dict:
+            wordtag_list = domain_data.get("wordtags", [])
+            for i in range(len(wordtag_list)):
+                tag, word, details = getWordTagObject(wordtag_list[i])
+                if tags != None and (type(tag) != str or tag not in tags):
+                    continue
+                if exclude_tags != None and tag in exclude_tags:
+                    continue
+                try:
+                    word_tag_collection.add(tag, word, details)
+                except TypeError as e:
+                    row_logger.log("Collection Add Error", "%s", e)
+                except Exception as e:
+                    row_logger.log("Unknown Error", "%s", e)
+        row_logger.flush()
+        return word_tag_collection
         
 
+    @classmethod
+    def pullAndSync(cls, controller, domain, tags=None):
+        """
+            Fetches the domain from the external server with an authenticated controller and syncs it into the cache.
+
+            Concurrent pulls of the same domain are coalesced by DomainSyncCoordinator, so this runs once for all of them.
+
+            A pull scoped to tags loads, diffs and writes only the rows of those tags, and does not
+            count as a pull of the domain for its freshness.
+
+            @param  {FetchController}   controller  The authenticated controller
+            @param  {string}    domain  The domain to pull
+            @param  {set}   tags    Only pull these tags, the whole domain by default
+
+            @return {dict}  {'syncCompleted': bool, 'syncErr': str}
+        """
+        external_wordtags = None
+        cached_wordtags = None
+        sync_err_msg = ""
+        sync_engine = SyncHandler.syncEngine()
+        run = SyncRunRecorder(domain, sync_engine, SyncHandler._default_syncMethod, SyncHandler._default_syncPriority, SyncHandler._default_syncControls, tags)
+        try:
+            with run.phase("fetch"):
+                external_wordtags = cls.getAllExternalData(controller, domain, tags)
+        except TypeError as e:
+            cls.logger.error("FetchController failed: %s", e)
+            sync_err_msg = f"FetchController failed: {e}"
+        except DomainError as e:
+            cls.logger.error("Domain Error with External Data: %s", e)
+            sync_err_msg = f"Domain Error with External Data: {e}"
+        except ExternalServerFetchException as e:
+            cls.logger.error("Fetch Data Error: %s", e)
+            sync_err_msg = f"Fetch Data Error: {e}"
+        except Exception as e:
+            cls.logger.error("Unknown Error: %s", e)
+            sync_err_msg = f"Unknown Error: {e}"
+        run.payload_bytes = getattr(controller, "payload_bytes", 0)
+        if external_wordtags == None:
+            # Syncing an empty collection would count as a completed pull and mark the domain fresh
+            run.save(False, sync_err_msg)
+            notify_domain_synced(cls, cls.getDomainId(domain), False, sync_err_msg)
+            return {'syncCompleted': False, 'syncErr': sync_err_msg}
+        if sync_engine == SyncEngine.PYTHON:
+            try:
+                with run.phase("load"):
+                    cached_wordtags = cls.getAllCachedData(domain, tags, SyncHandler.needsCachedDetails(SyncHandler._default_syncMethod, SyncHandler._default_syncPriority))
+            except DomainError as e:
+                cls.logger.error("Domain Error with Cached Data: %s", e)
+                raise e
+        syncCompleted = False
+        try:
+            with run.phase("sync"):
+                if sync_engine == SyncEngine.STAGING:
+                    from .sync_sql import StagingSyncHandler # imported here as it extends SyncHandler
+                    run.setStats(StagingSyncHandler.syncExternal(external_wordtags, domain, tags=tags))
+                elif sync_engine == SyncEngine.CHUNKED:
+                    from .sync_chunked import ChunkedSyncHandler # imported here as it extends SyncHandler
+                    run.setStats(ChunkedSyncHandler.syncExternal(external_wordtags, domain, tags=tags))
+                else:
+                    # Both collections only hold the rows of the tags, which confines the sync to them
+                    run.setStats(SyncHandler.syncExternalAndCached(external_wordtags, cached_wordtags, domain))
+            syncCompleted = True
+            if tags == None:
+                Domain.objects.filter(url=domain).update(last_synced=timezone.now())
+        except Exception as e:
+            syncCompleted = False
+            import traceback
+            sync_err_msg = f"{e}:\t(Line Number: {traceback.extract_tb(e.__traceback__)[-1][1]})"
+        run.save(syncCompleted, sync_err_msg)
+        notify_domain_synced(cls, cls.getDomainId(domain), syncCompleted, sync_err_msg)
+        return {'syncCompleted': syncCompleted, 'syncErr': sync_err_msg}
+
+    @classmethod
+    def admittedPullAndSync(cls, controller, domain, tags=None):
+        """
+            pullAndSync holding one of the in-flight sync slots of SyncAdmission, charged to the
+            rate limit of the domain
+
+            @raise  {RateLimited}   If too many syncs are already running or the domain is out of tokens
+        """
+        with SyncAdmission.syncSlot():
+            SyncAdmission.chargeDomain(domain)
+            return cls.pullAndSync(controller, domain, tags)
+
+    @classmethod
+    def flightKey(cls, domain, tags=None):
+        """
+            @return {str}   The key pulls are coalesced under, pulls of other tags of a domain are not shared
+        """
+        if tags == None:
+            return domain
+        return f"{domain}#{','.join(sorted(tags))}"
+
+    @classmethod
+    def freshness(cls, domain):
+        """
+            @return {Freshness} How current the cached data of a domain is
+        """
+        row = Domain.objects.filter(url=domain).values_list("last_synced", "sync_ttl").first()
+        if row == None or row[0] == None:
+            return Freshness.MISSING
+        last_synced, sync_ttl = row
+        if sync_ttl == None:
+            sync_ttl = getattr(settings, "SYNC_FRESHNESS_TTL", 300)
+        if (timezone.now() - last_synced).total_seconds() <= sync_ttl:
+            return Freshness.FRESH
+        return Freshness.STALE
+
     @classmethod
     def post_input(cls, request):
         """
@@ -424,57 +1245,63 @@ class SpellinBloxPullHandler(SpellinBloxHandler):
 
             Initiates a sync in the local cache with data from the SpellinBlox server based
             on parameters passed via POST request.
+
+            Only a domain that has never been pulled waits for the sync. A fresh domain answers
+            straight away and a stale one answers straight away while a pull runs in the background.
+
+            With an optional "tags" list only those tags are pulled, always straight away, and
+            SyncControl.DELETE only removes rows of those tags.
         """
         data = json.loads(request.body)
         domain = data.get("domain", "")
         username = data.get("username", "")
         password = data.get("password", "")
+        tags = data.get("tags", None)
+        if not SyncHandler.isValidTags(tags):
+            return HttpResponse("tags must be a list of tag names", status=400)
+        tags = SyncHandler.sanitizeTags(tags)
+        try:
+            SyncAdmission.admit(request)
+        except RateLimited as e:
+            return SyncAdmission.reject(e)
         controller = FetchController()
         auth_check = False
         err_msg = "Unknown Error"
-        sync_err_msg = ""
         try:
             controller.auth(username, password)
             auth_check = True
         except ExternalServerFetchException as e:
             auth_check = False # Just in case and for clarity
-            cls.logger.error(f"Authentication Error: {e}")
+            cls.logger.warning("Authentication Error: %s", e)
             err_msg = f"Authentication Error: {e}"
         except Exception as e:
             auth_check = False # Just in case and for clarity
-            cls.logger.error(f"Authentication Failed, Error Unknown {e}")
+            cls.logger.error("Authentication Failed, Error Unknown %s", e)
             err_msg = f"Authentication Failed, Error Unknown: {e}"
         finally:
             if auth_check:
                 set_auth_token(request)
-                external_wordtags = None
-                cached_wordtags = None
-                try:
-                    external_wordtags = cls.getAllExternalData(controller, domain)
-                except TypeError as e:
-                    cls.logger.error(f"FetchController failed: {e}")
-                    #return HttpResponse(f"FetchController failed: {e}", status=500)
-                except DomainError as e:
-                    cls.logger.error(f"Domain Error with External Data: {e}")
-                    #return HttpResponse(f"FetchController failed: {e}", status=400)
-                finally:
+                # A pull of some tags is what the editor asked for right now, it skips the freshness check
+                freshness = cls.freshness(domain) if tags == None else Freshness.MISSING
+                if freshness == Freshness.FRESH:
                     controller.quit()
+                    return cls.respond({'syncCompleted': True, 'syncErr': "", 'fresh': True, 'revalidating': False})
+                elif freshness == Freshness.STALE:
+                    # The controller is handed to the background pull, which quits it when done
+                    revalidating = DomainSyncCoordinator.revalidate(domain, lambda: cls.admittedPullAndSync(controller, domain), controller.quit, lambda res: res['syncCompleted'])
+                    return cls.respond({'syncCompleted': True, 'syncErr': "", 'fresh': False, 'revalidating': revalidating})
                 try:
-                    cached_wordtags = cls.getAllCachedData(domain)
+                    result = DomainSyncCoordinator.run(domain, lambda: cls.admittedPullAndSync(controller, domain, tags), lambda res: res['syncCompleted'], cls.flightKey(domain, tags))
                 except DomainError as e:
-                    cls.logger.error(f"Domain Error with Cached Data: {e}")
                     return HttpResponse(f"FetchController failed: {e}", status=400)
-                syncCompleted = False
-                try:
-                    SyncHandler.syncExternalAndCached(external_wordtags, cached_wordtags, domain)
-                    syncCompleted = True
-                except Exception as e:
-                    syncCompleted = False
-                    import traceback
-                    sync_err_msg = f"{e}:\t(Line Number: {traceback.extract_tb(e.__traceback__)[-1][1]})"
-
+                except (SingleFlightTimeout, FileLockTimeout) as e:
+                    cls.logger.warning("Pull of %s timed out waiting for another pull: %s", domain, e)
+                    return HttpResponse("A sync of this domain is already running", status=503)
+                except RateLimited as e:
+                    return SyncAdmission.reject(e)
                 finally:
-                    return JsonResponse({'syncCompleted': syncCompleted, 'syncErr': sync_err_msg})
+                    controller.quit()
+                return cls.respond({**result, 'fresh': result['syncCompleted'] and tags == None, 'revalidating': False})
             else:
                 # Do something is authentication failed
                 controller.quit()
@@ -493,38 +1320,72 @@ class SpellinBloxPushHandler(SpellinBloxHandler):
             domain = data.get("domain", "")
             username = data.get("username", "")
             password = data.get("password", "")
-            controller = FetchController()
-            auth_check = False
-            err_msg = "Unknown Error"
+            tags = data.get("tags", None)
+            if not SyncHandler.isValidTags(tags):
+                return HttpResponse("tags must be a list of tag names", status=400)
             try:
-                controller.auth(username, password)
-                auth_check = True
-            except ExternalServerFetchException as e:
-                auth_check = False # Just in case and for clarity
-                cls.logger.error(f"Authentication Error: {e}")
-                err_msg = f"Authentication Error: {e}"
-            except Exception as e:
-                auth_check = False # Just in case and for clarity
-                cls.logger.error(f"Authentication Failed, Error Unknown {e}")
-                err_msg = f"Authentication Failed, Error Unknown: {e}"
-            finally:
-                if auth_check:
-                    try:
-                        cached_wordtags = cls.getAllCachedData(domain)
-                    except DomainError as e:
-                        cls.logger.error(f"Domain Error with Cached Data: {e}")
-                        return HttpResponse(f"Fetching data from cache failed: {e}", status=400)
-                    data_packet = SpellinBloxPushDataCrafter.pushCacheToServer(cached_wordtags, domain)
-                    success_flag = True
-                    try:
-                        json_return = controller.sendData(data_packet)
-                    except Exception as e:
-                        err_msg = f"{e}"
-                        success_flag = False
-                    finally:
-                        controller.quit()
-                    if not success_flag:
-                        return HttpResponse(err_msg, status=500)
-                    return JsonResponse(json_return)
-                else:
-                    return HttpResponse("Must be Authenticated", status=403)
\ No newline at end of file
+                SyncAdmission.admit(request)
+                with SyncAdmission.syncSlot():
+                    SyncAdmission.chargeDomain(domain)
+                    return cls.pushCache(domain, username, password, SyncHandler.sanitizeTags(tags))
+            except RateLimited as e:
+                return SyncAdmission.reject(e)
+        else:
+            return HttpResponse("Must be Authenticated", status=403)
+
+    @classmethod
+    def pushCache(cls, domain, username, password, tags=None):
+        """
+            Authenticates with the external server and sends it the cached data of the domain.
+
+            SAVE_URL replaces the whole word list of the domain, so a push scoped to tags still
+            sends every tag: the cached rows of the tags are merged into the rows of the other
+            tags as the external server has them now, which the push leaves as they are.
+        """
+        controller = FetchController()
+        auth_check = False
+        err_msg = "Unknown Error"
+        try:
+            controller.auth(username, password)
+            auth_check = True
+        except ExternalServerFetchException as e:
+            auth_check = False # Just in case and for clarity
+            cls.logger.warning("Authentication Error: %s", e)
+            err_msg = f"Authentication Error: {e}"
+        except Exception as e:
+            auth_check = False # Just in case and for clarity
+            cls.logger.error("Authentication Failed, Error Unknown %s", e)
+            err_msg = f"Authentication Failed, Error Unknown: {e}"
+        finally:
+            if auth_check:
+                run = SyncRunRecorder(domain, tags=tags, kind=SyncRunRecorder.PUSH)
+                try:
+                    with run.phase("load"):
+                        cached_wordtags = cls.getAllCachedData(domain, tags)
+                except DomainError as e:
+                    cls.logger.error("Domain Error with Cached Data: %s", e)
+                    run.save(False, f"Fetching data from cache failed: {e}")
+                    return HttpResponse(f"Fetching data from cache failed: {e}", status=400)
+                success_flag = True
+                try:
+                    if tags != None:
+                        with run.phase("fetch"):
+                            push_wordtags = SpellinBloxPullHandler.parseExternalData(controller.getData(domain), exclude_tags=tags)
+                        run.payload_bytes = getattr(controller, "payload_bytes", 0)
+                        for tag, word, details in cached_wordtags.iterRows():
+                            push_wordtags.add(tag, word, details)
+                    else:
+                        push_wordtags = cached_wordtags
+                    with run.phase("sync"):
+                        json_return = controller.sendData(SpellinBloxPushDataCrafter.pushCacheToServer(push_wordtags, domain))
+                except Exception as e:
+                    err_msg = f"{e}"
+                    success_flag = False
+                finally:
+                    controller.quit()
+                run.save(success_flag, "" if success_flag else err_msg)
+                if not success_flag:
+                    return HttpResponse(err_msg, status=500)
+                return cls.respond(json_return)
+            else:
+                return HttpResponse("Must be Authenticated", status=403)
\ No newline at end of file
@@ -0,0 +1,139 @@
+"""
+    Warm-up of a worker before it takes traffic.
+
+    A fresh worker answers its first requests slowly: the URLconf (and with it the views and
+    DRF) is only imported by the first request, the database connections and the search
+    tables are opened on first use and every domain starts with empty id caches and indexes.
+    Warmup.run() does all of that up front for the WARMUP_DOMAINS most recently pulled domains:
+
+        - imports the URLconf and opens a connection to the primary and every shard
+        - checks which databases have the FTS search table
+        - caches the domain ids, shards and tag ids
+        - maps the domain snapshots, and builds missing ones when asked to
+        - builds the in-memory word indexes (the trie only when there is no snapshot to answer
+          /validate and /complete from)
+
+    With WARMUP_ON_START set, the WSGI and ASGI entry points run it through serverStart() and
+    wait for it (at most WARMUP_TIMEOUT seconds) before handing the application to the server.
+    Only the server processes load those modules, so management commands such as migrate or
+    shell never warm up. The warmup command runs it on its own, which is mostly useful to write
+    the snapshots shared by the workers before they start.
+"""
+import logging
+import threading
+import time
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import F
+from django.urls import get_resolver
+from .id_cache import DomainIdCache
+from .models import Domain, Tag
+from .search import WordSearchIndex
+from .shards import PRIMARY, DomainShards
+from .snapshots import DomainSnapshots
+from .word_index import DomainAnagramIndex, DomainSampleIndex, DomainTrieIndex
+
+
+class Warmup:
+
+    logger = logging.getLogger(__name__)
+
+    _done = None    # Set once the warm-up started on ready has finished
+
+    @classmethod
+    def domainLimit(cls):
+        return getattr(settings, "WARMUP_DOMAINS", 50)
+
+    @classmethod
+    def warmDomain(cls, domain_id, url, build_snapshots=False):
+        """
+            @return {bool}  True if the domain is served from a current snapshot
+        """
+        DomainIdCache.domainId(url)
+        with DomainShards.use(domain_id):
+            tag_texts = set(Tag.objects.filter(domain_id=domain_id).values_list("text", flat=True))
+        DomainIdCache.tagIds(domain_id, tag_texts, create=False)
+        snapshot = DomainSnapshots.get(domain_id)
+        if snapshot == None and build_snapshots and DomainSnapshots.isEnabled():
+            DomainSnapshots.build(domain_id)
+            snapshot = DomainSnapshots.get(domain_id)
+        indexes = [DomainAnagramIndex, DomainSampleIndex]
+        if snapshot == None:
+            indexes.append(DomainTrieIndex)
+        for index in indexes:
+            index.warm(domain_id)
+        return snapshot != None
+
+    @classmethod
+    def run(cls, domains=None, build_snapshots=False):
+        """
+            @param  {list}  domains     Urls of the domains to warm, the most recently pulled ones by default
+            @param  {bool}  build_snapshots     Write the snapshots of domains that have none up to date
+
+            @return {dict}  {domains, snapshots, seconds}
+        """
+        start = time.monotonic()
+        get_resolver().url_patterns
+        for alias in [PRIMARY] + DomainShards.shards():
+            connections[alias].ensure_connection()
+            WordSearchIndex.isSupported(alias)
+        rows = Domain.objects.using(PRIMARY)
+        if domains != None:
+            rows = rows.filter(url__in=domains)
+        rows = rows.order_by(F("last_synced").desc(nulls_last=True)).values_list("id", "url")[:cls.domainLimit()]
+        stats = {"domains": 0, "snapshots": 0}
+        for domain_id, url in rows:
+            if cls.warmDomain(domain_id, url, build_snapshots):
+                stats["snapshots"] += 1
+            stats["domains"] += 1
+        stats["seconds"] = round(time.monotonic() - start, 3)
+        cls.logger.info("Warmed up %s domains (%s from snapshots) in %ss", stats["domains"], stats["snapshots"], stats["seconds"])
+        return stats
+
+    @classmethod
+    def start(cls):
+        """
+            Runs the warm-up in a thread once the app registry is ready
+        """
+        if cls._done != None:
+            return
+        cls._done = threading.Event()
+
+        def target():
+            apps.ready_event.wait()
+            try:
+                cls.run()
+            except DatabaseError as e:
+                # Such as a database that has not been migrated yet
+                cls.logger.warning("Warm-up skipped: %s", e)
+            finally:
+                for conn in connections.all(initialized_only=True):
+                    conn.close()
+                cls._done.set()
+
+        threading.Thread(target=target, name="wordtag-warmup", daemon=True).start()
+
+    @classmethod
+    def serverStart(cls):
+        """
+            Called by the WSGI and ASGI entry points. With WARMUP_ON_START, starts the warm-up and
+            waits for it before the application is handed to the server.
+
+            @return {bool}  False if the warm-up did not finish within WARMUP_TIMEOUT
+        """
+        if not getattr(settings, "WARMUP_ON_START", False):
+            return True
+        cls.start()
+        return cls.wait()
+
+    @classmethod
+    def wait(cls):
+        """
+            Waits at most WARMUP_TIMEOUT seconds for the warm-up started by start()
+
+            @return {bool}  False if it was started and has not finished
+        """
+        if cls._done == None:
+            return True
+        return cls._done.wait(getattr(settings, "WARMUP_TIMEOUT", 30))
@@ -0,0 +1,420 @@
+"""
+    Per domain, in-process indexes over the words of a domain, answering the game's hot
+    questions without going to the database:
+
+        DomainTrieIndex     Is this a word, and which words start with this prefix
+        DomainAnagramIndex  Which words can be spelled with these letter blocks
+        DomainSampleIndex   Which random words should be used for a round
+
+    An index is built the first time a domain is used and is then kept up to date from the
+    domain_changed signal, row by row when the change is known. Otherwise, and once
+    WORD_INDEX_TTL has passed (writes made by other processes are only seen then), the index is
+    rebuilt in a background thread while the old one keeps answering. At most one rebuild of a
+    domain's index runs at a time, changes made while it runs queue one more.
+"""
+import logging
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from array import array
+from collections import Counter
+from django.conf import settings
+from django.db import connections
+from utils.trie import Trie
+from .models import Word
+from .shards import DomainShards
+
+
+class DomainIndex(ABC):
+    """
+        Base class holding one index per domain. Subclasses define how an index is created
+        and how a (tag, word) pair is added to or removed from it.
+    """
+
+    _indexes = None     # domain_id -> (index, time built), set per subclass
+    _locks = None       # domain_id -> Lock guarding the index of that domain
+    _locks_lock = None  # Also guards _refreshing and _dirty
+    _refreshing = None  # domain_id -> Thread rebuilding the index of that domain
+    _dirty = None       # domain ids changed while their index was being rebuilt
+
+    logger = logging.getLogger(__name__)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._indexes = {}
+        cls._locks = {}
+        cls._locks_lock = threading.Lock()
+        cls._refreshing = {}
+        cls._dirty = set()
+
+    @classmethod
+    def ttl(cls):
+        return getattr(settings, "WORD_INDEX_TTL", 300)
+
+    @classmethod
+    def _domainLock(cls, domain_id):
+        with cls._locks_lock:
+            lock = cls._locks.get(domain_id, None)
+            if lock == None:
+                lock = threading.Lock()
+                cls._locks[domain_id] = lock
+            return lock
+
+    @classmethod
+    @abstractmethod
+    def newIndex(cls):
+        pass
+
+    @classmethod
+    @abstractmethod
+    def addRow(cls, index, tag, word, signature=None):
+        pass
+
+    @classmethod
+    @abstractmethod
+    def removeRow(cls, index, tag, word):
+        pass
+
+    @classmethod
+    def build(cls, domain_id):
+        index = cls.newIndex()
+        rows = Word.objects.filter(tag__domain_id=domain_id).values_list("tag__text", "text", "signature")
+        for tag, word, signature in rows.iterator(chunk_size=getattr(settings, "SYNC_BATCH_SIZE", 1000)):
+            cls.addRow(index, tag, word, signature)
+        return index
+
+    @classmethod
+    def _get(cls, domain_id):
+        """
+            The index of a domain, built if there is none. An index older than WORD_INDEX_TTL is
+            returned as is and rebuilt in the background. Must be called with the domain lock held.
+        """
+        entry = cls._indexes.get(domain_id, None)
+        if entry == None:
+            with DomainShards.use(domain_id):
+                entry = (cls.build(domain_id), time.monotonic())
+            cls._indexes[domain_id] = entry
+        elif time.monotonic() - entry[1] > cls.ttl():
+            cls.refresh(domain_id, changed=False)
+        return entry[0]
+
+    @classmethod
+    def refresh(cls, domain_id, changed=True):
+        """
+            Rebuilds the index of a domain in a background thread, the current index answering
+            until the new one is swapped in.
+
+            @param  {bool}  changed     The domain was changed, a rebuild already running is run
+                                        once more when it finishes as it may have read the rows
+                                        before the change
+        """
+        with cls._locks_lock:
+            if domain_id in cls._refreshing:
+                if changed:
+                    cls._dirty.add(domain_id)
+                return
+            thread = threading.Thread(target=cls._refreshLoop, args=(domain_id,), name=f"wordtag-index-{cls.__name__}-{domain_id}", daemon=True)
+            cls._refreshing[domain_id] = thread
+        thread.start()
+
+    @classmethod
+    def _refreshLoop(cls, domain_id):
+        try:
+            while True:
+                with DomainShards.use(domain_id):
+                    index = cls.build(domain_id)
+                with cls._domainLock(domain_id):
+                    # An index dropped by invalidate stays dropped
+                    if domain_id in cls._indexes:
+                        cls._indexes[domain_id] = (index, time.monotonic())
+                with cls._locks_lock:
+                    if domain_id not in cls._dirty:
+                        cls._refreshing.pop(domain_id, None)
+                        return
+                    cls._dirty.discard(domain_id)
+        except Exception as e:
+            # The old index keeps answering, the next expiry or change tries again
+            cls.logger.error("Could not rebuild the %s of domain %s: %s", cls.__name__, domain_id, e)
+            with cls._locks_lock:
+                cls._refreshing.pop(domain_id, None)
+                cls._dirty.discard(domain_id)
+        finally:
+            for conn in connections.all(initialized_only=True):
+                conn.close()
+
+    @classmethod
+    def warm(cls, domain_id):
+        """
+            Builds the index of a domain ahead of its first use
+        """
+        with cls._domainLock(domain_id):
+            cls._get(domain_id)
+
+    @classmethod
+    def invalidate(cls, domain_id=None):
+        if domain_id == None:
+            cls._indexes.clear()
+        else:
+            with cls._domainLock(domain_id):
+                cls._indexes.pop(domain_id, None)
+
+    @classmethod
+    def onDomainChanged(cls, sender, domain_id, added=None, removed=None, **kwargs):
+        """
+            Receiver for the domain_changed signal
+        """
+        with cls._domainLock(domain_id):
+            entry = cls._indexes.get(domain_id, None)
+            if entry == None:
+                return
+            if added == None and removed == None:
+                cls.refresh(domain_id)
+                return
+            for tag, word in removed or []:
+                cls.removeRow(entry[0], tag, word)
+            for tag, word in added or []:
+                cls.addRow(entry[0], tag, word)
+        with cls._locks_lock:
+            if domain_id in cls._refreshing:
+                cls._dirty.add(domain_id)
+
+
+class DomainTrieIndex(DomainIndex):
+
+    @classmethod
+    def newIndex(cls):
+        return Trie()
+
+    @classmethod
+    def addRow(cls, index, tag, word, signature=None):
+        index.add(tag, word)
+
+    @classmethod
+    def removeRow(cls, index, tag, word):
+        index.remove(tag, word)
+
+    @classmethod
+    def validate(cls, domain_id, word, tag=None):
+        """
+            @return {set}   The tags the word belongs to, limited to tag when it is given.
+                            Empty if the word is not valid.
+        """
+        with cls._domainLock(domain_id):
+            tags = cls._get(domain_id).tags(word)
+        if tag != None:
+            tags = tags & {tag}
+        return tags
+
+    @classmethod
+    def complete(cls, domain_id, prefix, tag=None, limit=20):
+        with cls._domainLock(domain_id):
+            return cls._get(domain_id).complete(prefix, tag, limit)
+
+
+class AnagramIndex:
+    """
+        Words grouped by their sorted letter signature (see Word.signatureOf), with the letter
+        counts of each signature kept alongside for racks too large to enumerate.
+    """
+
+    __slots__ = ("words", "counts")
+
+    def __init__(self):
+        self.words = {}     # signature -> {word: set of tags}
+        self.counts = {}    # signature -> Counter of its letters
+
+
+class DomainAnagramIndex(DomainIndex):
+
+    # Racks with more sub-multisets than this are answered by scanning the signatures instead
+    max_subsets = 4096
+
+    @classmethod
+    def newIndex(cls):
+        return AnagramIndex()
+
+    @classmethod
+    def addRow(cls, index, tag, word, signature=None):
+        if not signature:
+            signature = Word.signatureOf(word)
+        if len(signature) == 0:
+            return
+        words = index.words.get(signature, None)
+        if words == None:
+            words = {}
+            index.words[signature] = words
+            index.counts[signature] = Counter(signature)
+        words.setdefault(word, set()).add(tag)
+
+    @classmethod
+    def removeRow(cls, index, tag, word):
+        signature = Word.signatureOf(word)
+        words = index.words.get(signature, None)
+        if words == None or word not in words:
+            return
+        words[word].discard(tag)
+        if len(words[word]) == 0:
+            del words[word]
+        if len(words) == 0:
+            del index.words[signature]
+            del index.counts[signature]
+
+    @classmethod
+    def subSignatures(cls, rack_counts, min_length):
+        """
+            Every sorted signature that can be made from a subset of the rack
+        """
+        letters = sorted(rack_counts.items())
+        ret = []
+        def walk(i, cur):
+            if i == len(letters):
+                if len(cur) >= min_length:
+                    ret.append("".join(cur))
+                return
+            letter, count = letters[i]
+            for n in range(count + 1):
+                walk(i + 1, cur + [letter] * n)
+        walk(0, [])
+        return ret
+
+    @classmethod
+    def formable(cls, domain_id, letters, tag=None, min_length=1, limit=None):
+        """
+            Words of a domain that can be spelled with the given letters, each letter used at most
+            as many times as it appears. Longest words first.
+
+            @return {list}  Dicts with the word and the tags it belongs to
+        """
+        rack_counts = Counter(Word.signatureOf(letters))
+        min_length = max(int(min_length), 1)
+        subsets = 1
+        for count in rack_counts.values():
+            subsets *= count + 1
+        found = []
+        with cls._domainLock(domain_id):
+            index = cls._get(domain_id)
+            if subsets <= cls.max_subsets:
+                signatures = [sig for sig in cls.subSignatures(rack_counts, min_length) if sig in index.words]
+            else:
+                signatures = [
+                    sig for sig, counts in index.counts.items()
+                    if len(sig) >= min_length and all(rack_counts[letter] >= n for letter, n in counts.items())
+                ]
+            for sig in signatures:
+                for word, tags in index.words[sig].items():
+                    if tag == None or tag in tags:
+                        found.append({"word": word, "tags": sorted(tags)})
+        found.sort(key=lambda cur: (-len(cur["word"]), cur["word"]))
+        if limit != None:
+            found = found[:limit]
+        return found
+
+
+class SampleIndex:
+    """
+        Dense arrays of the Word ids of a domain, one for the whole domain and one per tag
+    """
+
+    __slots__ = ("ids", "tag_ids")
+
+    def __init__(self):
+        self.ids = array("q")
+        self.tag_ids = {}   # tag -> array of ids
+
+
+class DomainSampleIndex(DomainIndex):
+    """
+        Draws random words for game rounds in O(N) from cached id arrays, instead of running
+        ORDER BY RANDOM() over the whole domain.
+
+        The arrays hold ids, which the domain_changed signal does not carry, so any change to
+        a domain rebuilds its arrays in the background. Until then draws of deleted ids are
+        retried and the added words are not drawn.
+    """
+
+    # Draws are retried this many times when ids turn out to be excluded or already deleted
+    max_rounds = 3
+
+    _random = random.Random()
+
+    @classmethod
+    def newIndex(cls):
+        return SampleIndex()
+
+    @classmethod
+    def build(cls, domain_id):
+        index = cls.newIndex()
+        rows = Word.objects.filter(tag__domain_id=domain_id).order_by("id").values_list("id", "tag__text")
+        for word_id, tag in rows.iterator(chunk_size=getattr(settings, "SYNC_BATCH_SIZE", 1000)):
+            index.ids.append(word_id)
+            tag_ids = index.tag_ids.get(tag, None)
+            if tag_ids == None:
+                tag_ids = array("q")
+                index.tag_ids[tag] = tag_ids
+            tag_ids.append(word_id)
+        return index
+
+    @classmethod
+    def addRow(cls, index, tag, word, signature=None):
+        pass
+
+    @classmethod
+    def removeRow(cls, index, tag, word):
+        pass
+
+    @classmethod
+    def onDomainChanged(cls, sender, domain_id, added=None, removed=None, **kwargs):
+        with cls._domainLock(domain_id):
+            if domain_id in cls._indexes:
+                cls.refresh(domain_id)
+
+    @classmethod
+    def draw(cls, ids, count, exclude):
+        """
+            Picks up to count distinct ids that are not in exclude, by rejection sampling when the
+            exclusions are a small part of ids and by filtering otherwise.
+        """
+        if count <= 0 or len(ids) == 0:
+            return []
+        if len(exclude) * 2 >= len(ids) or count * 2 >= len(ids):
+            candidates = [word_id for word_id in ids if word_id not in exclude]
+            return cls._random.sample(candidates, min(count, len(candidates)))
+        chosen = set()
+        attempts = 0
+        while len(chosen) < count and attempts < count * 10:
+            word_id = ids[cls._random.randrange(len(ids))]
+            attempts += 1
+            if word_id not in exclude:
+                chosen.add(word_id)
+        return list(chosen)
+
+    @classmethod
+    def sample(cls, domain_id, count, tag=None, exclude=None):
+        """
+            Random words of a domain.
+
+            @param  {int}   domain_id   The domain to draw from
+            @param  {int}   count   The number of words wanted
+            @param  {str}   tag     Optionally only draw from a tag
+            @param  {set}   exclude Word ids not to return, such as recently served words
+
+            @return {list}  Dicts with the id, tag, word and details of each word
+        """
+        exclude = set(exclude or [])
+        with cls._domainLock(domain_id):
+            index = cls._get(domain_id)
+            ids = index.ids if tag == None else index.tag_ids.get(tag, array("q"))
+        ret = []
+        for _ in range(cls.max_rounds):
+            drawn = cls.draw(ids, count - len(ret), exclude)
+            if len(drawn) == 0:
+                break
+            rows = Word.objects.filter(id__in=drawn, tag__domain_id=domain_id).values_list("id", "tag__text", "text", "details")
+            for word_id, tag_text, text, details in rows:
+                ret.append({"id": word_id, "tag": tag_text, "word": text, "details": details})
+            if len(ret) >= count:
+                break
+            # Some ids were deleted by another process, leave them out of the next round
+            exclude.update(drawn)
+        return ret